@@ -0,0 +1,189 @@
+"""
+Benchmark of flow transformation on the fixture flows comparing the original
+per key flattening with FlowTransformer.
+
+    python benchmarks/bench_flow_transformer.py [repeats]
+
+"""
+
+import sys
+from os.path import join
+from time import perf_counter
+
+from hdx.location.country import Country
+from hdx.utilities.dictandlist import dict_of_lists_add
+from hdx.utilities.loader import load_json, load_yaml
+from hdx.utilities.matching import multiple_replace
+
+from hdx.scraper.fts.flow_transformer import FlowTransformer
+from hdx.scraper.fts.locations import Locations
+
+input_dir = join("tests", "fixtures", "input")
+config_path = join(
+    "src", "hdx", "scraper", "fts", "config", "project_configuration.yaml"
+)
+
+
+class FixtureDownloader:
+    def download(self, partial_url):
+        return load_json(join(input_dir, "1-public-location.json"))["data"]
+
+
+def load_flows():
+    flows = []
+    for locationid in (1, 114, 171):
+        for suffix in ("", "-page-2", "-page-3"):
+            filename = f"custom-search-locationid-{locationid}-year-2020{suffix}.json"
+            flows.extend(load_json(join(input_dir, filename))["data"]["flows"])
+    return flows
+
+
+def legacy_flatten_objects(configuration, locations, objs, shortened, newrow):
+    # Flows.flatten_objects before FlowTransformer
+    objinfo_by_type = {}
+    destPlanId = None
+    for obj in objs:
+        objtype = obj["type"]
+        objinfo = objinfo_by_type.get(objtype, {})
+        for key in obj:
+            if objtype == "Plan" and key == "id":
+                plan_id = obj[key]
+                dict_of_lists_add(objinfo, key, plan_id)
+                if shortened == "dest":
+                    destPlanId = plan_id
+            if key not in ["type", "behavior", "id"]:
+                value = obj[key]
+                if isinstance(value, list):
+                    for element in value:
+                        dict_of_lists_add(objinfo, key, element)
+                else:
+                    dict_of_lists_add(objinfo, key, value)
+        objinfo_by_type[objtype] = objinfo
+    for objtype in objinfo_by_type:
+        prefix = f"{shortened}{objtype}"
+        for key in objinfo_by_type[objtype]:
+            keyname = f"{prefix}{key.capitalize()}"
+            values = objinfo_by_type[objtype][key]
+            replacements = {
+                "OrganizationOrganization": "Organization",
+                "Name": "",
+                "types": "Types",
+                "code": "Code",
+            }
+            keyname = multiple_replace(keyname, replacements)
+            if "UsageYear" in keyname:
+                values = sorted(values)
+                newrow[f"{keyname}Start"] = values[0]
+                outputstr = values[-1]
+                keyname = f"{keyname}End"
+            elif any(
+                x in keyname for x in ["Cluster", "Location", "OrganizationTypes"]
+            ):
+                if keyname[-1] != "s":
+                    keyname = f"{keyname}s"
+                if "Location" in keyname:
+                    iso3s = []
+                    for country in values:
+                        iso3 = locations.get_countryiso_from_name(country)
+                        if iso3:
+                            iso3s.append(iso3)
+                    values = iso3s
+                outputstr = ",".join(sorted(values))
+            else:
+                if len(values) > 1:
+                    outputstr = "Multiple"
+                else:
+                    outputstr = values[0]
+            if keyname in configuration["country_all_columns_to_keep"]:
+                newrow[keyname] = outputstr
+    return destPlanId
+
+
+def legacy_flatten_flow(configuration, locations, planidcodemapping, row):
+    # Row loop of Flows.generate_country_resources before FlowTransformer
+    srcdestmap = {"sourceObjects": "src", "destinationObjects": "dest"}
+    newrow = {}
+    destPlanId = None
+    for key in row:
+        if key == "reportDetails":
+            continue
+        value = row[key]
+        shortened = srcdestmap.get(key)
+        if shortened:
+            newdestPlanId = legacy_flatten_objects(
+                configuration, locations, value, shortened, newrow
+            )
+            if newdestPlanId:
+                destPlanId = int(newdestPlanId)
+            continue
+        if key == "keywords":
+            if value:
+                newrow[key] = ",".join(value)
+            else:
+                newrow[key] = ""
+            continue
+        if key in [
+            "date",
+            "firstReportedDate",
+            "decisionDate",
+            "createdAt",
+            "updatedAt",
+        ]:
+            if value:
+                newrow[key] = value[:10]
+            else:
+                newrow[key] = ""
+            continue
+        renamed_column = configuration["rename_columns"].get(key)
+        if renamed_column:
+            newrow[renamed_column] = value
+            continue
+        if key in configuration["country_all_columns_to_keep"]:
+            newrow[key] = value
+    if "originalAmount" not in newrow:
+        newrow["originalAmount"] = ""
+    if "originalCurrency" not in newrow:
+        newrow["originalCurrency"] = ""
+    if "refCode" not in newrow:
+        newrow["refCode"] = ""
+    newrow["destPlanCode"] = planidcodemapping.get(destPlanId, "")
+    return newrow
+
+
+def time_rows_per_second(function, flows, repeats):
+    start = perf_counter()
+    for _ in range(repeats):
+        rows = [function(flow) for flow in flows]
+    elapsed = perf_counter() - start
+    return rows, len(flows) * repeats / elapsed
+
+
+def main(repeats=5):
+    Country.countriesdata(use_live=False)
+    configuration = load_yaml(config_path)
+    locations = Locations(FixtureDownloader())
+    planidcodemapping = {}
+    flows = load_flows()
+
+    legacy_rows, legacy_rate = time_rows_per_second(
+        lambda flow: legacy_flatten_flow(
+            configuration, locations, planidcodemapping, flow
+        ),
+        flows,
+        repeats,
+    )
+    transformer = FlowTransformer(configuration, locations, planidcodemapping)
+    rows, rate = time_rows_per_second(transformer.transform, flows, repeats)
+    if rows != legacy_rows:
+        raise ValueError("FlowTransformer output differs from original!")
+    print(f"{len(flows)} fixture flows x {repeats}")
+    print(f"Before (per key flattening): {legacy_rate:,.0f} rows/sec")
+    print(f"After (FlowTransformer):     {rate:,.0f} rows/sec")
+    print(f"Speed up: {rate / legacy_rate:.1f}x")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
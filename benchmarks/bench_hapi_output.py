@@ -0,0 +1,227 @@
+"""
+Benchmark of HAPI row validation and transformation on synthetic global
+requirements and funding rows comparing the original list based duplicate
+checks and per row lookups with HAPIOutput.iterate_rows. As the original is
+quadratic, it is only run on the first legacy_rows rows where the outputs and
+error messages are also checked to be identical.
+
+    python benchmarks/bench_hapi_output.py [rows] [legacy_rows]
+
+"""
+
+import random
+import sys
+from os.path import join
+from time import perf_counter
+
+from hdx.api.configuration import Configuration
+from hdx.data.dataset import Dataset
+from hdx.data.resource import Resource
+from hdx.location.country import Country
+from hdx.utilities.dateparse import (
+    iso_string_from_datetime,
+    parse_date,
+    parse_date_range,
+)
+from hdx.utilities.useragent import UserAgent
+
+from hdx.scraper.fts.hapi_output import HAPIOutput
+
+config_path = join(
+    "src", "hdx", "scraper", "fts", "config", "project_configuration.yaml"
+)
+
+
+class MessageRecorder:
+    def __init__(self):
+        self.messages = []
+
+    def add_message(self, *args, **kwargs):
+        self.messages.append((args, kwargs))
+
+
+def generate_rows(no_rows, seed=1):
+    rng = random.Random(seed)
+    countryiso3s = [country for country in Country.countriesdata()["countries"]][:200]
+    rows = []
+    for i in range(no_rows):
+        countryiso3 = rng.choice(countryiso3s)
+        year = rng.randint(2000, 2025)
+        if rng.random() < 0.8:
+            code = f"H{countryiso3}{i}"
+            startdate = f"{year}-01-01"
+            enddate = f"{year}-12-31"
+            if rng.random() < 0.01:
+                startdate, enddate = enddate, startdate
+        else:
+            code = ""
+            startdate = enddate = ""
+        if rng.random() < 0.01 and rows:
+            rows.append(dict(rows[-1]))
+            continue
+        requirements = rng.randint(0, 10**9)
+        funding = rng.randint(-(10**6), 10**9)
+        rows.append(
+            {
+                "countryCode": countryiso3,
+                "id": i,
+                "name": f"Plan {i}",
+                "code": code,
+                "typeId": 1,
+                "typeName": "Humanitarian response plan",
+                "startDate": startdate,
+                "endDate": enddate,
+                "year": year,
+                "requirements": requirements,
+                "funding": funding,
+                "percentFunded": rng.randint(0, 100),
+            }
+        )
+    return rows
+
+
+def legacy_transform(
+    error_handler, rows, dataset_id, dataset_name, resource_id, resource_name
+):
+    # Row loop of HAPIOutput.generate_dataset before it was rewritten
+    global_data = []
+    duplicate_checks = []
+    start_dates = []
+    for row in rows:
+        countryiso3 = row["countryCode"]
+        errors = []
+        hapi_row = {"location_code": countryiso3}
+        hapi_row["has_hrp"] = (
+            "Y" if Country.get_hrp_status_from_iso3(countryiso3) else "N"
+        )
+        hapi_row["in_gho"] = (
+            "Y" if Country.get_gho_status_from_iso3(countryiso3) else "N"
+        )
+
+        appeal_code = row.get("code")
+        if not appeal_code:
+            appeal_code = "Not specified"
+        hapi_row["appeal_code"] = appeal_code
+
+        hapi_row["appeal_name"] = row.get("name")
+        hapi_row["appeal_type"] = row.get("typeName")
+        hapi_row["requirements_usd"] = row.get("requirements")
+
+        funding = row.get("funding")
+        if not funding:
+            funding = 0
+        if funding < 0:
+            error_handler.add_message(
+                "Funding",
+                dataset_name,
+                f"Negative funding value found for {countryiso3}",
+                resource_name=resource_name,
+                err_to_hdx=True,
+            )
+            errors.append("Negative funding value")
+        hapi_row["funding_usd"] = funding
+
+        funding_pct = row.get("percentFunded")
+        if not funding_pct and row.get("requirements"):
+            funding_pct = 0
+        hapi_row["funding_pct"] = funding_pct
+
+        if row.get("startDate"):
+            start_date = parse_date(row["startDate"])
+            end_date = parse_date(row["endDate"])
+            if start_date > end_date:
+                error_handler.add_message(
+                    "Funding",
+                    dataset_name,
+                    f"Start date occurs after end date for {countryiso3}",
+                    resource_name=resource_name,
+                    err_to_hdx=True,
+                )
+                errors.append("Start date occurs after end date")
+        else:
+            start_date, end_date = parse_date_range(str(row["year"]))
+        start_dates.append(start_date)
+        hapi_row["reference_period_start"] = iso_string_from_datetime(start_date)
+        hapi_row["reference_period_end"] = iso_string_from_datetime(end_date)
+
+        hapi_row["dataset_hdx_id"] = dataset_id
+        hapi_row["resource_hdx_id"] = resource_id
+
+        duplicate_check = (countryiso3, hapi_row["appeal_code"], start_date)
+        if duplicate_check in duplicate_checks:
+            error_handler.add_message(
+                "Funding",
+                dataset_name,
+                f"Duplicate row found for {countryiso3}",
+                resource_name=resource_name,
+                err_to_hdx=True,
+            )
+            errors.append("Duplicate row")
+        else:
+            duplicate_checks.append(duplicate_check)
+
+        hapi_row["warning"] = ""  # We have no warnings at present
+        hapi_row["error"] = "|".join(errors)
+        global_data.append(hapi_row)
+    return global_data, min(start_dates)
+
+
+def run_hapi_output(configuration, global_results, rows):
+    error_handler = MessageRecorder()
+    hapi_output = HAPIOutput(configuration, error_handler, global_results, None, None)
+    hapi_output.set_global_resource()
+    start = perf_counter()
+    hapi_rows = list(hapi_output.iterate_rows(rows))
+    elapsed = perf_counter() - start
+    return hapi_rows, hapi_output.start_date, error_handler.messages, elapsed
+
+
+def main(no_rows=100000, legacy_rows=20000):
+    UserAgent.set_global("benchmark")
+    Configuration._create(
+        hdx_read_only=True, hdx_site="prod", project_config_yaml=config_path
+    )
+    configuration = Configuration.read()
+    Country.countriesdata(use_live=False)
+    global_dataset = Dataset(
+        {"name": "global-requirements-and-funding-data", "id": "1234"}
+    )
+    resource_name = "fts_requirements_funding_global.csv"
+    global_dataset.add_update_resource(
+        Resource({"name": resource_name, "id": "5678", "format": "csv"})
+    )
+    global_results = {"dataset": global_dataset, "resource": {"name": resource_name}}
+    rows = generate_rows(no_rows)
+
+    legacy_rows = min(legacy_rows, no_rows)
+    error_handler = MessageRecorder()
+    start = perf_counter()
+    expected_rows, expected_start_date = legacy_transform(
+        error_handler,
+        rows[:legacy_rows],
+        "1234",
+        global_dataset["name"],
+        "5678",
+        resource_name,
+    )
+    legacy_elapsed = perf_counter() - start
+    hapi_rows, start_date, messages, elapsed = run_hapi_output(
+        configuration, global_results, rows[:legacy_rows]
+    )
+    if (
+        hapi_rows != expected_rows
+        or start_date != expected_start_date
+        or messages != error_handler.messages
+    ):
+        raise ValueError("HAPIOutput output differs from original!")
+    print(f"{legacy_rows} rows ({len(messages)} error messages):")
+    print(f"  Before (list duplicate checks): {legacy_elapsed:.2f}s")
+    print(f"  After (HAPIOutput.iterate_rows): {elapsed:.2f}s")
+
+    _, _, messages, elapsed = run_hapi_output(configuration, global_results, rows)
+    print(f"{no_rows} rows ({len(messages)} error messages):")
+    print(f"  After (HAPIOutput.iterate_rows): {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,463 @@
+"""
+Scaling benchmark of the whole pipeline on synthetic FTS data. The synthetic
+responses are put in a ResponseCache so that FTSDownload serves them without
+any network access and every stage (Locations, Pipeline set up, country
+datasets, global datasets and the HAPI output) runs on them as in a real run.
+
+For each stage, wall time, peak traced memory and output rows per second are
+measured. Memory is traced in a second run so that it does not slow down the
+timed run. Within stages, the (exclusive) time spent in each component is
+measured too. Results are compared with the stored baseline for the same
+scale in benchmarks/baseline_pipeline.json and any stage or component that is
+slower or uses more memory than the baseline by more than the tolerance (or
+whose row count has changed) is flagged as a regression and the exit status
+is 1. Timings depend on the machine so the baseline is not kept in git: the
+first run of a scale on a machine saves its results as the baseline and
+--save-baseline replaces it, for example before starting on a change.
+
+    python benchmarks/bench_pipeline.py [--scale small|medium|full]
+        [--countries N] [--years N] [--flows N] [--seed N] [--global-flows]
+        [--no-memory] [--tolerance 0.25] [--save-baseline] [--output path]
+        [--server] [--latency s] [--jitter s] [--error-rate p]
+        [--throttle-rate p] [--calls-per-sec n]
+
+With --server, the responses are served over HTTP by the stand-in FTS server
+in tests/fts_server.py with the given per request latency and rates of 5xx
+and 429 responses and FTSDownload uses the configured rate limit (or
+--calls-per-sec) and concurrency as in a real run. Request counts and timings per endpoint are
+printed at the end. In both cases, the per endpoint figures recorded by
+FTSDownload are printed and included in the results.
+
+The benchmark imports hdx.scraper.fts so the package must be installed (eg.
+pip install -e .) or src put on the path (PYTHONPATH=src) and it must be run
+from the root of the repository as it reads the configuration from src.
+
+"""
+
+import argparse
+import sys
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from csv import reader
+from fnmatch import fnmatch
+from json import dump, load
+from os import listdir
+from os.path import abspath, dirname, exists, join
+from time import perf_counter
+
+from hdx.api.configuration import Configuration
+from hdx.api.locations import Locations as HDXLocations
+from hdx.api.utilities.hdx_error_handler import HDXErrorHandler
+from hdx.data.dataset import Dataset
+from hdx.data.vocabulary import Vocabulary
+from hdx.location.country import Country
+from hdx.utilities.dateparse import parse_date
+from hdx.utilities.downloader import Download
+from hdx.utilities.path import temp_dir
+from hdx.utilities.useragent import UserAgent
+from synthetic_fts import SyntheticFTS, scales
+
+from hdx.scraper.fts.download import FTSDownload
+from hdx.scraper.fts.flows import Flows
+from hdx.scraper.fts.hapi_output import HAPIOutput
+from hdx.scraper.fts.locations import Locations
+from hdx.scraper.fts.pipeline import Pipeline
+from hdx.scraper.fts.requirements_funding import RequirementsFunding
+from hdx.scraper.fts.requirements_funding_cluster import RequirementsFundingCluster
+from hdx.scraper.fts.requirements_funding_covid import RequirementsFundingCovid
+from hdx.scraper.fts.response_cache import ResponseCache
+
+# The stand-in FTS server lives with the tests
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from tests.fts_server import FTSServer  # noqa: E402
+
+config_path = join(
+    "src", "hdx", "scraper", "fts", "config", "project_configuration.yaml"
+)
+baseline_path = join(dirname(__file__), "baseline_pipeline.json")
+
+# Component timers: (class, method, component)
+components = (
+    (Pipeline, "get_plans", "plans"),
+    (RequirementsFundingCovid, "_get_covid_funding", "covid_funding"),
+    (Pipeline, "prefetch_cluster_data", "cluster_prefetch"),
+    (Flows, "generate_country_resources", "flows"),
+    (Flows, "generate_global_resources", "flows"),
+    (RequirementsFunding, "generate_country_resource", "requirements_funding"),
+    (RequirementsFunding, "generate_global_resource", "requirements_funding"),
+    (RequirementsFundingCluster, "generate_rows_requirements_funding", "cluster"),
+    (RequirementsFundingCluster, "generate_plan_requirements_funding", "cluster"),
+    (RequirementsFundingCluster, "generate_country_resource", "cluster"),
+    (RequirementsFundingCluster, "generate_global_resource", "cluster"),
+    (RequirementsFundingCovid, "generate_plan_funding", "covid"),
+    (RequirementsFundingCovid, "generate_country_resource", "covid"),
+    (RequirementsFundingCovid, "generate_global_resource", "covid"),
+    (HAPIOutput, "generate_dataset", "hapi"),
+)
+
+# Output files counted as the rows of each stage and component
+stage_files = {
+    "countries": ("fts_*_???.csv",),
+    "global": ("fts_*_global.csv",),
+    "hapi": ("hdx_hapi_*.csv",),
+}
+component_files = {
+    "flows": ("fts_incoming_*.csv", "fts_outgoing_*.csv", "fts_internal_*.csv"),
+    "requirements_funding": ("fts_requirements_funding_???.csv",),
+    "cluster": ("fts_requirements_funding_*cluster_*.csv",),
+    "covid": ("fts_requirements_funding_covid_*.csv",),
+    "hapi": ("hdx_hapi_*.csv",),
+}
+
+
+class Timers:
+    """Exclusive time per component of methods that may call each other"""
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self._stack = []
+
+    def wrap(self, method, component):
+        def timed(*args, **kwargs):
+            self._stack.append(0.0)
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                child_time = self._stack.pop()
+                if self._stack:
+                    self._stack[-1] += elapsed
+                self.seconds[component] = (
+                    self.seconds.get(component, 0.0) + elapsed - child_time
+                )
+                self.calls[component] = self.calls.get(component, 0) + 1
+
+        return timed
+
+    @contextmanager
+    def install(self):
+        originals = []
+        for cls, name, component in components:
+            originals.append((cls, name, cls.__dict__.get(name)))
+            setattr(cls, name, self.wrap(getattr(cls, name), component))
+        try:
+            yield self
+        finally:
+            for cls, name, method in originals:
+                if method is None:
+                    delattr(cls, name)
+                else:
+                    setattr(cls, name, method)
+
+
+class Stages:
+    def __init__(self, track_memory=True):
+        self._track_memory = track_memory
+        self.results = {}
+
+    @contextmanager
+    def measure(self, stage):
+        if self._track_memory:
+            tracemalloc.start()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            result = {"seconds": perf_counter() - start}
+            if self._track_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                result["peak_mb"] = peak / (1024 * 1024)
+            self.results[stage] = result
+
+
+def count_rows(folder, patterns):
+    rows = 0
+    for filename in listdir(folder):
+        if not any(fnmatch(filename, pattern) for pattern in patterns):
+            continue
+        with open(join(folder, filename), encoding="utf-8-sig") as file:
+            rows += sum(1 for _ in reader(file)) - 1
+    return rows
+
+
+def add_rows(results, folder, files):
+    for name, patterns in files.items():
+        result = results.get(name)
+        if result is None:
+            continue
+        rows = count_rows(folder, patterns)
+        result["rows"] = rows
+        if result["seconds"]:
+            result["rows_per_sec"] = rows / result["seconds"]
+
+
+def print_server_stats(server):
+    print("Server requests:")
+    for endpoint, stats in sorted(server.endpoints.items()):
+        print(
+            f"  {endpoint:<22}{stats['requests']:>7} requests{stats['failures']:>5} failures{stats['seconds']:>9.2f}s"
+        )
+    print(f"  Responses by status: {dict(sorted(server.statuses.items()))}")
+
+
+def run(
+    synthetic,
+    global_flows=False,
+    track_memory=False,
+    server_options=None,
+    rate_limit=None,
+):
+    today = parse_date(f"{synthetic.latest_year}-12-31")
+    configuration = Configuration.read()
+    stages = Stages(track_memory)
+    timers = Timers()
+    with temp_dir("FTS-BENCHMARK") as folder, ExitStack() as stack:
+        if server_options is None:
+            ttl = 10 * 365 * 24 * 3600
+            cache = ResponseCache(
+                join(folder, "synthetic.sqlite"),
+                today.year,
+                current_year_ttl=ttl,
+                closed_year_ttl=ttl,
+                default_ttl=ttl,
+                max_size=1024**4,
+            )
+            stack.callback(cache.close)
+            rate_limit = None
+            no_responses, size = synthetic.fill_cache(
+                cache, configuration["base_url"], global_flows
+            )
+        else:
+            server = stack.enter_context(FTSServer(**server_options))
+            stack.callback(print_server_stats, server)
+            no_responses = size = 0
+            for partial_url, body in synthetic.iterate_responses(
+                server.url, global_flows
+            ):
+                server.add_response(partial_url, body)
+                no_responses += 1
+                size += len(body)
+            configuration = dict(configuration)
+            configuration["base_url"] = server.url
+            cache = None
+            if rate_limit is None:
+                rate_limit = configuration["rate_limit"]
+        print(f"Generated {no_responses} responses ({size / 1024 / 1024:.1f}MB)")
+        with Download(user_agent="benchmark") as downloader, timers.install():
+            ftsdownloader = FTSDownload(
+                configuration,
+                downloader,
+                rate_limit=rate_limit,
+                max_concurrent=configuration["max_concurrent"],
+                cache=cache,
+            )
+            with stages.measure("locations"):
+                locations = Locations(ftsdownloader)
+            with stages.measure("pipeline_setup"):
+                pipeline = Pipeline(
+                    configuration,
+                    ftsdownloader,
+                    folder,
+                    locations,
+                    today,
+                    start_year=synthetic.latest_year - synthetic.no_years,
+                    global_flows=global_flows,
+                )
+            with stages.measure("countries"):
+                for country in locations.countries:
+                    dataset = Dataset(
+                        {"name": f"{country['iso3'].lower()}-funding-benchmark"}
+                    )
+                    pipeline.generate_country_dataset_and_showcase(country, dataset)
+            with stages.measure("global"):
+                global_dataset = Dataset({"name": "global-funding-benchmark"})
+                global_results = pipeline.generate_global_dataset(global_dataset)
+            global_results["dataset"]["id"] = "1234"
+            global_results["resource"]["id"] = "5678"
+            with HDXErrorHandler(write_to_hdx=False) as error_handler:
+                with stages.measure("hapi"):
+                    HAPIOutput(
+                        configuration, error_handler, global_results, today, folder
+                    ).generate_dataset()
+        add_rows(stages.results, folder, stage_files)
+        component_results = {
+            component: {"seconds": seconds, "calls": timers.calls[component]}
+            for component, seconds in timers.seconds.items()
+        }
+        add_rows(component_results, folder, component_files)
+    return {
+        "stages": stages.results,
+        "components": component_results,
+        "downloads": ftsdownloader.get_stats().get_report(),
+    }
+
+
+def compare(results, baseline, tolerance, min_seconds=0.05):
+    regressions = []
+    for section in ("stages", "components"):
+        for name, result in results[section].items():
+            expected = baseline[section].get(name)
+            if expected is None:
+                continue
+            seconds = result["seconds"]
+            expected_seconds = expected["seconds"]
+            if (
+                seconds > expected_seconds * (1 + tolerance)
+                and seconds - expected_seconds > min_seconds
+            ):
+                regressions.append(
+                    f"{name}: {seconds:.2f}s vs baseline {expected_seconds:.2f}s"
+                )
+            peak_mb = result.get("peak_mb")
+            expected_peak_mb = expected.get("peak_mb")
+            if peak_mb and expected_peak_mb:
+                if peak_mb > expected_peak_mb * (1 + tolerance):
+                    regressions.append(
+                        f"{name}: peak {peak_mb:.1f}MB vs baseline {expected_peak_mb:.1f}MB"
+                    )
+            rows = result.get("rows")
+            expected_rows = expected.get("rows")
+            if rows is not None and expected_rows is not None and rows != expected_rows:
+                regressions.append(f"{name}: {rows} rows vs baseline {expected_rows}")
+    return regressions
+
+
+def print_results(results):
+    for section in ("stages", "components"):
+        print(f"{section.capitalize()}:")
+        for name, result in results[section].items():
+            line = f"  {name:<22}{result['seconds']:>9.2f}s"
+            if "peak_mb" in result:
+                line = f"{line}{result['peak_mb']:>10.1f}MB"
+            if "rows" in result:
+                line = f"{line}{result['rows']:>10} rows"
+            if "rows_per_sec" in result:
+                line = f"{line}{result['rows_per_sec']:>12.0f} rows/s"
+            print(line)
+    print("Downloads:")
+    for endpoint, figures in results["downloads"].items():
+        print(
+            f"  {endpoint:<22}{figures['requests']:>7} requests{figures['cached']:>7} cached{figures['failures']:>5} failures{figures['seconds']:>9.2f}s{figures['rate_limit_wait']:>9.2f}s waiting"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline scaling benchmark")
+    parser.add_argument("--scale", default="small", choices=sorted(scales))
+    parser.add_argument("--countries", type=int, default=None)
+    parser.add_argument("--years", type=int, default=None)
+    parser.add_argument("--flows", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--global-flows", action="store_true")
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--server", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--calls-per-sec", type=float, default=None)
+    args = parser.parse_args()
+
+    parameters = dict(scales[args.scale])
+    if args.countries:
+        parameters["no_countries"] = args.countries
+    if args.years:
+        parameters["no_years"] = args.years
+    if args.flows:
+        parameters["no_flows"] = args.flows
+    key = "-".join(
+        [f"{name}={value}" for name, value in sorted(parameters.items())]
+        + [f"seed={args.seed}", f"global_flows={args.global_flows}"]
+    )
+    if args.server:
+        server_options = {
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "error_rate": args.error_rate,
+            "throttle_rate": args.throttle_rate,
+            "seed": args.seed,
+        }
+        key = "-".join(
+            [key, "server"]
+            + [f"{name}={value}" for name, value in sorted(server_options.items())]
+        )
+        if args.calls_per_sec:
+            rate_limit = {"calls": args.calls_per_sec, "period": 1}
+            key = f"{key}-calls_per_sec={args.calls_per_sec}"
+        else:
+            rate_limit = None
+    else:
+        server_options = None
+        rate_limit = None
+
+    UserAgent.set_global("benchmark")
+    Configuration._create(
+        hdx_read_only=True, hdx_site="prod", project_config_yaml=config_path
+    )
+    Country.countriesdata(use_live=False)
+    # As in the tests, avoid reading locations and approved tags from HDX
+    HDXLocations.set_validlocations([{"name": "world", "title": "World"}])
+    Vocabulary._approved_vocabulary = {
+        "tags": [
+            {"name": tag}
+            for tag in (
+                "funding",
+                "covid-19",
+                "humanitarian financial tracking service-fts",
+            )
+        ],
+        "id": "4e61d464-4943-4e97-973a-84673c1aaa87",
+        "name": "approved",
+    }
+    results = run(
+        SyntheticFTS(**parameters, seed=args.seed),
+        args.global_flows,
+        server_options=server_options,
+        rate_limit=rate_limit,
+    )
+    if not args.no_memory:
+        memory_results = run(
+            SyntheticFTS(**parameters, seed=args.seed),
+            args.global_flows,
+            True,
+            server_options,
+            rate_limit,
+        )
+        for stage, result in memory_results["stages"].items():
+            results["stages"][stage]["peak_mb"] = result["peak_mb"]
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            dump(results, file, indent=2)
+
+    if exists(baseline_path):
+        with open(baseline_path) as file:
+            baselines = load(file)
+    else:
+        baselines = {}
+    baseline = baselines.get(key)
+    if args.save_baseline or baseline is None:
+        baselines[key] = results
+        with open(baseline_path, "w") as file:
+            dump(baselines, file, indent=2, sort_keys=True)
+            file.write("\n")
+        print(f"Saved baseline {key}")
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("Regressions against baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,560 @@
+"""
+Seeded generator of synthetic FTS API responses at configurable scale: the
+location list, plan overviews per year, location, cluster and global cluster
+breakdowns of plans, COVID funding, country funding trends and paged custom
+search flows (per country and global). Responses have the shapes the scraper
+reads from api.hpc.tools and are consistent with each other (eg. every plan
+that the scraper will ask for a breakdown of has one). Country names and
+iso3s come from hdx-python-country so Country.countriesdata must be loaded
+first.
+
+"""
+
+import random
+from json import dumps
+
+from hdx.location.country import Country
+
+scales = {
+    "small": {"no_countries": 20, "no_years": 5, "no_flows": 5000},
+    "medium": {"no_countries": 100, "no_years": 15, "no_flows": 30000},
+    "full": {"no_countries": 250, "no_years": 28, "no_flows": 100000},
+}
+
+plan_types = (
+    (4, "Humanitarian response plan"),
+    (5, "Flash appeal"),
+    (8, "Regional response plan"),
+    (13, "Other"),
+)
+clusters = (
+    (1, "Food Security"),
+    (2, "Health"),
+    (3, "Protection"),
+    (4, "Emergency Shelter and NFI"),
+    (5, "Water Sanitation Hygiene"),
+    (6, "Education"),
+    (7, "Nutrition"),
+    (8, "Logistics"),
+)
+organizations = tuple(
+    (str(1000 + i), f"Organization {i}", organization_type)
+    for i, organization_type in enumerate(
+        ("Government", "NGO", "UN agency", "Pooled fund", "Private organization") * 40
+    )
+)
+flow_statuses = ("paid", "commitment", "pledge")
+currencies = ("USD", "EUR", "CHF", "GBP")
+
+
+class SyntheticFTS:
+    """Generates responses keyed by partial url. covidstartyear must match
+    the one used by RequirementsFundingCovid."""
+
+    def __init__(
+        self,
+        no_countries=20,
+        no_years=5,
+        no_flows=5000,
+        latest_year=2025,
+        flows_per_page=1000,
+        covidstartyear=2020,
+        seed=1,
+    ):
+        self.no_countries = no_countries
+        self.no_years = no_years
+        self.no_flows = no_flows
+        self.latest_year = latest_year
+        self.flows_per_page = flows_per_page
+        self._covidstartyear = covidstartyear
+        self._rng = random.Random(seed)
+        countryiso3s = sorted(Country.countriesdata()["countries"])
+        countryiso3s = sorted(self._rng.sample(countryiso3s, no_countries))
+        self.countries = [
+            {
+                "id": i + 1,
+                "iso3": countryiso3,
+                "name": Country.get_country_name_from_iso3(countryiso3),
+            }
+            for i, countryiso3 in enumerate(countryiso3s)
+        ]
+        self.years = list(range(latest_year, latest_year - no_years, -1))
+        self._plans_by_year = {}
+        self._next_planid = 100
+
+    @classmethod
+    def from_scale(cls, scale, **kwargs):
+        return cls(**scales[scale], **kwargs)
+
+    def get_plan_country(self, country):
+        return {
+            "id": country["id"],
+            "iso3": country["iso3"],
+            "name": country["name"],
+            "adminLevel": 0,
+        }
+
+    def make_plan(self, year, countries, plan_type, customlocationcode=None):
+        rng = self._rng
+        planid = self._next_planid
+        self._next_planid += 1
+        if len(countries) == 1:
+            name = f"{countries[0]['name']} {year}"
+            code = f"H{countries[0]['iso3']}{year % 100:02d}"
+        else:
+            name = f"Regional plan {planid} {year}"
+            code = f"R{planid}{year % 100:02d}"
+        requirements = rng.randint(10**6, 10**9)
+        funding = int(requirements * rng.uniform(0.1, 1.1))
+        plan = {
+            "id": planid,
+            "name": name,
+            "code": code,
+            "startDate": f"{year}-01-01",
+            "endDate": f"{year}-12-31",
+            "customLocationCode": customlocationcode,
+            "countries": [self.get_plan_country(country) for country in countries],
+            "planType": {"id": plan_type[0], "name": plan_type[1]},
+            "usageYears": [{"id": year - 1979, "year": str(year)}],
+            "requirements": {
+                "origRequirements": requirements,
+                "revisedRequirements": requirements,
+            },
+            "funding": {
+                "totalFunding": funding,
+                "progress": round(funding / requirements * 100, 2),
+            },
+        }
+        return plan
+
+    def get_plans(self, year):
+        plans = self._plans_by_year.get(year)
+        if plans is not None:
+            return plans
+        rng = self._rng
+        plans = []
+        for country in self.countries:
+            if rng.random() < 0.7:
+                plan_type = plan_types[rng.randrange(len(plan_types) - 2)]
+                plans.append(self.make_plan(year, [country], plan_type))
+        if self.no_countries > 1:
+            for _ in range(max(1, self.no_countries // 10)):
+                countries = rng.sample(
+                    self.countries, rng.randint(2, min(5, self.no_countries))
+                )
+                plans.append(self.make_plan(year, countries, plan_types[2]))
+            if year >= self._covidstartyear:
+                countries = rng.sample(self.countries, min(10, self.no_countries))
+                plans.append(self.make_plan(year, countries, plan_types[3], "COVD"))
+        self._plans_by_year[year] = plans
+        return plans
+
+    @staticmethod
+    def get_response(data):
+        return {"status": "ok", "data": data}
+
+    def get_breakdown(self, objects, objecttype, total, notspecified=True):
+        rng = self._rng
+        breakdown = []
+        for objectid, name in objects:
+            breakdown.append(
+                {
+                    "type": objecttype,
+                    "direction": "destination",
+                    "id": str(objectid),
+                    "name": name,
+                    "totalFunding": rng.randint(1, max(1, total // len(objects))),
+                }
+            )
+        if notspecified:
+            breakdown.append(
+                {
+                    "type": objecttype,
+                    "direction": "destination",
+                    "name": "Not specified",
+                    "totalFunding": rng.randint(0, max(1, total // 10)),
+                }
+            )
+        return {
+            "fundingTotals": {
+                "total": total,
+                "objects": [
+                    {
+                        "type": objecttype,
+                        "direction": "destination",
+                        "objectsBreakdown": breakdown,
+                        "totalBreakdown": {
+                            "sharedFunding": rng.randint(0, max(1, total // 20))
+                        },
+                    }
+                ],
+            }
+        }
+
+    def get_requirements(self, objects, objecttype, total):
+        rng = self._rng
+        return {
+            "totalRevisedReqs": total,
+            "totalOrigReqs": 0,
+            "objects": [
+                {
+                    "id": objectid,
+                    "name": name,
+                    "objectType": objecttype,
+                    "revisedRequirements": rng.randint(
+                        1, max(1, total // len(objects))
+                    ),
+                }
+                for objectid, name in objects
+            ],
+        }
+
+    def get_location_split(self, plan):
+        total = plan["requirements"]["revisedRequirements"]
+        locations = [(country["id"], country["name"]) for country in plan["countries"]]
+        return {
+            "requirements": self.get_requirements(locations, "Location", total),
+            "report3": self.get_breakdown(
+                locations, "Location", plan["funding"]["totalFunding"]
+            ),
+        }
+
+    def get_cluster_split(self, plan, clusterlevel):
+        rng = self._rng
+        total = plan["requirements"]["revisedRequirements"]
+        plan_clusters = rng.sample(clusters, rng.randint(2, len(clusters)))
+        if clusterlevel:
+            objecttype = "GlobalCluster"
+        else:
+            objecttype = "Cluster"
+            plan_clusters = [
+                (plan["id"] * 100 + clusterid, name)
+                for clusterid, name in plan_clusters
+            ]
+        return {
+            "requirements": self.get_requirements(plan_clusters, objecttype, total),
+            "report3": self.get_breakdown(
+                plan_clusters, objecttype, plan["funding"]["totalFunding"]
+            ),
+        }
+
+    def get_covid_responses(self):
+        rng = self._rng
+        onecountry_planids = set()
+        multiplecountry_plans = {}
+        for year in self.years:
+            if year < self._covidstartyear:
+                continue
+            for plan in self.get_plans(year):
+                if len(plan["countries"]) == 1:
+                    onecountry_planids.add(str(plan["id"]))
+                else:
+                    multiplecountry_plans[str(plan["id"])] = plan
+        responses = {}
+        if onecountry_planids:
+            breakdown = [
+                {
+                    "type": "Plan",
+                    "direction": "destination",
+                    "id": planid,
+                    "totalFunding": rng.randint(1, 10**7),
+                }
+                for planid in sorted(onecountry_planids)
+                if rng.random() < 0.5
+            ]
+            planids = ",".join(sorted(onecountry_planids))
+            responses[
+                f"1/fts/flow/custom-search?emergencyid=911&planid={planids}&groupby=plan"
+            ] = {
+                "report3": {
+                    "fundingTotals": {"objects": [{"objectsBreakdown": breakdown}]}
+                }
+            }
+        for planid, plan in multiplecountry_plans.items():
+            if rng.random() < 0.3:
+                objects = []
+            else:
+                breakdown = [
+                    {
+                        "type": "Location",
+                        "direction": "destination",
+                        "id": str(country["id"]),
+                        "totalFunding": rng.randint(1, 10**6),
+                    }
+                    for country in plan["countries"]
+                ]
+                objects = [{"objectsBreakdown": breakdown}]
+            responses[
+                f"1/fts/flow/custom-search?emergencyid=911&planid={planid}&groupby=location"
+            ] = {"report3": {"fundingTotals": {"objects": objects}}}
+        return responses
+
+    def get_trends(self, country):
+        rng = self._rng
+        responses = {}
+        first_year = self.years[-1]
+        for year in range(self.latest_year + 5, first_year - 16, -11):
+            responses[f"2/country/{country['id']}/summary/trends/{year}"] = [
+                {"year": trend_year, "totalFunding": rng.randint(0, 10**9)}
+                for trend_year in range(year - 5, year + 6)
+                if first_year <= trend_year <= self.latest_year
+            ]
+        return responses
+
+    def get_flow_objects(self, locations, usageyears, plan):
+        rng = self._rng
+        organization = rng.choice(organizations)
+        objects = [
+            {
+                "type": "Organization",
+                "id": organization[0],
+                "name": organization[1],
+                "behavior": "single",
+                "organizationTypes": [organization[2]],
+            }
+        ]
+        if plan:
+            objects.append(
+                {
+                    "type": "Plan",
+                    "id": str(plan["id"]),
+                    "name": plan["name"],
+                    "behavior": "single",
+                }
+            )
+            cluster = rng.choice(clusters)
+            objects.append(
+                {
+                    "type": "GlobalCluster",
+                    "id": str(cluster[0]),
+                    "name": cluster[1],
+                    "behavior": "single",
+                }
+            )
+        if len(locations) > 1:
+            behavior = "shared"
+        else:
+            behavior = "single"
+        for country in locations:
+            objects.append(
+                {
+                    "type": "Location",
+                    "id": str(country["id"]),
+                    "name": country["name"],
+                    "behavior": behavior,
+                }
+            )
+        if len(usageyears) > 1:
+            behavior = "shared"
+        else:
+            behavior = "single"
+        for year in usageyears:
+            objects.append(
+                {
+                    "type": "UsageYear",
+                    "id": str(year - 1979),
+                    "name": str(year),
+                    "behavior": behavior,
+                }
+            )
+        return objects
+
+    @staticmethod
+    def get_location_boundaries(sources, destinations, usageyears, newmoney):
+        """Boundary and onBoundary of a flow in the per location searches of
+        each of its source and destination countries"""
+        boundaries = {}
+        source_ids = {country["id"] for country in sources}
+        for countries, boundary in ((destinations, "incoming"), (sources, "outgoing")):
+            if len(countries) > 1 or len(usageyears) > 1:
+                onboundary = "shared"
+            else:
+                onboundary = "single"
+            for country in countries:
+                locationid = country["id"]
+                if locationid in boundaries:
+                    continue
+                if boundary == "incoming" and locationid in source_ids and not newmoney:
+                    boundaries[locationid] = ("internal", onboundary)
+                else:
+                    boundaries[locationid] = (boundary, onboundary)
+        return boundaries
+
+    def get_flows(self):
+        """Returns the flows and for each, its boundaries in the per location
+        searches"""
+        rng = self._rng
+        year = self.latest_year
+        plans = [plan for plan in self.get_plans(year) if plan["countries"]]
+        flows = []
+        boundaries = []
+        for i in range(self.no_flows):
+            plan = None
+            if plans and rng.random() < 0.6:
+                plan = rng.choice(plans)
+                destinations = plan["countries"]
+            else:
+                destinations = rng.sample(
+                    self.countries, min(rng.choice((1, 1, 1, 2)), self.no_countries)
+                )
+            if rng.random() < 0.1:
+                sources = [rng.choice(self.countries)]
+            else:
+                sources = []
+            usageyears = [year]
+            if rng.random() < 0.1:
+                usageyears.insert(0, year - 1)
+            amount = rng.randint(0, 10**7)
+            currency = rng.choice(currencies)
+            day = f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+            flow = {
+                "id": str(100000 + i),
+                "amountUSD": amount,
+                "budgetYear": str(year),
+                "childFlowIds": None,
+                "contributionType": "financial",
+                "createdAt": f"{day}T10:00:00.000Z",
+                "date": f"{day}T00:00:00Z",
+                "decisionDate": None if rng.random() < 0.5 else f"{day}T00:00:00Z",
+                "description": f"Synthetic flow {i}",
+                "exchangeRate": None if currency == "USD" else 1.1,
+                "firstReportedDate": f"{day}T00:00:00Z",
+                "flowType": "Standard",
+                "keywords": None if rng.random() < 0.8 else ["Multiyear"],
+                "newMoney": rng.random() < 0.5,
+                "method": "Traditional aid",
+                "parentFlowId": None,
+                "status": rng.choice(flow_statuses),
+                "updatedAt": f"{day}T10:00:00.000Z",
+                "versionId": 1,
+                "sourceObjects": self.get_flow_objects(sources, usageyears, None),
+                "destinationObjects": self.get_flow_objects(
+                    destinations, usageyears, plan
+                ),
+                "reportDetails": [
+                    {
+                        "sourceType": "Primary",
+                        "organization": "Synthetic",
+                        "reportChannel": "Email",
+                        "date": f"{day}T00:00:00.000Z",
+                    }
+                ],
+            }
+            if currency != "USD":
+                flow["originalAmount"] = int(amount / 1.1)
+                flow["originalCurrency"] = currency
+            if rng.random() < 0.8:
+                flow["refCode"] = f"REF-{i}"
+            flows.append(flow)
+            boundaries.append(
+                self.get_location_boundaries(
+                    sources, destinations, usageyears, flow["newMoney"]
+                )
+            )
+        return flows, boundaries
+
+    def get_flow_pages(self, base_url, query, flows):
+        partial_url = f"1/fts/flow/custom-search?{query}"
+        responses = {}
+        no_pages = max(1, -(-len(flows) // self.flows_per_page))
+        for page in range(no_pages):
+            if page == 0:
+                page_url = partial_url
+            else:
+                page_url = f"{partial_url}&page={page + 1}"
+            if page + 1 < no_pages:
+                nextlink = f"{base_url}{partial_url}&page={page + 2}"
+            else:
+                nextlink = None
+            start = page * self.flows_per_page
+            page_flows = flows[start : start + self.flows_per_page]
+            meta = {"language": "en", "count": len(flows)}
+            if nextlink:
+                meta["nextLink"] = nextlink
+            responses[page_url] = {
+                "status": "ok",
+                "data": {"flows": page_flows},
+                "meta": meta,
+            }
+        return responses
+
+    def get_flow_responses(self, base_url, global_flows=True):
+        flows, boundaries = self.get_flows()
+        flows_by_location = {}
+        for flow, location_boundaries in zip(flows, boundaries):
+            for locationid, (boundary, onboundary) in location_boundaries.items():
+                location_flow = dict(flow)
+                location_flow["boundary"] = boundary
+                location_flow["onBoundary"] = onboundary
+                flows_by_location.setdefault(locationid, []).append(location_flow)
+        responses = {}
+        for country in self.countries:
+            responses.update(
+                self.get_flow_pages(
+                    base_url,
+                    f"locationid={country['id']}&year={self.latest_year}",
+                    flows_by_location.get(country["id"], []),
+                )
+            )
+        if global_flows:
+            responses.update(
+                self.get_flow_pages(base_url, f"year={self.latest_year}", flows)
+            )
+        return responses
+
+    def iterate_responses(self, base_url, global_flows=True):
+        """Yields partial url and serialized response pairs. Flow page
+        nextLinks are absolute urls starting with base_url."""
+        locations = [
+            {**country, "adminLevel": 0, "pcode": None} for country in self.countries
+        ]
+        locations.append(
+            {"id": 9999, "iso3": None, "name": "Region", "adminLevel": 0, "pcode": None}
+        )
+        yield "1/public/location", dumps(self.get_response(locations))
+        single_plans = []
+        for year in self.years:
+            plans = self.get_plans(year)
+            yield (
+                f"2/fts/flow/plan/overview/progress/{year}",
+                dumps(self.get_response({"plans": plans})),
+            )
+            for plan in plans:
+                planid = plan["id"]
+                if len(plan["countries"]) == 1:
+                    single_plans.append(plan)
+                elif plan["customLocationCode"] != "COVD":
+                    yield (
+                        f"1/fts/flow/custom-search?planid={planid}&groupby=location",
+                        dumps(self.get_response(self.get_location_split(plan))),
+                    )
+        for plan in single_plans:
+            planid = plan["id"]
+            for clusterlevel in ("", "global"):
+                yield (
+                    f"1/fts/flow/custom-search?planid={planid}&groupby={clusterlevel}cluster",
+                    dumps(
+                        self.get_response(self.get_cluster_split(plan, clusterlevel))
+                    ),
+                )
+        for partial_url, data in self.get_covid_responses().items():
+            yield partial_url, dumps(self.get_response(data))
+        for country in self.countries:
+            for partial_url, data in self.get_trends(country).items():
+                yield partial_url, dumps(self.get_response(data))
+        for partial_url, response in self.get_flow_responses(
+            base_url, global_flows
+        ).items():
+            yield partial_url, dumps(response)
+
+    def fill_cache(self, cache, base_url, global_flows=True):
+        """Stores all the responses in a ResponseCache under base_url returning
+        the number of responses and their total size in bytes."""
+        no_responses = 0
+        size = 0
+        for partial_url, body in self.iterate_responses(base_url, global_flows):
+            body = body.encode("utf-8")
+            cache.set(f"{base_url}{partial_url}", body)
+            no_responses += 1
+            size += len(body)
+        return no_responses, size
@@ -9,9 +9,11 @@ that register datasets in HDX.
 """
 
 import logging
+from contextlib import ExitStack
 from datetime import datetime
 from os import getenv
 from os.path import expanduser, join
+from time import monotonic
 from typing import Optional
 
 from hdx.api.configuration import Configuration
@@ -22,17 +24,27 @@ from hdx.utilities.dateparse import parse_date
 from hdx.utilities.downloader import Download
 from hdx.utilities.easy_logging import setup_logging
 from hdx.utilities.path import (
+    get_temp_dir,
     progress_storing_folder,
     script_dir_plus_file,
     wheretostart_tempdir_batch,
 )
 
 from hdx.scraper.fts._version import __version__
+from hdx.scraper.fts.columnar_output import ColumnarOutput
+from hdx.scraper.fts.country_stages import CountryStages
 from hdx.scraper.fts.dataset_generator import DatasetGenerator
 from hdx.scraper.fts.download import FTSDownload
+from hdx.scraper.fts.download_stats import DownloadStats
+from hdx.scraper.fts.fingerprint_store import SKIP, UPDATE_DATE, FingerprintStore
+from hdx.scraper.fts.flow_store import FlowStore
 from hdx.scraper.fts.hapi_output import HAPIOutput
 from hdx.scraper.fts.locations import Locations
 from hdx.scraper.fts.pipeline import Pipeline
+from hdx.scraper.fts.response_cache import ResponseCache
+from hdx.scraper.fts.run_ledger import RunLedger
+from hdx.scraper.fts.run_profiler import RunProfiler
+from hdx.scraper.fts.snapshot_store import SnapshotStore
 
 setup_logging()
 logger = logging.getLogger(__name__)
@@ -47,6 +59,15 @@ def main(
     years: str = "",
     testfolder: str = "",
     err_to_hdx: Optional[bool] = None,
+    cache_folder: str = "",
+    global_flows: bool = False,
+    incremental_flows: bool = False,
+    full_resync: bool = False,
+    columnar_outputs: bool = False,
+    country_workers: int = 1,
+    write_workers: int = 1,
+    upload_workers: int = 1,
+    profile: bool = False,
 ) -> None:
     """Generate dataset and create it in HDX
 
@@ -56,11 +77,22 @@ def main(
         years (str): Years to run. Defaults to "".
         testfolder (str): Output test data to folder. Defaults to "".
         err_to_hdx (Optional[bool]): Whether to write any errors to HDX metadata. Defaults to None.
+        cache_folder (str): Folder for persistent FTS response cache, flow store and upload fingerprints. Defaults to "" (no cache).
+        global_flows (bool): Download all flows once rather than per country. Defaults to False.
+        incremental_flows (bool): Sync flows into a flow store in cache_folder. Defaults to False.
+        full_resync (bool): Force a full resync of the flow store. Defaults to False.
+        columnar_outputs (bool): Write Parquet and Arrow files alongside global CSVs. Defaults to False.
+        country_workers (int): Number of countries to fetch from FTS at once. Defaults to 1.
+        write_workers (int): Number of countries to transform and write at once. Defaults to 1.
+        upload_workers (int): Number of countries to upload to HDX at once. Defaults to 1.
+        profile (bool): Profile each stage in every thread and trace its memory allocations with tracemalloc. Defaults to False.
 
     Returns:
         None
     """
 
+    started_at = datetime.now()
+    start = monotonic()
     logger.info(f"##### {lookup} version {__version__} ####")
     configuration = Configuration.read()
     User.check_current_user_write_access(
@@ -68,87 +100,266 @@ def main(
     )
     if err_to_hdx is None:
         err_to_hdx = getenv("ERR_TO_HDX")
+    if not cache_folder:
+        cache_folder = getenv("FTS_CACHE_FOLDER")
+    if today:
+        today = parse_date(today)
+    else:
+        today = datetime.now()
     with HDXErrorHandler(write_to_hdx=err_to_hdx) as error_handler:
         with Download(
             fail_on_missing_file=False,
             extra_params_yaml=join(expanduser("~"), ".extraparams.yaml"),
             extra_params_lookup=lookup,
-            rate_limit={"calls": 1, "period": 1},
         ) as downloader:
-            with wheretostart_tempdir_batch(lookup) as info:
+            with wheretostart_tempdir_batch(lookup) as info, ExitStack() as stores:
                 folder = info["folder"]
                 batch = info["batch"]
+                if profile:
+                    profiler = RunProfiler(
+                        get_temp_dir(f"{lookup}-profile", delete_if_exists=True),
+                        profile=True,
+                    )
+                    stores.callback(profiler.close)
+                else:
+                    profiler = RunProfiler()
+                if cache_folder:
+                    cache_configuration = configuration["cache"]
+                    cache = ResponseCache(
+                        join(cache_folder, cache_configuration["filename"]),
+                        today.year,
+                        current_year_ttl=cache_configuration["current_year_ttl"],
+                        closed_year_ttl=cache_configuration["closed_year_ttl"],
+                        default_ttl=cache_configuration["default_ttl"],
+                        max_size=cache_configuration["max_size_mb"] * 1024 * 1024,
+                    )
+                    stores.callback(cache.close)
+                else:
+                    cache = None
+                if cache_folder and incremental_flows:
+                    flow_store_configuration = configuration["flow_store"]
+                    flow_store = FlowStore(
+                        join(cache_folder, flow_store_configuration["filename"]),
+                        updated_since_parameter=flow_store_configuration[
+                            "updated_since_parameter"
+                        ],
+                        full_resync_days=flow_store_configuration["full_resync_days"],
+                        full_resync=full_resync,
+                    )
+                    stores.callback(flow_store.close)
+                else:
+                    flow_store = None
+                if cache_folder:
+                    fingerprint_configuration = configuration["fingerprint_store"]
+                    fingerprint_store = FingerprintStore(
+                        join(cache_folder, fingerprint_configuration["filename"]),
+                        refresh_days=fingerprint_configuration["refresh_days"],
+                    )
+                    stores.callback(fingerprint_store.close)
+                else:
+                    fingerprint_store = None
+                if cache_folder:
+                    snapshot_configuration = configuration["snapshot_store"]
+                    snapshot_store = SnapshotStore(
+                        join(cache_folder, snapshot_configuration["filename"]),
+                        today,
+                        horizon_days=snapshot_configuration["horizon_days"],
+                        revalidate_days=snapshot_configuration["revalidate_days"],
+                    )
+                    stores.callback(snapshot_store.close)
+                else:
+                    snapshot_store = None
+                if columnar_outputs:
+                    columnar_configuration = configuration["columnar_output"]
+                    columnar_output = ColumnarOutput(
+                        folder,
+                        columnar_configuration["schemas"],
+                        compression=columnar_configuration["compression"],
+                        formats=columnar_configuration["formats"],
+                    )
+                else:
+                    columnar_output = None
+                stats_configuration = configuration["download_stats"]
+                download_stats = DownloadStats(
+                    slow_request_seconds=stats_configuration["slow_request_seconds"]
+                )
+                if cache_folder:
+                    ledger_configuration = configuration["run_ledger"]
+                    run_ledger = RunLedger(
+                        join(cache_folder, ledger_configuration["filename"]),
+                        keep_runs=ledger_configuration["keep_runs"],
+                    )
+                    stores.callback(run_ledger.close)
+
+                    def add_run(exc_type, exc_value, traceback):
+                        # Runs are recorded however they end
+                        if exc_type is None:
+                            status = "success"
+                        elif issubclass(exc_type, Exception):
+                            status = "failed"
+                        else:
+                            status = "interrupted"
+                        run_ledger.add_run(
+                            RunLedger.create_record(
+                                started_at,
+                                monotonic() - start,
+                                profiler.get_timings(),
+                                download_stats,
+                                folder,
+                                status=status,
+                            )
+                        )
+
+                    stores.push(add_run)
                 ftsdownloader = FTSDownload(
                     configuration,
                     downloader,
                     countryiso3s=countries,
                     years=years,
                     testfolder=testfolder,
+                    rate_limit=configuration["rate_limit"],
+                    max_concurrent=configuration["max_concurrent"],
+                    cache=cache,
+                    stats=download_stats,
+                    snapshot_store=snapshot_store,
                 )
                 notes = configuration["notes"]
-                if today:
-                    today = parse_date(today)
-                else:
-                    today = datetime.now()
 
-                locations = Locations(ftsdownloader)
+                with profiler.measure("locations"):
+                    locations = Locations(ftsdownloader)
                 logger.info(
                     f"Number of country datasets to upload: {len(locations.countries)}"
                 )
+                if (
+                    flow_store
+                    and locations.countries
+                    and not flow_store.probe(
+                        ftsdownloader, today.year, locations.countries[0]["id"]
+                    )
+                ):
+                    flow_store = None
 
                 pipeline = Pipeline(
-                    configuration, ftsdownloader, folder, locations, today
+                    configuration,
+                    ftsdownloader,
+                    folder,
+                    locations,
+                    today,
+                    global_flows=global_flows,
+                    flow_store=flow_store,
+                    columnar_output=columnar_output,
+                    profiler=profiler,
                 )
                 dataset_generator = DatasetGenerator(
                     today, notes, additional_tags=("covid-19",)
                 )
-                for _, country in progress_storing_folder(
-                    info, locations.countries, "iso3"
-                ):
-                    # for testing specific countries only
-                    #             if country['iso3'] not in ['AFG', 'JOR', 'TUR', 'PHL', 'SDN', 'PSE']:
-                    #                 continue
+
+                def fetch_country(country):
                     dataset, showcase = (
                         dataset_generator.get_country_dataset_and_showcase(
                             country,
                         )
                     )
                     if not dataset:
-                        continue
-                    success = pipeline.generate_country_dataset_and_showcase(
-                        country, dataset
-                    )
+                        return country, None, None, None
+                    with profiler.measure("fetch", country["iso3"]):
+                        context = pipeline.fetch_country(country)
+                    return country, dataset, showcase, context
+
+                def generate_country(country, dataset, showcase, context):
+                    if not dataset:
+                        return None, None
+                    with profiler.measure("country", country["iso3"]):
+                        success = pipeline.generate_country_dataset_and_showcase(
+                            country, dataset, context
+                        )
                     if not success:
-                        continue
-                    dataset.update_from_yaml(
-                        script_dir_plus_file(
-                            join("config", "hdx_dataset_static.yaml"), main
-                        ),
-                    )
-                    dataset.create_in_hdx(
-                        remove_additional_resources=True,
-                        match_resource_order=True,
-                        updated_by_script=updated_by_script,
-                        batch=batch,
-                    )
+                        return None, None
+                    return dataset, showcase
+
+                def upload_country(dataset, showcase):
+                    if not dataset:
+                        return
+                    with profiler.measure("upload", dataset["name"]):
+                        dataset.update_from_yaml(
+                            script_dir_plus_file(
+                                join("config", "hdx_dataset_static.yaml"), main
+                            ),
+                        )
+                        if fingerprint_store:
+                            name = dataset["name"]
+                            dataset_date = dataset.get("dataset_date")
+                            fingerprint = fingerprint_store.get_fingerprint(
+                                dataset, showcase
+                            )
+                            action = fingerprint_store.get_action(
+                                name, fingerprint, dataset_date
+                            )
+                            if action == SKIP:
+                                logger.info(f"Skipping unchanged dataset {name}")
+                                fingerprint_store.record_skip()
+                                return
+                            if action == UPDATE_DATE:
+                                logger.info(f"Updating dataset date only for {name}")
+                                dataset.update_in_hdx(
+                                    update_resources=False,
+                                    create_default_views=False,
+                                    hxl_update=False,
+                                    updated_by_script=updated_by_script,
+                                    batch=batch,
+                                )
+                                fingerprint_store.set(
+                                    name, fingerprint, dataset_date, action
+                                )
+                                return
+                        dataset.create_in_hdx(
+                            remove_additional_resources=True,
+                            match_resource_order=True,
+                            updated_by_script=updated_by_script,
+                            batch=batch,
+                        )
 
-                    showcase.create_in_hdx()
-                    showcase.add_dataset(dataset)
+                        showcase.create_in_hdx()
+                        showcase.add_dataset(dataset)
+                        if fingerprint_store:
+                            fingerprint_store.set(name, fingerprint, dataset_date)
+
+                with CountryStages(
+                    fetch_country,
+                    generate_country,
+                    upload_country,
+                    locations.countries,
+                    fetch_workers=country_workers,
+                    generate_workers=write_workers,
+                    upload_workers=upload_workers,
+                    queue_size=configuration["upload_queue_size"],
+                ) as country_stages:
+                    for _, country in progress_storing_folder(
+                        info, locations.countries, "iso3"
+                    ):
+                        # for testing specific countries only
+                        #             if country['iso3'] not in ['AFG', 'JOR', 'TUR', 'PHL', 'SDN', 'PSE']:
+                        #                 continue
+                        country_stages.wait(country)
 
                 global_dataset = dataset_generator.get_global_dataset()
                 if global_dataset:
-                    global_results = pipeline.generate_global_dataset(global_dataset)
+                    with profiler.measure("global"):
+                        global_results = pipeline.generate_global_dataset(
+                            global_dataset
+                        )
                     global_dataset.update_from_yaml(
                         script_dir_plus_file(
                             join("config", "hdx_dataset_static.yaml"), main
                         ),
                     )
-                    global_dataset.create_in_hdx(
-                        remove_additional_resources=True,
-                        match_resource_order=True,
-                        updated_by_script=updated_by_script,
-                        batch=batch,
-                    )
+                    with profiler.measure("upload", global_dataset["name"]):
+                        global_dataset.create_in_hdx(
+                            remove_additional_resources=True,
+                            match_resource_order=True,
+                            updated_by_script=updated_by_script,
+                            batch=batch,
+                        )
 
                 hapi_output = HAPIOutput(
                     configuration,
@@ -156,18 +367,36 @@ def main(
                     global_results,
                     today,
                     folder,
+                    columnar_output=columnar_output,
                 )
-                hapi_dataset = hapi_output.generate_dataset()
+                with profiler.measure("hapi"):
+                    hapi_dataset = hapi_output.generate_dataset()
                 hapi_dataset.update_from_yaml(
                     script_dir_plus_file(
                         join("config", "hdx_hapi_dataset_static.yaml"), main
                     ),
                 )
-                hapi_dataset.create_in_hdx(
-                    remove_additional_resources=True,
-                    match_resource_order=False,
-                    updated_by_script=updated_by_script,
+                with profiler.measure("upload", hapi_dataset["name"]):
+                    hapi_dataset.create_in_hdx(
+                        remove_additional_resources=True,
+                        match_resource_order=False,
+                        updated_by_script=updated_by_script,
+                    )
+                ftsdownloader.log_cache_stats()
+                # The temporary folder is deleted on success so the report goes
+                # in a folder that is kept
+                stats_folder = cache_folder or get_temp_dir(f"{lookup}-stats")
+                download_stats.write_report(
+                    join(stats_folder, stats_configuration["filename"])
                 )
+                download_stats.log_summary()
+                if fingerprint_store:
+                    fingerprint_store.log_stats()
+                if snapshot_store:
+                    snapshot_store.log_stats()
+                profiler.log_summary()
+                if profile:
+                    profiler.write()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,130 @@
+import logging
+from contextlib import ExitStack
+from datetime import date
+from os.path import join, splitext
+
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet
+from hdx.data.resource import Resource
+
+logger = logging.getLogger(__name__)
+
+format_descriptions = {"parquet": "Parquet", "arrow": "Arrow IPC"}
+converters = {
+    "string": str,
+    "int64": int,
+    "float64": float,
+    "date32": lambda value: date.fromisoformat(value[:10]),
+}
+
+
+class ColumnarOutput:
+    """Writes the rows of a CSV resource to typed, compressed Parquet and/or
+    Arrow IPC files alongside it and adds them to the dataset as further
+    resources. Column types come from fixed schemas (column name to pyarrow
+    type) keyed by the name of the header list of the output with empty
+    strings and None becoming nulls. Rows are consumed from an iterable and
+    written in record batches. Formats that HDX does not map to a file
+    type are not written.
+    """
+
+    def __init__(
+        self,
+        folder,
+        schemas,
+        compression="zstd",
+        formats=("parquet", "arrow"),
+        batch_size=65536,
+    ):
+        self._folder = folder
+        self._schemas = schemas
+        self._compression = compression
+        self._batch_size = batch_size
+        self._formats = []
+        for format in formats:
+            if Resource.get_mapped_format(format) is None:
+                logger.warning(
+                    f"HDX has no file type for {format} so it is not written"
+                )
+                continue
+            self._formats.append(format)
+
+    def get_column_types(self, headers, schema):
+        column_types = self._schemas[schema]
+        missing = [header for header in headers if header not in column_types]
+        if missing:
+            raise ValueError(f"Columns {missing} are not in the {schema} schema")
+        return {header: column_types[header] for header in headers}
+
+    @staticmethod
+    def get_columns(rows, column_types):
+        columns = {}
+        for header, column_type in column_types.items():
+            converter = converters[column_type]
+            values = []
+            for row in rows:
+                value = row.get(header)
+                if value is None or value == "":
+                    values.append(None)
+                else:
+                    values.append(converter(value))
+            columns[header] = values
+        return columns
+
+    def get_schema(self, column_types):
+        return pyarrow.schema(
+            [
+                (header, pyarrow.type_for_alias(column_type))
+                for header, column_type in column_types.items()
+            ]
+        )
+
+    def get_batches(self, rows, column_types, schema):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == self._batch_size:
+                columns = self.get_columns(batch, column_types)
+                yield pyarrow.RecordBatch.from_pydict(columns, schema=schema)
+                batch = []
+        if batch:
+            columns = self.get_columns(batch, column_types)
+            yield pyarrow.RecordBatch.from_pydict(columns, schema=schema)
+
+    def open_writer(self, filepath, schema, format):
+        if format == "parquet":
+            return pyarrow.parquet.ParquetWriter(
+                filepath, schema, compression=self._compression
+            )
+        options = pyarrow.ipc.IpcWriteOptions(compression=self._compression)
+        return pyarrow.ipc.new_file(filepath, schema, options=options)
+
+    def generate_resources(self, dataset, resource, rows, headers, schema):
+        """Write an iterable of rows to each format a batch at a time so that
+        the rows are never all held in memory."""
+        column_types = self.get_column_types(headers, schema)
+        arrow_schema = self.get_schema(column_types)
+        stem, _ = splitext(resource["name"])
+        filepaths = {}
+        with ExitStack() as stack:
+            writers = []
+            for format in self._formats:
+                filepath = join(self._folder, f"{stem}.{format}")
+                filepaths[format] = filepath
+                writer = self.open_writer(filepath, arrow_schema, format)
+                stack.callback(writer.close)
+                writers.append(writer)
+            for batch in self.get_batches(rows, column_types, arrow_schema):
+                for writer in writers:
+                    writer.write_batch(batch)
+        for format, filepath in filepaths.items():
+            resourcedata = {
+                "name": f"{stem}.{format}",
+                "description": f"{resource['description']} ({format_descriptions[format]})",
+                "format": format,
+            }
+            columnar_resource = Resource(resourcedata)
+            columnar_resource.set_format(format)
+            columnar_resource.set_file_to_upload(filepath)
+            dataset.add_update_resource(columnar_resource)
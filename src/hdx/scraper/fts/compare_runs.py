@@ -0,0 +1,71 @@
+"""
+Compare the latest run in the run ledger with a rolling baseline of the
+successful runs before it and list the costs (run, stage, country, endpoint and flow search
+times, requests, bytes and pages) that jumped. The exit status is 1 if any
+did.
+
+    python -m hdx.scraper.fts.compare_runs CACHE_FOLDER/fts_runs.sqlite
+        [--baseline-runs 7] [--threshold 0.5] [--top 20]
+
+"""
+
+import argparse
+import sys
+
+from hdx.scraper.fts.run_ledger import RunLedger
+
+
+def format_value(unit, value):
+    if unit == "bytes":
+        return f"{value / 1024 / 1024:.1f}MB"
+    if unit == "seconds":
+        return f"{value:.1f}s"
+    if unit == "mb":
+        return f"{value:.0f}MB"
+    return f"{value:g} {unit}"
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Compare the latest FTS run with a rolling baseline"
+    )
+    parser.add_argument("ledger", help="Path of the run ledger")
+    parser.add_argument("--baseline-runs", type=int, default=7)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args(args)
+
+    ledger = RunLedger(args.ledger)
+    try:
+        latest, no_baseline_runs, jumps = ledger.compare(
+            args.baseline_runs, args.threshold
+        )
+    finally:
+        ledger.close()
+    if latest is None:
+        print("No runs in ledger")
+        return 0
+    print(
+        f"Latest run {latest['started_at']} ({latest.get('status', 'success')}): "
+        f"{format_value('seconds', latest['seconds'])}, "
+        f"{latest['requests']} requests, {format_value('bytes', latest['bytes'])}, "
+        f"cache hit rate {latest['cache_hit_rate']}, peak RSS {latest['peak_rss_mb']}MB"
+    )
+    if not no_baseline_runs:
+        print("No earlier successful runs to compare with")
+        return 0
+    if not jumps:
+        print(f"No jumps against median of {no_baseline_runs} earlier successful runs")
+        return 0
+    print(f"Jumps against median of {no_baseline_runs} earlier successful runs:")
+    for section, name, unit, value, baseline in jumps[: args.top]:
+        print(
+            f"  {section} {name}: {format_value(unit, value)} vs {format_value(unit, baseline)}"
+        )
+    if len(jumps) > args.top:
+        print(f"  ... and {len(jumps) - args.top} more")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,23 @@
+class CountryContext:
+    """State built up while generating the resources for one country. Keeping
+    it here rather than on the resource generators means that several
+    countries can be processed at once. Rows and the latest year with
+    populated data are held per resource generator keyed by its filename. The
+    data fetched from FTS for the country (its flow table and funding by year)
+    is kept so that fetching and writing can be done by different workers.
+    """
+
+    def __init__(self, country):
+        self.country = country
+        self.countryiso3 = country["iso3"]
+        self._rows = {}
+        self.latestpopulated = {}
+        self.flow_table = None
+        self.funding_by_year = None
+
+    def get_rows(self, name):
+        rows = self._rows.get(name)
+        if rows is None:
+            rows = []
+            self._rows[name] = rows
+        return rows
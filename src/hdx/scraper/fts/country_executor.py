@@ -0,0 +1,54 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CountryExecutor:
+    """Runs a function for countries on a pool of max_workers threads. Results
+    are requested in order with get. Requesting a country submits it and the
+    countries following it so that up to max_pending (by default max_workers)
+    are submitted and not yet requested at once. Countries that are never
+    requested (eg. before WHERETOSTART) are never run. With max_pending of 1,
+    each country is run when it is requested.
+    """
+
+    def __init__(self, function, countries, max_workers=1, max_pending=None):
+        self._function = function
+        self._pending = deque(countries)
+        if max_pending is None:
+            max_pending = max_workers
+        self._max_pending = max_pending
+        self._futures = {}
+        self._executor = None
+        if max_pending > 1:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _submit(self, country):
+        self._futures[country["iso3"]] = self._executor.submit(self._function, country)
+
+    def get(self, country):
+        if self._executor is None:
+            return self._function(country)
+        countryiso3 = country["iso3"]
+        while self._pending and countryiso3 not in self._futures:
+            pending_country = self._pending.popleft()
+            if pending_country["iso3"] == countryiso3:
+                self._submit(pending_country)
+        while self._pending and len(self._futures) < self._max_pending:
+            self._submit(self._pending.popleft())
+        future = self._futures.pop(countryiso3, None)
+        if future is None:
+            return self._function(country)
+        return future.result()
+
+    def close(self):
+        if self._executor is not None:
+            for future in self._futures.values():
+                future.cancel()
+            self._executor.shutdown(wait=True)
+            self._executor = None
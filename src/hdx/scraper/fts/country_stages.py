@@ -0,0 +1,116 @@
+from concurrent.futures import Future
+from queue import Queue
+from threading import Thread
+
+from hdx.scraper.fts.country_executor import CountryExecutor
+
+
+class CountryStages:
+    """Fetches countries from FTS, generates them (transforming and writing
+    files) and uploads them to HDX in three stages, each with its own workers,
+    connected by bounded queues of queue_size (at least 1) countries. fetch's
+    result is passed to generate and generate's to upload as arguments. When
+    a queue is full, the stage before it waits so that no more than
+    fetch_workers + generate_workers + upload_workers + 2 * queue_size
+    countries are held at once. wait returns once a country has been
+    uploaded, so iterating with progress_storing_folder and calling wait for
+    each country keeps the progress marker at the earliest country not yet
+    uploaded.
+    """
+
+    def __init__(
+        self,
+        fetch,
+        generate,
+        upload,
+        countries,
+        fetch_workers=1,
+        generate_workers=1,
+        upload_workers=1,
+        queue_size=2,
+    ):
+        if queue_size < 1:
+            raise ValueError(f"queue_size must be at least 1 not {queue_size}")
+        self._fetch = fetch
+        self._generate = generate
+        self._upload = upload
+        self._generate_queue = Queue(maxsize=queue_size)
+        self._upload_queue = Queue(maxsize=queue_size)
+        self._closing = False
+        self._executor = CountryExecutor(
+            self._fetch_and_queue,
+            countries,
+            max_workers=fetch_workers,
+            max_pending=fetch_workers
+            + generate_workers
+            + upload_workers
+            + 2 * queue_size,
+        )
+        self._generate_threads = [
+            Thread(target=self._run_generates, daemon=True)
+            for _ in range(generate_workers)
+        ]
+        self._upload_threads = [
+            Thread(target=self._run_uploads, daemon=True) for _ in range(upload_workers)
+        ]
+        for thread in self._generate_threads + self._upload_threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _fetch_and_queue(self, country):
+        future = Future()
+        result = self._fetch(country)
+        self._generate_queue.put((result, future))
+        return future
+
+    def _run_generates(self):
+        while True:
+            item = self._generate_queue.get()
+            if item is None:
+                return
+            result, future = item
+            if self._closing:
+                future.cancel()
+                continue
+            try:
+                result = self._generate(*result)
+            except BaseException as ex:
+                future.set_exception(ex)
+                continue
+            self._upload_queue.put((result, future))
+
+    def _run_uploads(self):
+        while True:
+            item = self._upload_queue.get()
+            if item is None:
+                return
+            result, future = item
+            if self._closing:
+                future.cancel()
+                continue
+            try:
+                future.set_result(self._upload(*result))
+            except BaseException as ex:
+                future.set_exception(ex)
+
+    def wait(self, country):
+        return self._executor.get(country).result()
+
+    def close(self):
+        # Countries fetched or generated ahead but never waited for are not
+        # uploaded
+        self._closing = True
+        self._executor.close()
+        for _ in self._generate_threads:
+            self._generate_queue.put(None)
+        for thread in self._generate_threads:
+            thread.join()
+        for _ in self._upload_threads:
+            self._upload_queue.put(None)
+        for thread in self._upload_threads:
+            thread.join()
@@ -0,0 +1,41 @@
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from hdx.utilities.dateparse import parse_date, parse_date_range
+
+iso_date_pattern = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+year_pattern = re.compile(r"\d{4}")
+
+
+@lru_cache(maxsize=8192)
+def parse_iso_date(datestr):
+    """Parse a date string into a UTC datetime. Strict YYYY-MM-DD strings are
+    constructed directly and anything else falls back to parse_date. Results
+    are cached as the same dates recur across flows and plans."""
+    match = iso_date_pattern.fullmatch(datestr)
+    if match:
+        try:
+            return datetime(
+                int(match.group(1)),
+                int(match.group(2)),
+                int(match.group(3)),
+                tzinfo=timezone.utc,
+            )
+        except ValueError:
+            pass
+    return parse_date(datestr)
+
+
+@lru_cache(maxsize=256)
+def parse_year_range(year):
+    """Get the UTC start and end dates of a year given as an int or string
+    falling back to parse_date_range if it is not a 4 digit year."""
+    yearstr = str(year)
+    if year_pattern.fullmatch(yearstr):
+        year = int(yearstr)
+        return (
+            datetime(year, 1, 1, tzinfo=timezone.utc),
+            datetime(year, 12, 31, tzinfo=timezone.utc),
+        )
+    return parse_date_range(yearstr)
@@ -1,14 +1,38 @@
+import asyncio
+from json import loads
 from os.path import basename, join
+from threading import BoundedSemaphore, current_thread, local, main_thread
+from time import monotonic
 from urllib.parse import urlsplit
 
+import ijson
+from hdx.utilities.downloader import Download
 from hdx.utilities.saver import save_json
+from ijson.common import ObjectBuilder
 from slugify import slugify
 
+from hdx.scraper.fts.download_stats import DownloadStats
+from hdx.scraper.fts.response_filter import ResponseFilter
+from hdx.scraper.fts.token_bucket import TokenBucket
+
 
 class FTSException(Exception):
     pass
 
 
+class CountingReader:
+    """Wraps a file like object counting the bytes read from it"""
+
+    def __init__(self, file):
+        self._file = file
+        self.bytes = 0
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self.bytes += len(data)
+        return data
+
+
 class FTSDownload:
     def __init__(
         self,
@@ -18,20 +42,47 @@ class FTSDownload:
         years=None,
         testfolder=None,
         testpath=False,
+        rate_limit=None,
+        max_concurrent=1,
+        cache=None,
+        stats=None,
+        snapshot_store=None,
     ):
         self._url = configuration["base_url"]
         self._test_url = configuration["test_url"]
         self._downloader = downloader
         if countryiso3s:
-            self._countryiso3s = countryiso3s.split(",")
-        else:
-            self._countryiso3s = None
+            countryiso3s = countryiso3s.split(",")
         if years:
-            self._years = years.split(",")
-        else:
-            self._years = None
+            years = years.split(",")
+        self._response_filter = ResponseFilter(countryiso3s, years)
         self._testfolder = testfolder
         self._testpath = testpath
+        if rate_limit:
+            self._token_bucket = TokenBucket(rate_limit["calls"], rate_limit["period"])
+        else:
+            self._token_bucket = None
+        # One bound shared by all threads and event loops (each download_many
+        # runs its own) so at most max_concurrent requests are ever in flight
+        self._request_slots = BoundedSemaphore(max_concurrent)
+        self._thread_local = local()
+        self._cache = cache
+        if stats is None:
+            stats = DownloadStats()
+        self._stats = stats
+        self._snapshot_store = snapshot_store
+
+    def get_countryiso3s(self):
+        """Countries requested or None for all countries"""
+        return self._response_filter.countryiso3s
+
+    def get_years(self):
+        """Years (as strings) requested or None for all years"""
+        return self._response_filter.years
+
+    def get_stats(self):
+        """DownloadStats of the requests made so far"""
+        return self._stats
 
     def get_url(self, partial_url):
         return f"{self._url}{partial_url}"
@@ -55,13 +106,232 @@ class FTSDownload:
             filename = f"{filename}.json"
         return filename
 
-    def download(self, partial_url=None, data=True, url=None):
+    def _resolve_url(self, partial_url, url):
         if self._testpath:
             partial_url = self.get_testfile_path(partial_url, url)
         if partial_url is not None:
             url = self.get_url(partial_url)
-        r = self._downloader.download(url)
-        origjson = r.json()
+        return partial_url, url
+
+    def _get_thread_downloader(self):
+        # Download keeps the last response on the object so each worker thread
+        # needs its own instance. They share the session (and so any extra
+        # parameters, headers and connection pool) of the main downloader.
+        downloader = getattr(self._thread_local, "downloader", None)
+        if downloader is None:
+            downloader = Download(session=self._downloader.session)
+            self._thread_local.downloader = downloader
+        return downloader
+
+    def _get_downloader(self):
+        if current_thread() is main_thread():
+            return self._downloader
+        return self._get_thread_downloader()
+
+    def _lookup_cache(self, url):
+        if self._cache is None:
+            return None, None
+        entry = self._cache.get(url)
+        if entry is None or not entry.is_fresh():
+            return None, entry
+        self._cache.record("hit")
+        self._stats.record_cached(url)
+        return loads(entry.body), entry
+
+    def _acquire_token(self, url):
+        if self._token_bucket:
+            self._stats.record_rate_limit_wait(url, self._token_bucket.acquire())
+
+    def _fetch_json(self, downloader, url, entry=None):
+        with self._request_slots:
+            self._acquire_token(url)
+            return self._request_json(downloader, url, entry)
+
+    def _request_json(self, downloader, url, entry):
+        if entry is None:
+            headers = None
+        else:
+            headers = entry.get_validators()
+        start = monotonic()
+        try:
+            r = downloader.download(url, headers=headers)
+        except Exception:
+            self._stats.record_request(url, monotonic() - start, failed=True)
+            raise
+        network_time = monotonic() - start
+        self._stats.record_request(url, network_time, len(r.content))
+        if self._cache is None:
+            return r.json()
+        if r.status_code == 304:
+            self._cache.refresh(url)
+            self._cache.record("revalidated", network_time)
+            return loads(entry.body)
+        self._cache.record("miss", network_time)
+        origjson = loads(r.content)
+        if origjson.get("status") == "ok":
+            self._cache.set(
+                url,
+                r.content,
+                r.headers.get("ETag"),
+                r.headers.get("Last-Modified"),
+            )
+        return origjson
+
+    def download(self, partial_url=None, data=True, url=None):
+        partial_url, url = self._resolve_url(partial_url, url)
+        origjson, entry = self._lookup_cache(url)
+        if origjson is None:
+            origjson = self._fetch_json(self._get_downloader(), url, entry)
+        return self._process_json(origjson, partial_url, url, data)
+
+    async def async_download(self, partial_url=None, data=True, url=None):
+        """Coroutine version of download. The request is made in a worker
+        thread which waits for one of the max_concurrent request slots and a
+        token from the rate limit shared with all other requests.
+        """
+        partial_url, url = self._resolve_url(partial_url, url)
+        origjson, entry = self._lookup_cache(url)
+        if origjson is None:
+            origjson = await asyncio.to_thread(
+                lambda: self._fetch_json(self._get_thread_downloader(), url, entry)
+            )
+        return self._process_json(origjson, partial_url, url, data)
+
+    async def async_download_many(
+        self, partial_urls, data=True, return_exceptions=False
+    ):
+        return await asyncio.gather(
+            *[self.async_download(partial_url, data) for partial_url in partial_urls],
+            return_exceptions=return_exceptions,
+        )
+
+    def download_many(self, partial_urls, data=True, return_exceptions=False):
+        """Download a batch of partial urls concurrently returning a list of
+        results in the same order as partial_urls. If return_exceptions is True,
+        exceptions are returned in place of results rather than raised.
+        """
+        return asyncio.run(
+            self.async_download_many(partial_urls, data, return_exceptions)
+        )
+
+    def download_snapshots(self, kind, requests):
+        """Download a batch of (id, year, end date, partial url) requests for a
+        kind of snapshot like download_many. With a snapshot store, frozen data
+        is served from it and frozen data that is downloaded is stored unless
+        countries or years are requested (as the data would be filtered).
+        Snapshots served count as cached responses in the download stats. The
+        store is not used when saving responses to a test folder as they would
+        not be saved.
+        """
+        if self._snapshot_store is None or self._testfolder:
+            return self.download_many([request[3] for request in requests])
+        results = [None] * len(requests)
+        to_download = []
+        for i, (id, year, end_date, partial_url) in enumerate(requests):
+            if self._snapshot_store.is_frozen(end_date):
+                data = self._snapshot_store.get_fresh(kind, id, year)
+                if data is not None:
+                    results[i] = self._response_filter.filter_data(data)
+                    _, url = self._resolve_url(partial_url, None)
+                    self._stats.record_cached(url)
+                    continue
+            to_download.append(i)
+        if not to_download:
+            return results
+        downloaded = self.download_many([requests[i][3] for i in to_download])
+        store = not self._response_filter.is_active()
+        for i, data in zip(to_download, downloaded):
+            results[i] = data
+            id, year, end_date, _ = requests[i]
+            if store and self._snapshot_store.is_frozen(end_date):
+                self._snapshot_store.set(kind, id, year, data)
+        return results
+
+    def _stream_flows_page(self, url):
+        # The request slot is held until the page has been read
+        with self._request_slots:
+            self._acquire_token(url)
+            return (yield from self._read_flows_page(url))
+
+    def _read_flows_page(self, url):
+        # Flows are built from parser events as they arrive so a whole page is
+        # never held in memory. reportDetails is never used so its events are
+        # skipped rather than built.
+        downloader = self._get_downloader()
+        start = monotonic()
+        try:
+            r = downloader.setup(url)
+        except Exception:
+            self._stats.record_request(url, monotonic() - start, failed=True)
+            raise
+        r.raw.decode_content = True
+        # Count decompressed bytes as len(r.content) does for other requests
+        reader = CountingReader(r.raw)
+        failed = False
+        nextlink = None
+        builder = None
+        skipping = False
+        try:
+            for prefix, event, value in ijson.parse(reader, use_float=True):
+                if builder is not None:
+                    if skipping:
+                        if prefix.startswith("data.flows.item.reportDetails"):
+                            continue
+                        skipping = False
+                    if prefix == "data.flows.item":
+                        if event == "map_key" and value == "reportDetails":
+                            skipping = True
+                            continue
+                        if event == "end_map":
+                            yield builder.value
+                            builder = None
+                            continue
+                    builder.event(event, value)
+                elif prefix == "data.flows.item" and event == "start_map":
+                    builder = ObjectBuilder()
+                    builder.event(event, value)
+                elif prefix == "status" and value != "ok":
+                    raise FTSException(f"{url} gives status {value}")
+                elif prefix == "meta.nextLink":
+                    nextlink = value
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._stats.record_request(
+                url, monotonic() - start, reader.bytes, failed=failed
+            )
+            downloader.close_response()
+        return nextlink
+
+    def iterate_flows(self, partial_url=None, url=None):
+        """Iterate the flows of a custom search following nextLink pages. If
+        there is no cache or test folder, each page is parsed incrementally.
+        """
+        _, firsturl = self._resolve_url(partial_url, url)
+        pages = 0
+        try:
+            while partial_url is not None or url:
+                pages += 1
+                if self._cache is None and not self._testfolder:
+                    _, url = self._resolve_url(partial_url, url)
+                    partial_url = None
+                    url = yield from self._stream_flows_page(url)
+                    continue
+                json = self.download(partial_url, data=False, url=url)
+                partial_url = None
+                for flow in json["data"]["flows"]:
+                    flow.pop("reportDetails", None)
+                    yield flow
+                url = json["meta"].get("nextLink")
+        finally:
+            self._stats.record_pages(firsturl, pages)
+
+    def log_cache_stats(self):
+        if self._cache is not None:
+            self._cache.log_stats()
+
+    def _process_json(self, origjson, partial_url, url, data):
         status = origjson["status"]
         if status != "ok":
             raise FTSException(f"{url} gives status {status}")
@@ -76,41 +346,13 @@ class FTSDownload:
                     del json["report4"]
                 except KeyError:
                     pass
+                json = self._response_filter.filter_data(json)
                 plans = json.get("plans")
-                if plans is not None:
-                    for i, plan in reversed(list(enumerate(plans))):
-                        delete = False
-                        if self._countryiso3s:
-                            countries = plan["countries"]
-                            if countries:
-                                delete = True
-                                for country in countries:
-                                    if country["iso3"] in self._countryiso3s:
-                                        delete = False
-                                        break
-                        if not delete and self._years:
-                            delete = True
-                            for year in plan["usageYears"]:
-                                if year["year"] in self._years:
-                                    delete = False
-                                    break
-                        if delete:
-                            del plans[i]
-                    if len(plans) == 0:
-                        save = False
-            elif self._countryiso3s or self._years:
-                for i, object in reversed(list(enumerate(json))):
-                    if "iso3" in object:
-                        countryiso3 = object["iso3"]
-                        if countryiso3 is None or (
-                            self._countryiso3s and countryiso3 not in self._countryiso3s
-                        ):
-                            del json[i]
-                            continue
-                    if "year" in object:
-                        year = str(object["year"])
-                        if year is None or (self._years and year not in self._years):
-                            del json[i]
+                if plans is not None and len(plans) == 0:
+                    save = False
+            else:
+                json = self._response_filter.filter_data(json)
+                origjson["data"] = json
         else:
             json = origjson
         if save and self._testfolder and json:
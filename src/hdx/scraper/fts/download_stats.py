@@ -0,0 +1,163 @@
+import logging
+import re
+from json import dump
+from threading import Lock
+
+from slugify import slugify
+
+logger = logging.getLogger(__name__)
+
+# Endpoint families in the order they are matched against slugified urls so
+# that test file urls are classified in the same way as FTS API urls
+endpoints = (
+    ("locations", re.compile(r"public-location(-json)?$")),
+    ("plan_overview", re.compile(r"plan-overview-progress-\d+")),
+    ("trends", re.compile(r"summary-trends-\d+")),
+    ("covid", re.compile(r"custom-search-emergencyid-911")),
+    ("plan_locations", re.compile(r"custom-search-planid-\d+-groupby-location")),
+    ("plan_clusters", re.compile(r"custom-search-planid-\d+-groupby-cluster")),
+    (
+        "plan_globalclusters",
+        re.compile(r"custom-search-planid-\d+-groupby-globalcluster"),
+    ),
+    ("flows_by_location", re.compile(r"custom-search-locationid-\d+")),
+    ("flows", re.compile(r"custom-search")),
+)
+# Upper bounds in seconds of the latency histogram buckets
+latency_buckets = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.cached = 0
+        self.failures = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rate_limit_wait = 0.0
+        self.latency_histogram = [0] * (len(latency_buckets) + 1)
+        self.searches = 0
+        self.pages = 0
+        self.max_pages = 0
+
+    def get_report(self):
+        histogram = {}
+        for bucket, count in zip(latency_buckets, self.latency_histogram):
+            histogram[f"<={bucket}s"] = count
+        histogram[f">{latency_buckets[-1]}s"] = self.latency_histogram[-1]
+        report = {
+            "requests": self.requests,
+            "cached": self.cached,
+            "failures": self.failures,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 3),
+            "max_seconds": round(self.max_seconds, 3),
+            "rate_limit_wait": round(self.rate_limit_wait, 3),
+            "latency_histogram": histogram,
+        }
+        if self.searches:
+            report["searches"] = self.searches
+            report["pages"] = self.pages
+            report["max_pages"] = self.max_pages
+        return report
+
+
+class DownloadStats:
+    """Figures per endpoint family of the requests made by FTSDownload: number
+    of requests (and responses served from the cache), failures, bytes, time
+    and a histogram of latencies, time spent waiting on the rate limiter and
+    for paged searches, number of pages. Requests slower than
+    slow_request_seconds are logged as they happen. Safe to share between
+    threads.
+    """
+
+    def __init__(self, slow_request_seconds=None):
+        self._slow_request_seconds = slow_request_seconds
+        self._lock = Lock()
+        self._endpoints = {}
+        self._search_pages = {}
+
+    @staticmethod
+    def get_endpoint(url):
+        slug = slugify(url)
+        for endpoint, pattern in endpoints:
+            if pattern.search(slug):
+                return endpoint
+        return "other"
+
+    def _get_stats(self, url):
+        endpoint = self.get_endpoint(url)
+        stats = self._endpoints.get(endpoint)
+        if stats is None:
+            stats = EndpointStats()
+            self._endpoints[endpoint] = stats
+        return stats
+
+    def record_request(self, url, seconds, size=0, failed=False):
+        with self._lock:
+            stats = self._get_stats(url)
+            stats.requests += 1
+            if failed:
+                stats.failures += 1
+            stats.bytes += size
+            stats.seconds += seconds
+            if seconds > stats.max_seconds:
+                stats.max_seconds = seconds
+            for i, bucket in enumerate(latency_buckets):
+                if seconds <= bucket:
+                    break
+            else:
+                i = len(latency_buckets)
+            stats.latency_histogram[i] += 1
+        if self._slow_request_seconds and seconds > self._slow_request_seconds:
+            logger.warning(f"Slow request ({seconds:.1f}s): {url}")
+
+    def record_cached(self, url):
+        with self._lock:
+            self._get_stats(url).cached += 1
+
+    def record_rate_limit_wait(self, url, seconds):
+        with self._lock:
+            self._get_stats(url).rate_limit_wait += seconds
+
+    def record_pages(self, url, pages):
+        with self._lock:
+            stats = self._get_stats(url)
+            stats.searches += 1
+            stats.pages += pages
+            if pages > stats.max_pages:
+                stats.max_pages = pages
+            self._search_pages[url] = pages
+
+    def get_search_pages(self):
+        """Returns a dict of the first url of each paged search to its number
+        of pages"""
+        with self._lock:
+            return dict(self._search_pages)
+
+    def get_report(self):
+        """Returns a dict of endpoint family to dict of figures with the
+        totals across endpoints under "total"."""
+        with self._lock:
+            report = {
+                endpoint: self._endpoints[endpoint].get_report()
+                for endpoint in sorted(self._endpoints)
+            }
+        total = {}
+        for key in ("requests", "cached", "failures", "bytes"):
+            total[key] = sum(figures[key] for figures in report.values())
+        for key in ("seconds", "rate_limit_wait"):
+            total[key] = round(sum(figures[key] for figures in report.values()), 3)
+        report["total"] = total
+        return report
+
+    def write_report(self, path):
+        with open(path, "w") as file:
+            dump(self.get_report(), file, indent=2)
+
+    def log_summary(self):
+        for endpoint, figures in self.get_report().items():
+            logger.info(
+                f"{endpoint}: {figures['requests']} requests ({figures['cached']} cached, {figures['failures']} failed), {figures['bytes']} bytes, {figures['seconds']:.1f}s, {figures['rate_limit_wait']:.1f}s rate limited"
+            )
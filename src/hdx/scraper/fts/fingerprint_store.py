@@ -0,0 +1,115 @@
+import logging
+import sqlite3
+from hashlib import sha256
+from json import dumps
+from threading import Lock
+from time import time
+
+logger = logging.getLogger(__name__)
+
+# Upload actions
+UPLOAD = "upload"
+UPDATE_DATE = "update_date"
+SKIP = "skip"
+
+
+class FingerprintStore:
+    """SQLite store of a fingerprint per dataset name recorded after each
+    successful upload to HDX. The fingerprint is a hash of the dataset
+    metadata (other than dataset_date), the name, description, format and
+    file contents of each resource and the showcase metadata. If a dataset's
+    fingerprint matches the last upload, there is no need to upload it again.
+    Only its dataset date needs updating if that has changed or it was last
+    sent more than refresh_days ago.
+    """
+
+    def __init__(self, path, refresh_days=1):
+        self._refresh_period = refresh_days * 24 * 3600
+        self._lock = Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints (name TEXT PRIMARY KEY, "
+            "fingerprint TEXT, dataset_date TEXT, uploaded_at REAL)"
+        )
+        self.skipped = 0
+        self.date_updates = 0
+        self.uploads = 0
+
+    @staticmethod
+    def get_file_hash(path):
+        filehash = sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                filehash.update(chunk)
+        return filehash.hexdigest()
+
+    @classmethod
+    def get_fingerprint(cls, dataset, showcase=None):
+        metadata = {
+            key: value for key, value in dataset.data.items() if key != "dataset_date"
+        }
+        resources = []
+        for resource in dataset.get_resources():
+            filepath = resource.get_file_to_upload()
+            if filepath:
+                filehash = cls.get_file_hash(filepath)
+            else:
+                filehash = None
+            resources.append(
+                [
+                    resource.get("name"),
+                    resource.get("description"),
+                    resource.get("format"),
+                    filehash,
+                ]
+            )
+        if showcase is None:
+            showcase_metadata = None
+        else:
+            showcase_metadata = showcase.data
+        fingerprint = dumps(
+            [metadata, resources, showcase_metadata], sort_keys=True, default=str
+        )
+        return sha256(fingerprint.encode("utf-8")).hexdigest()
+
+    def get_action(self, name, fingerprint, dataset_date):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT fingerprint, dataset_date, uploaded_at FROM fingerprints "
+                "WHERE name = ?",
+                (name,),
+            ).fetchone()
+        if row is None or row[0] != fingerprint:
+            return UPLOAD
+        _, last_dataset_date, uploaded_at = row
+        if last_dataset_date != dataset_date:
+            return UPDATE_DATE
+        if time() - uploaded_at > self._refresh_period:
+            return UPDATE_DATE
+        return SKIP
+
+    def set(self, name, fingerprint, dataset_date, action=UPLOAD):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)",
+                (name, fingerprint, dataset_date, time()),
+            )
+            if action == UPLOAD:
+                self.uploads += 1
+            elif action == UPDATE_DATE:
+                self.date_updates += 1
+
+    def record_skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def log_stats(self):
+        logger.info(
+            f"HDX uploads: {self.uploads} uploaded, {self.date_updates} dataset date "
+            f"only updates, {self.skipped} skipped as unchanged"
+        )
+
+    def close(self):
+        self._connection.close()
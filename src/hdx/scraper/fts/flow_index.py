@@ -0,0 +1,112 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FlowIndex:
+    """Index by location of all the flows for a year. The flows are paged
+    through once using a custom search without a location and each flow is
+    flattened only once no matter how many locations it touches.
+
+    The boundary of a flow is relative to the location and year being queried
+    so it is derived from the source and destination objects. A side matches
+    if it has the location and a UsageYear of the year. Flows matching on both
+    sides are internal unless they are new money in which case they are
+    incoming like those matching only on the destination side. Flows matching
+    only on the source side are outgoing. Locations on neither matching side
+    are not indexed as a search for them would not return the flow. onBoundary
+    is shared if the Location or any UsageYear on the boundary side is shared.
+    This reproduces boundary and onBoundary of the per location searches for
+    all the flows in the test fixtures.
+
+    Flows without any matching location (such as those with no Location
+    objects) would not be returned by any per location search so they are
+    counted but not indexed.
+    """
+
+    def __init__(self, downloader, year):
+        self._downloader = downloader
+        self._year = year
+        self._entries_by_location = {}
+        self.no_flows = 0
+        self.no_unlocated_flows = 0
+
+    @staticmethod
+    def get_boundaries(flow, year):
+        year = str(year)
+        sides = []
+        for key in ("sourceObjects", "destinationObjects"):
+            locations = {}
+            matches_year = False
+            usageyear_shared = False
+            for obj in flow[key]:
+                objtype = obj["type"]
+                if objtype == "Location":
+                    locations[int(obj["id"])] = obj.get("behavior")
+                elif objtype == "UsageYear":
+                    if obj["name"] == year:
+                        matches_year = True
+                    if obj.get("behavior") == "shared":
+                        usageyear_shared = True
+            if not matches_year:
+                locations = {}
+            sides.append((locations, usageyear_shared))
+        (src_locations, src_shared), (dest_locations, dest_shared) = sides
+        newmoney = flow.get("newMoney")
+        boundaries = {}
+        for locationid, behavior in dest_locations.items():
+            if locationid in src_locations and not newmoney:
+                boundary = "internal"
+            else:
+                boundary = "incoming"
+            if behavior == "shared" or dest_shared:
+                boundaries[locationid] = (boundary, "shared")
+            else:
+                boundaries[locationid] = (boundary, "single")
+        for locationid, behavior in src_locations.items():
+            if locationid in boundaries:
+                continue
+            if behavior == "shared" or src_shared:
+                boundaries[locationid] = ("outgoing", "shared")
+            else:
+                boundaries[locationid] = ("outgoing", "single")
+        return boundaries
+
+    def add_flow(self, flow, flatten_flow):
+        boundaries = self.get_boundaries(flow, self._year)
+        if not boundaries:
+            self.no_unlocated_flows += 1
+            return
+        newrow = flatten_flow(flow)
+        for locationid, boundary in boundaries.items():
+            entries = self._entries_by_location.get(locationid)
+            if entries is None:
+                entries = []
+                self._entries_by_location[locationid] = entries
+            entries.append((newrow, boundary))
+        self.no_flows += 1
+
+    def build(self, flatten_flow):
+        funding_url = self._downloader.get_url(
+            f"1/fts/flow/custom-search?year={self._year}"
+        )
+        for flow in self._downloader.iterate_flows(url=funding_url):
+            self.add_flow(flow, flatten_flow)
+        logger.info(
+            f"Indexed {self.no_flows} flows for {self._year} across {len(self._entries_by_location)} locations"
+        )
+        if self.no_unlocated_flows:
+            logger.info(
+                f"{self.no_unlocated_flows} flows for {self._year} have no location matching the year and are in no country's flows"
+            )
+
+    def get_rows(self, locationid):
+        rows = []
+        for newrow, (boundary, onboundary) in self._entries_by_location.get(
+            int(locationid), []
+        ):
+            row = dict(newrow)
+            row["boundary"] = boundary
+            row["onBoundary"] = onboundary
+            rows.append(row)
+        return rows
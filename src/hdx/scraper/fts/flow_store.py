@@ -0,0 +1,244 @@
+import logging
+import sqlite3
+import zlib
+from itertools import islice
+from json import dumps, loads
+from threading import Lock
+from time import time
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+probe_watermark = "9999-12-31T00:00:00.000Z"
+
+
+class FlowStore:
+    """Local SQLite store of the flows for a year of each location keyed by
+    flow id. Flows are synced with the per location search so that the stored
+    boundary and onBoundary are those computed by the API. After an initial
+    full sync of a location, only flows updated since its watermark (the
+    latest updatedAt seen) are requested and merged into the store. Flows are
+    returned in the order of the search: full syncs store each flow's position
+    in the results, flows updated by a delta keep their position and new ones
+    are placed after those stored.
+
+    The updated since parameter is not documented by FTS. probe should be
+    called before syncing to check that it is supported and the store not
+    used if not, since a full download on every run plus the store overhead
+    is slower than not using the store. If a delta still contains flows last
+    updated before the watermark, the parameter was ignored and the full set
+    of flows was returned so the sync is treated as a full one (and a warning
+    logged). Flows returned with a deletedAt are removed, but as FTS
+    does not document that deleted flows are returned, deletions and flows
+    moving out of the location or year are only certain to be seen by a full
+    resync which removes flows no longer returned. This is done every
+    full_resync_days or when full_resync is True.
+    """
+
+    def __init__(
+        self,
+        path,
+        updated_since_parameter="updatedSince",
+        full_resync_days=7,
+        full_resync=False,
+    ):
+        self._updated_since_parameter = updated_since_parameter
+        self._full_resync_period = full_resync_days * 24 * 3600
+        self._full_resync = full_resync
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS flows (year INTEGER, locationid INTEGER, "
+            "id INTEGER, position INTEGER, updated_at TEXT, body BLOB, "
+            "PRIMARY KEY (year, locationid, id))"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS syncs (year INTEGER, locationid INTEGER, "
+            "watermark TEXT, full_sync REAL, PRIMARY KEY (year, locationid))"
+        )
+        self._connection.commit()
+
+    def get_sync_info(self, year, locationid):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT watermark, full_sync FROM syncs "
+                "WHERE year = ? AND locationid = ?",
+                (year, locationid),
+            ).fetchone()
+        if row is None:
+            return None, None
+        return row
+
+    def merge(self, year, locationid, flows):
+        """Merge flows into the store returning the number of flows added or
+        updated, the number deleted and the earliest and latest updatedAt of
+        the flows. New flows are placed after those stored and existing ones
+        keep their position."""
+        changed = 0
+        deleted = 0
+        earliest = None
+        latest = ""
+        with self._lock:
+            (position,) = self._connection.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM flows "
+                "WHERE year = ? AND locationid = ?",
+                (year, locationid),
+            ).fetchone()
+            for flow in flows:
+                flowid = int(flow["id"])
+                updated_at = flow.get("updatedAt") or ""
+                if updated_at > latest:
+                    latest = updated_at
+                if earliest is None or updated_at < earliest:
+                    earliest = updated_at
+                if flow.get("deletedAt"):
+                    cursor = self._connection.execute(
+                        "DELETE FROM flows WHERE year = ? AND locationid = ? AND id = ?",
+                        (year, locationid, flowid),
+                    )
+                    deleted += cursor.rowcount
+                    continue
+                flow.pop("reportDetails", None)
+                body = zlib.compress(dumps(flow, separators=(",", ":")).encode("utf-8"))
+                cursor = self._connection.execute(
+                    "INSERT INTO flows VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (year, locationid, id) DO UPDATE SET "
+                    "updated_at = excluded.updated_at, body = excluded.body "
+                    "WHERE excluded.updated_at > flows.updated_at",
+                    (year, locationid, flowid, position, updated_at, body),
+                )
+                changed += cursor.rowcount
+                position += 1
+            self._connection.commit()
+        return changed, deleted, earliest, latest
+
+    def remove_missing(self, year, locationid, flowids):
+        with self._lock:
+            existing = {
+                row[0]
+                for row in self._connection.execute(
+                    "SELECT id FROM flows WHERE year = ? AND locationid = ?",
+                    (year, locationid),
+                )
+            }
+            missing = [(year, locationid, flowid) for flowid in existing - flowids]
+            self._connection.executemany(
+                "DELETE FROM flows WHERE year = ? AND locationid = ? AND id = ?",
+                missing,
+            )
+            self._connection.commit()
+        return len(missing)
+
+    def set_positions(self, year, locationid, flowids):
+        """Set the position of each flow to its index in flowids, the order in
+        which a full sync received them."""
+        with self._lock:
+            self._connection.executemany(
+                "UPDATE flows SET position = ? "
+                "WHERE year = ? AND locationid = ? AND id = ?",
+                (
+                    (position, year, locationid, flowid)
+                    for position, flowid in enumerate(flowids)
+                ),
+            )
+            self._connection.commit()
+
+    def set_sync_info(self, year, locationid, watermark, full_sync):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO syncs VALUES (?, ?, ?, ?)",
+                (year, locationid, watermark, full_sync),
+            )
+            self._connection.commit()
+
+    def get_url(self, downloader, year, locationid, watermark=None):
+        partial_url = f"1/fts/flow/custom-search?locationid={locationid}&year={year}"
+        if watermark:
+            partial_url = (
+                f"{partial_url}&{self._updated_since_parameter}={quote(watermark)}"
+            )
+        return downloader.get_url(partial_url)
+
+    def probe(self, downloader, year, locationid):
+        """Returns whether FTS supports the updated since parameter by
+        requesting the flows of a location updated since a far future
+        watermark which should return none. If the location has no flows in
+        the year, the probe passes and an ignored parameter is still detected
+        by sync."""
+        funding_url = self.get_url(downloader, year, locationid, probe_watermark)
+        supported = True
+        for _ in downloader.iterate_flows(url=funding_url):
+            supported = False
+            break
+        if not supported:
+            logger.warning(
+                f"FTS ignored {self._updated_since_parameter} so the flow store "
+                f"is not used"
+            )
+        return supported
+
+    def sync(self, downloader, year, locationid):
+        watermark, full_sync = self.get_sync_info(year, locationid)
+        now = time()
+        full = (
+            self._full_resync
+            or not watermark
+            or now - full_sync > self._full_resync_period
+        )
+        if full:
+            funding_url = self.get_url(downloader, year, locationid)
+        else:
+            funding_url = self.get_url(downloader, year, locationid, watermark)
+        flowids = []
+        changed = 0
+        deleted = 0
+        earliest = None
+        latest = watermark or ""
+        flows = downloader.iterate_flows(url=funding_url)
+        while True:
+            batch = list(islice(flows, 1000))
+            if not batch:
+                break
+            flowids.extend(int(flow["id"]) for flow in batch)
+            batch_changed, batch_deleted, batch_earliest, batch_latest = self.merge(
+                year, locationid, batch
+            )
+            changed += batch_changed
+            deleted += batch_deleted
+            if earliest is None or batch_earliest < earliest:
+                earliest = batch_earliest
+            if batch_latest > latest:
+                latest = batch_latest
+        if not full and earliest is not None and earliest < watermark:
+            logger.warning(
+                f"Flows updated before {watermark} returned for location {locationid} "
+                f"so {self._updated_since_parameter} was ignored: treating as full sync"
+            )
+            full = True
+        if full:
+            deleted += self.remove_missing(year, locationid, set(flowids))
+            self.set_positions(year, locationid, flowids)
+            full_sync = now
+        self.set_sync_info(year, locationid, latest, full_sync)
+        if full:
+            synctype = "Full"
+        else:
+            synctype = f"Incremental (since {watermark})"
+        logger.info(
+            f"{synctype} flow sync for location {locationid} {year}: "
+            f"{len(flowids)} flows received, {changed} added or updated, "
+            f"{deleted} deleted"
+        )
+
+    def get_flows(self, year, locationid):
+        with self._lock:
+            bodies = self._connection.execute(
+                "SELECT body FROM flows WHERE year = ? AND locationid = ? "
+                "ORDER BY position",
+                (year, locationid),
+            ).fetchall()
+        for (body,) in bodies:
+            yield loads(zlib.decompress(body))
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,153 @@
+from csv import writer
+
+import pyarrow
+import pyarrow.compute
+
+from hdx.scraper.fts.dates import parse_iso_date
+
+
+class FlowTable:
+    """Columnar table of flattened flows with one column per output header.
+    Flows are appended to a buffer per column which build turns into a pyarrow
+    table. Columns holding only ints or only floats are typed as such, columns
+    mixing the two are a union of both so that, for example, 1 and 1.0 are
+    kept apart and all other columns are strings with empty strings becoming
+    nulls. String columns are dictionary encoded if they have few distinct
+    values compared with their number of rows. Partitioning, sorting, finding
+    the earliest date and writing CSVs work on the columns of the built table.
+    """
+
+    def __init__(self, headers, dictionary_ratio=0.5):
+        self.headers = headers
+        self._dictionary_ratio = dictionary_ratio
+        self._buffers = {header: [] for header in headers}
+        self._row = {}
+        self.no_rows = 0
+
+    def new_row(self):
+        """Returns an empty dict to be filled and passed to append. It is
+        reused for every row so that no dict is kept per row."""
+        self._row.clear()
+        return self._row
+
+    def append(self, row):
+        for header, buffer in self._buffers.items():
+            buffer.append(row.get(header))
+        self.no_rows += 1
+
+    def get_array(self, values):
+        values = [None if value == "" else value for value in values]
+        value_types = {type(value) for value in values if value is not None}
+        if value_types == {int}:
+            return pyarrow.array(values, type=pyarrow.int64())
+        if value_types == {float}:
+            return pyarrow.array(values, type=pyarrow.float64())
+        if value_types == {int, float}:
+            type_ids = []
+            offsets = []
+            children = ([], [])
+            for value in values:
+                type_id = 1 if isinstance(value, float) else 0
+                child = children[type_id]
+                type_ids.append(type_id)
+                offsets.append(len(child))
+                child.append(value)
+            return pyarrow.UnionArray.from_dense(
+                pyarrow.array(type_ids, type=pyarrow.int8()),
+                pyarrow.array(offsets, type=pyarrow.int32()),
+                [
+                    pyarrow.array(children[0], type=pyarrow.int64()),
+                    pyarrow.array(children[1], type=pyarrow.float64()),
+                ],
+                ["int", "float"],
+            )
+        # The csv module writes str of every value other than floats
+        array = pyarrow.array(
+            [None if value is None else str(value) for value in values],
+            type=pyarrow.string(),
+        )
+        no_distinct = pyarrow.compute.count_distinct(array).as_py()
+        if no_distinct <= self._dictionary_ratio * len(array):
+            return array.dictionary_encode()
+        return array
+
+    def build(self):
+        arrays = [self.get_array(self._buffers[header]) for header in self.headers]
+        self._buffers = {header: [] for header in self.headers}
+        self.no_rows = 0
+        return pyarrow.Table.from_arrays(arrays, names=self.headers)
+
+    @staticmethod
+    def decode(column):
+        if pyarrow.types.is_dictionary(column.type):
+            return column.cast(pyarrow.string())
+        return column
+
+    @classmethod
+    def get_min_date(cls, table, keys, start_date):
+        for key in keys:
+            datestr = pyarrow.compute.min(cls.decode(table.column(key))).as_py()
+            if datestr:
+                date = parse_iso_date(datestr)
+                if date < start_date:
+                    start_date = date
+        return start_date
+
+    @classmethod
+    def partition(cls, table, key):
+        """Returns a dict of each value of the key column to the table of rows
+        with that value."""
+        column = cls.decode(table.column(key))
+        tables = {}
+        for value in pyarrow.compute.unique(column).to_pylist():
+            if value is None:
+                mask = pyarrow.compute.is_null(column)
+            else:
+                mask = pyarrow.compute.equal(column, value)
+            tables[value] = table.filter(mask)
+        return tables
+
+    @classmethod
+    def sort(cls, table, key, reverse=False):
+        """Stable sort of the table by the key column with nulls last."""
+        indices = pyarrow.compute.array_sort_indices(
+            cls.decode(table.column(key)),
+            order="descending" if reverse else "ascending",
+        )
+        return table.take(indices)
+
+    @classmethod
+    def get_columns(cls, table):
+        """Returns the values of each column of the table as a list. Dictionary
+        and union columns are decoded with compute functions rather than value
+        by value by to_pylist which is much slower for them."""
+        columns = []
+        for column in table.columns:
+            column = cls.decode(column)
+            if pyarrow.types.is_union(column.type):
+                values = []
+                for chunk in column.chunks:
+                    children = [
+                        chunk.field(index).to_pylist()
+                        for index in range(chunk.type.num_fields)
+                    ]
+                    for type_code, offset in zip(
+                        chunk.type_codes.to_pylist(), chunk.offsets.to_pylist()
+                    ):
+                        values.append(children[type_code][offset])
+                columns.append(values)
+            else:
+                columns.append(column.to_pylist())
+        return columns
+
+    @staticmethod
+    def iterate_rows(headers, columns):
+        for values in zip(*columns):
+            yield dict(zip(headers, values))
+
+    @staticmethod
+    def write_csv(headers, columns, path):
+        with open(path, "w", encoding="utf-8", newline="") as file:
+            csvwriter = writer(file, lineterminator="\n")
+            csvwriter.writerow(headers)
+            csvwriter.writerows(zip(*columns))
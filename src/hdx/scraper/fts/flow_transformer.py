@@ -0,0 +1,192 @@
+import logging
+
+from hdx.utilities.matching import multiple_replace
+
+logger = logging.getLogger(__name__)
+
+srcdestmap = {"sourceObjects": "src", "destinationObjects": "dest"}
+date_keys = ("date", "firstReportedDate", "decisionDate", "createdAt", "updatedAt")
+keyname_replacements = {
+    "OrganizationOrganization": "Organization",
+    "Name": "",
+    "types": "Types",
+    "code": "Code",
+}
+ignored_object_keys = frozenset(("type", "behavior", "id"))
+
+# Flow key handlers
+SKIP = 0
+COPY = 1
+OBJECTS = 2
+DATE = 3
+KEYWORDS = 4
+
+# Object column handlers
+SINGLE = 0
+USAGE_YEAR = 1
+JOINED = 2
+
+
+class FlowTransformer:
+    """Transforms FTS flows into output rows. The handler for each flow key and
+    the output column(s) and handler for each (source/destination, object type,
+    key) are worked out from the configuration the first time they are seen and
+    looked up in dicts thereafter.
+    """
+
+    def __init__(self, configuration, locations, planidcodemapping):
+        self._columns_to_keep = frozenset(configuration["country_all_columns_to_keep"])
+        self._rename_columns = configuration["rename_columns"]
+        self._get_countryiso = locations.get_countryiso_from_name
+        self._planidcodemapping = planidcodemapping
+        self._flow_handlers = {}
+        self._object_columns = {}
+
+    def get_flow_handler(self, key):
+        handler = self._flow_handlers.get(key)
+        if handler is not None:
+            return handler
+        if key == "reportDetails":
+            handler = (SKIP, None)
+        elif key in srcdestmap:
+            handler = (OBJECTS, srcdestmap[key])
+        elif key == "keywords":
+            handler = (KEYWORDS, key)
+        elif key in date_keys:
+            handler = (DATE, key)
+        else:
+            renamed_column = self._rename_columns.get(key)
+            if renamed_column:
+                handler = (COPY, renamed_column)
+            elif key in self._columns_to_keep:
+                handler = (COPY, key)
+            else:
+                handler = (SKIP, None)
+        self._flow_handlers[key] = handler
+        return handler
+
+    def get_object_column(self, shortened, objtype, key):
+        """Returns handler, output column, extra information (end column for
+        usage years, whether to map location names to iso3s for joined columns)
+        and whether the output column is kept."""
+        column = self._object_columns.get((shortened, objtype, key))
+        if column is not None:
+            return column
+        keyname = multiple_replace(
+            f"{shortened}{objtype}{key.capitalize()}", keyname_replacements
+        )
+        if "UsageYear" in keyname:
+            endkeyname = f"{keyname}End"
+            column = (
+                USAGE_YEAR,
+                f"{keyname}Start",
+                endkeyname,
+                endkeyname in self._columns_to_keep,
+            )
+        elif any(x in keyname for x in ["Cluster", "Location", "OrganizationTypes"]):
+            if keyname[-1] != "s":
+                keyname = f"{keyname}s"
+            column = (
+                JOINED,
+                keyname,
+                "Location" in keyname,
+                keyname in self._columns_to_keep,
+            )
+        else:
+            column = (SINGLE, keyname, None, keyname in self._columns_to_keep)
+        self._object_columns[(shortened, objtype, key)] = column
+        return column
+
+    def flatten_objects(self, objs, shortened, newrow):
+        objinfo_by_type = {}
+        plan_id = None
+        destPlanId = None
+        for obj in objs:
+            objtype = obj["type"]
+            objinfo = objinfo_by_type.get(objtype)
+            if objinfo is None:
+                objinfo = {}
+                objinfo_by_type[objtype] = objinfo
+            for key, value in obj.items():
+                if key in ignored_object_keys:
+                    if objtype != "Plan" or key != "id":
+                        continue
+                    plan_id = value
+                    if shortened == "dest":
+                        destPlanId = plan_id
+                values = objinfo.get(key)
+                if values is None:
+                    values = []
+                    objinfo[key] = values
+                if isinstance(value, list):
+                    values.extend(value)
+                else:
+                    values.append(value)
+        for objtype, objinfo in objinfo_by_type.items():
+            for key, values in objinfo.items():
+                handler, keyname, extra, keep = self.get_object_column(
+                    shortened, objtype, key
+                )
+                if handler == USAGE_YEAR:
+                    values = sorted(values)
+                    newrow[keyname] = values[0]
+                    if keep:
+                        newrow[extra] = values[-1]
+                elif handler == JOINED:
+                    if not keep:
+                        continue
+                    if extra:
+                        iso3s = []
+                        for country in values:
+                            iso3 = self._get_countryiso(country)
+                            if iso3:
+                                iso3s.append(iso3)
+                        values = iso3s
+                    newrow[keyname] = ",".join(sorted(values))
+                else:
+                    if len(values) > 1:
+                        outputstr = "Multiple"
+                        logger.error(
+                            f"Multiple used instead of {values} for {keyname} in {plan_id} ({shortened})"
+                        )
+                    else:
+                        outputstr = values[0]
+                    if keep:
+                        newrow[keyname] = outputstr
+        return destPlanId
+
+    def transform(self, row, newrow=None):
+        if newrow is None:
+            newrow = {}
+        destPlanId = None
+        for key, value in row.items():
+            handler, column = self.get_flow_handler(key)
+            if handler == COPY:
+                newrow[column] = value
+            elif handler == OBJECTS:
+                newdestPlanId = self.flatten_objects(value, column, newrow)
+                if newdestPlanId:
+                    destPlanId = int(newdestPlanId)
+            elif handler == DATE:
+                if value:
+                    newrow[column] = value[:10]
+                else:
+                    newrow[column] = ""
+            elif handler == KEYWORDS:
+                if value:
+                    newrow[column] = ",".join(value)
+                else:
+                    newrow[column] = ""
+        if "originalAmount" not in newrow:
+            newrow["originalAmount"] = ""
+        if "originalCurrency" not in newrow:
+            newrow["originalCurrency"] = ""
+        if "refCode" not in newrow:
+            newrow["refCode"] = ""
+        newrow["destPlanCode"] = self._planidcodemapping.get(destPlanId, "")
+        return newrow
+
+    def append(self, row, flow_table):
+        """Transforms a flow into the reused row of a flow table and appends it
+        to the table's columns."""
+        flow_table.append(self.transform(row, flow_table.new_row()))
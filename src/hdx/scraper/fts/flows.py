@@ -1,188 +1,127 @@
 import logging
+from os.path import join
+from threading import Lock
 
-from hdx.utilities.dateparse import default_enddate, parse_date
-from hdx.utilities.dictandlist import dict_of_dicts_add, dict_of_lists_add
-from hdx.utilities.matching import multiple_replace
+from hdx.data.resource import Resource
+from hdx.utilities.dateparse import default_enddate
 
-from hdx.scraper.fts.resource_generator import ResourceGenerator
+from hdx.scraper.fts.flow_index import FlowIndex
+from hdx.scraper.fts.flow_table import FlowTable
+from hdx.scraper.fts.flow_transformer import FlowTransformer, date_keys
+from hdx.scraper.fts.resource_generator import (
+    ResourceGenerator,
+    generate_streamed_resource,
+)
+from hdx.scraper.fts.row_spill import RowSpill
 
 logger = logging.getLogger(__name__)
 
-srcdestmap = {"sourceObjects": "src", "destinationObjects": "dest"}
-
 
 class Flows(ResourceGenerator):
     def __init__(
-        self, configuration, downloader, folder, locations, planidcodemapping, today
+        self,
+        configuration,
+        downloader,
+        folder,
+        locations,
+        planidcodemapping,
+        today,
+        global_pull=False,
+        flow_store=None,
     ):
         super().__init__(downloader, folder)
         self._configuration = configuration
         self._locations = locations
         self._planidcodemapping = planidcodemapping
         self._latestyear = today.year
+        self._global_pull = global_pull
+        self._flow_store = flow_store
+        self._flow_index = None
+        self._global_rows_by_boundary = {}
+        self._lock = Lock()
+        self._transformer = FlowTransformer(configuration, locations, planidcodemapping)
 
-    def flatten_objects(self, objs, shortened, newrow):
-        objinfo_by_type = {}
-        plan_id = None
-        destPlanId = None
-        for obj in objs:
-            objtype = obj["type"]
-            objinfo = objinfo_by_type.get(objtype, {})
-            for key in obj:
-                if objtype == "Plan" and key == "id":
-                    plan_id = obj[key]
-                    dict_of_lists_add(objinfo, key, plan_id)
-                    if shortened == "dest":
-                        destPlanId = plan_id
-                if key not in ["type", "behavior", "id"]:
-                    value = obj[key]
-                    if isinstance(value, list):
-                        for element in value:
-                            dict_of_lists_add(objinfo, key, element)
-                    else:
-                        dict_of_lists_add(objinfo, key, value)
-            objinfo_by_type[objtype] = objinfo
-        for objtype in objinfo_by_type:
-            prefix = f"{shortened}{objtype}"
-            for key in objinfo_by_type[objtype]:
-                keyname = f"{prefix}{key.capitalize()}"
-                values = objinfo_by_type[objtype][key]
-                replacements = {
-                    "OrganizationOrganization": "Organization",
-                    "Name": "",
-                    "types": "Types",
-                    "code": "Code",
-                }
-                keyname = multiple_replace(keyname, replacements)
-                if "UsageYear" in keyname:
-                    values = sorted(values)
-                    newrow[f"{keyname}Start"] = values[0]
-                    outputstr = values[-1]
-                    keyname = f"{keyname}End"
-                elif any(
-                    x in keyname for x in ["Cluster", "Location", "OrganizationTypes"]
-                ):
-                    if keyname[-1] != "s":
-                        keyname = f"{keyname}s"
-                    if "Location" in keyname:
-                        iso3s = []
-                        for country in values:
-                            iso3 = self._locations.get_countryiso_from_name(country)
-                            if iso3:
-                                iso3s.append(iso3)
-                        values = iso3s
-                    outputstr = ",".join(sorted(values))
-                else:
-                    if len(values) > 1:
-                        outputstr = "Multiple"
-                        logger.error(
-                            f"Multiple used instead of {values} for {keyname} in {plan_id} ({shortened})"
-                        )
-                    else:
-                        outputstr = values[0]
-                if keyname in self._configuration["country_all_columns_to_keep"]:
-                    newrow[keyname] = outputstr
-        return destPlanId
+    def flatten_flow(self, row):
+        return self._transformer.transform(row)
+
+    def get_flow_index(self):
+        with self._lock:
+            if self._flow_index is None:
+                flow_index = FlowIndex(self._downloader, self._latestyear)
+                flow_index.build(self.flatten_flow)
+                self._flow_index = flow_index
+        return self._flow_index
 
-    def generate_country_resources(self, dataset, country):
-        fund_boundaries_info = {}
-        fund_data = []
-        base_funding_url = f"1/fts/flow/custom-search?locationid={country['id']}&"
-        funding_url = self._downloader.get_url(
-            f"{base_funding_url}year={self._latestyear}"
-        )
-        while funding_url:
-            json = self._downloader.download(url=funding_url, data=False)
-            fund_data.extend(json["data"]["flows"])
-            funding_url = json["meta"].get("nextLink")
+    def get_country_table(self, country):
+        flow_table = FlowTable(self._configuration["plans_headers"])
+        if self._flow_store:
+            self._flow_store.sync(self._downloader, self._latestyear, country["id"])
+            for row in self._flow_store.get_flows(self._latestyear, country["id"]):
+                self._transformer.append(row, flow_table)
+        elif self._global_pull:
+            for row in self.get_flow_index().get_rows(country["id"]):
+                flow_table.append(row)
+        else:
+            base_funding_url = f"1/fts/flow/custom-search?locationid={country['id']}&"
+            funding_url = self._downloader.get_url(
+                f"{base_funding_url}year={self._latestyear}"
+            )
+            for row in self._downloader.iterate_flows(url=funding_url):
+                self._transformer.append(row, flow_table)
+        return flow_table.build()
 
-        start_date = default_enddate
-        for row in fund_data:
-            newrow = {}
-            destPlanId = None
-            for key in row:
-                if key == "reportDetails":
-                    continue
-                value = row[key]
-                shortened = srcdestmap.get(key)
-                if shortened:
-                    newdestPlanId = self.flatten_objects(value, shortened, newrow)
-                    if newdestPlanId:
-                        destPlanId = int(newdestPlanId)
-                    continue
-                if key == "keywords":
-                    if value:
-                        newrow[key] = ",".join(value)
-                    else:
-                        newrow[key] = ""
-                    continue
-                if key in [
-                    "date",
-                    "firstReportedDate",
-                    "decisionDate",
-                    "createdAt",
-                    "updatedAt",
-                ]:
-                    if value:
-                        datestr = value[:10]
-                        newrow[key] = datestr
-                        date = parse_date(datestr)
-                        if date < start_date:
-                            start_date = date
-                    else:
-                        newrow[key] = ""
-                    continue
-                renamed_column = self._configuration["rename_columns"].get(key)
-                if renamed_column:
-                    newrow[renamed_column] = value
-                    continue
-                if key in self._configuration["country_all_columns_to_keep"]:
-                    newrow[key] = value
-            if "originalAmount" not in newrow:
-                newrow["originalAmount"] = ""
-            if "originalCurrency" not in newrow:
-                newrow["originalCurrency"] = ""
-            if "refCode" not in newrow:
-                newrow["refCode"] = ""
-            newrow["destPlanCode"] = self._planidcodemapping.get(destPlanId, "")
-            boundary = row["boundary"]
-            dict_of_lists_add(fund_boundaries_info, boundary, newrow)
+    def generate_country_resources(self, dataset, country, table=None):
+        if table is None:
+            table = self.get_country_table(country)
+        start_date = FlowTable.get_min_date(table, date_keys, default_enddate)
 
         countryiso3 = country["iso3"]
         resources = []
-        for boundary in sorted(fund_boundaries_info):
-            rows = sorted(
-                fund_boundaries_info[boundary], key=lambda k: k["date"], reverse=True
+        tables_by_boundary = FlowTable.partition(table, "boundary")
+        for boundary in sorted(tables_by_boundary):
+            boundary_table = FlowTable.sort(
+                tables_by_boundary[boundary], "date", reverse=True
             )
             filename = f"fts_{boundary}_funding_{countryiso3.lower()}.csv"
-            description = f"FTS {boundary.capitalize()} Funding Data for {country['name']} for {self._latestyear}"
-            success, results = self.generate_resource(
-                dataset,
-                rows,
-                country["iso3"],
-                headers=self._configuration["plans_headers"],
-                countryname=country["name"],
-                filename=filename,
-                description=description,
+            filepath = join(self._folder, filename)
+            headers = boundary_table.column_names
+            columns = FlowTable.get_columns(boundary_table)
+            FlowTable.write_csv(headers, columns, filepath)
+            resource = Resource(
+                {
+                    "name": filename,
+                    "description": f"FTS {boundary.capitalize()} Funding Data for {country['name']} for {self._latestyear}",
+                    "format": "csv",
+                }
             )
-            if success:
-                resources.append(results["resource"])
-            dict_of_dicts_add(self._global_rows, boundary, countryiso3, rows)
+            resource.set_format("csv")
+            resource.set_file_to_upload(filepath)
+            dataset.add_update_resource(resource)
+            resources.append(resource)
+            with self._lock:
+                global_rows = self._global_rows_by_boundary.get(boundary)
+                if global_rows is None:
+                    global_rows = RowSpill(self._folder)
+                    self._global_rows_by_boundary[boundary] = global_rows
+            global_rows.add(countryiso3, FlowTable.iterate_rows(headers, columns))
         return resources, start_date
 
-    def generate_global_resources(self, dataset):
-        for boundary in sorted(self._global_rows):
-            global_rows = self._global_rows[boundary]
-            rows = []
-            for countryiso3 in sorted(global_rows):
-                rows.extend(global_rows[countryiso3])
+    def generate_global_resources(self, dataset, columnar_output=None):
+        for boundary in sorted(self._global_rows_by_boundary):
+            global_rows = self._global_rows_by_boundary[boundary]
             filename = f"fts_{boundary}_funding_global.csv"
-            description = f"FTS {boundary.capitalize()} Funding Data globally for {self._latestyear}"
-            self.generate_resource(
+            resourcedata = {
+                "name": filename,
+                "description": f"FTS {boundary.capitalize()} Funding Data globally for {self._latestyear}",
+                "format": "csv",
+            }
+            generate_streamed_resource(
                 dataset,
-                rows,
-                "global",
-                headers=self._configuration["plans_headers"],
-                filename=filename,
-                description=description,
+                self._folder,
+                filename,
+                global_rows,
+                resourcedata,
+                self._configuration["plans_headers"],
+                columnar_output=columnar_output,
+                schema="plans_headers",
             )
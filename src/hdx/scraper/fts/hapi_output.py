@@ -2,133 +2,153 @@ from logging import getLogger
 
 from hdx.data.dataset import Dataset
 from hdx.location.country import Country
-from hdx.utilities.dateparse import (
-    iso_string_from_datetime,
-    parse_date,
-    parse_date_range,
-)
+from hdx.utilities.dateparse import iso_string_from_datetime
+
+from hdx.scraper.fts.dates import parse_iso_date, parse_year_range
+from hdx.scraper.fts.resource_generator import generate_streamed_resource
 
 logger = getLogger(__name__)
 
 
 class HAPIOutput:
-    def __init__(self, configuration, error_handler, global_results, today, folder):
+    def __init__(
+        self,
+        configuration,
+        error_handler,
+        global_results,
+        today,
+        folder,
+        columnar_output=None,
+    ):
         self._configuration = configuration
         self._error_handler = error_handler
         self._temp_dir = folder
         self._today = today
         self._global_results = global_results
+        self._columnar_output = columnar_output
+        self._flags = {}
+        self._dataset_id = None
+        self._dataset_name = None
+        self._resource_id = None
+        self._resource_name = None
+        self.start_date = None
+
+    def get_flags(self, countryiso3):
+        """Get HRP and GHO flags for a country memoized per country."""
+        flags = self._flags.get(countryiso3)
+        if flags is None:
+            flags = (
+                "Y" if Country.get_hrp_status_from_iso3(countryiso3) else "N",
+                "Y" if Country.get_gho_status_from_iso3(countryiso3) else "N",
+            )
+            self._flags[countryiso3] = flags
+        return flags
+
+    def add_error(self, message):
+        self._error_handler.add_message(
+            "Funding",
+            self._dataset_name,
+            message,
+            resource_name=self._resource_name,
+            err_to_hdx=True,
+        )
 
-    def generate_dataset(self) -> Dataset:
-        dataset = Dataset(self._configuration["hapi_dataset"])
-
-        global_data = []
-        duplicate_checks = []
-        start_dates = []
-
+    def transform_row(self, row, duplicate_checks):
+        """Validate and transform a global requirements and funding row into
+        a HAPI row returning it and its start date. duplicate_checks is the
+        set of (country, appeal code, start date) seen so far."""
+        countryiso3 = row["countryCode"]
+        errors = []
+        hapi_row = {"location_code": countryiso3}
+        hapi_row["has_hrp"], hapi_row["in_gho"] = self.get_flags(countryiso3)
+
+        appeal_code = row.get("code")
+        if not appeal_code:
+            appeal_code = "Not specified"
+        hapi_row["appeal_code"] = appeal_code
+
+        hapi_row["appeal_name"] = row.get("name")
+        hapi_row["appeal_type"] = row.get("typeName")
+        hapi_row["requirements_usd"] = row.get("requirements")
+
+        funding = row.get("funding")
+        if not funding:
+            funding = 0
+        if funding < 0:
+            self.add_error(f"Negative funding value found for {countryiso3}")
+            errors.append("Negative funding value")
+        hapi_row["funding_usd"] = funding
+
+        funding_pct = row.get("percentFunded")
+        if not funding_pct and row.get("requirements"):
+            funding_pct = 0
+        hapi_row["funding_pct"] = funding_pct
+
+        if row.get("startDate"):
+            start_date = parse_iso_date(row["startDate"])
+            end_date = parse_iso_date(row["endDate"])
+            if start_date > end_date:
+                self.add_error(f"Start date occurs after end date for {countryiso3}")
+                errors.append("Start date occurs after end date")
+        else:
+            start_date, end_date = parse_year_range(row["year"])
+        hapi_row["reference_period_start"] = iso_string_from_datetime(start_date)
+        hapi_row["reference_period_end"] = iso_string_from_datetime(end_date)
+
+        hapi_row["dataset_hdx_id"] = self._dataset_id
+        hapi_row["resource_hdx_id"] = self._resource_id
+
+        duplicate_check = (countryiso3, appeal_code, start_date)
+        if duplicate_check in duplicate_checks:
+            self.add_error(f"Duplicate row found for {countryiso3}")
+            errors.append("Duplicate row")
+        else:
+            duplicate_checks.add(duplicate_check)
+
+        hapi_row["warning"] = ""  # We have no warnings at present
+        hapi_row["error"] = "|".join(errors)
+        return hapi_row, start_date
+
+    def iterate_rows(self, rows):
+        """Transform rows as they are consumed keeping track of the earliest
+        start date in start_date."""
+        duplicate_checks = set()
+        for row in rows:
+            hapi_row, start_date = self.transform_row(row, duplicate_checks)
+            if self.start_date is None or start_date < self.start_date:
+                self.start_date = start_date
+            yield hapi_row
+
+    def set_global_resource(self):
         global_dataset = self._global_results["dataset"]
-        dataset_id = global_dataset["id"]
-        dataset_name = global_dataset["name"]
+        self._dataset_id = global_dataset["id"]
+        self._dataset_name = global_dataset["name"]
         global_resource = self._global_results["resource"]
-        resource_name = global_resource["name"]
-        resource_id = None
+        self._resource_name = global_resource["name"]
         for resource in global_dataset.get_resources():
-            if resource["name"] == resource_name:
-                resource_id = resource["id"]
+            if resource["name"] == self._resource_name:
+                self._resource_id = resource["id"]
                 break
 
-        for row in self._global_results["rows"]:
-            countryiso3 = row["countryCode"]
-            errors = []
-            hapi_row = {"location_code": countryiso3}
-            hapi_row["has_hrp"] = (
-                "Y" if Country.get_hrp_status_from_iso3(countryiso3) else "N"
-            )
-            hapi_row["in_gho"] = (
-                "Y" if Country.get_gho_status_from_iso3(countryiso3) else "N"
-            )
-
-            appeal_code = row.get("code")
-            if not appeal_code:
-                appeal_code = "Not specified"
-            hapi_row["appeal_code"] = appeal_code
-
-            hapi_row["appeal_name"] = row.get("name")
-            hapi_row["appeal_type"] = row.get("typeName")
-            hapi_row["requirements_usd"] = row.get("requirements")
-
-            funding = row.get("funding")
-            if not funding:
-                funding = 0
-            if funding < 0:
-                self._error_handler.add_message(
-                    "Funding",
-                    dataset_name,
-                    f"Negative funding value found for {countryiso3}",
-                    resource_name=resource_name,
-                    err_to_hdx=True,
-                )
-                errors.append("Negative funding value")
-            hapi_row["funding_usd"] = funding
-
-            funding_pct = row.get("percentFunded")
-            if not funding_pct and row.get("requirements"):
-                funding_pct = 0
-            hapi_row["funding_pct"] = funding_pct
-
-            if row.get("startDate"):
-                start_date = parse_date(row["startDate"])
-                end_date = parse_date(row["endDate"])
-                if start_date > end_date:
-                    self._error_handler.add_message(
-                        "Funding",
-                        dataset_name,
-                        f"Start date occurs after end date for {countryiso3}",
-                        resource_name=resource_name,
-                        err_to_hdx=True,
-                    )
-                    errors.append("Start date occurs after end date")
-            else:
-                start_date, end_date = parse_date_range(str(row["year"]))
-            start_dates.append(start_date)
-            hapi_row["reference_period_start"] = iso_string_from_datetime(start_date)
-            hapi_row["reference_period_end"] = iso_string_from_datetime(end_date)
-
-            hapi_row["dataset_hdx_id"] = dataset_id
-            hapi_row["resource_hdx_id"] = resource_id
-
-            duplicate_check = (countryiso3, hapi_row["appeal_code"], start_date)
-            if duplicate_check in duplicate_checks:
-                self._error_handler.add_message(
-                    "Funding",
-                    dataset_name,
-                    f"Duplicate row found for {countryiso3}",
-                    resource_name=resource_name,
-                    err_to_hdx=True,
-                )
-                errors.append("Duplicate row")
-            else:
-                duplicate_checks.append(duplicate_check)
-
-            hapi_row["warning"] = ""  # We have no warnings at present
-            hapi_row["error"] = "|".join(errors)
-            global_data.append(hapi_row)
-
-        start_date = min(start_dates)
-        dataset.set_time_period(start_date, self._today)
+    def generate_dataset(self) -> Dataset:
+        dataset = Dataset(self._configuration["hapi_dataset"])
+        self.set_global_resource()
 
         tags = ["funding", "humanitarian financial tracking service-fts"]
         dataset.add_tags(tags)
 
         dataset.add_other_location("world")
 
-        headers = self._configuration["hapi_headers"]
-        dataset.generate_resource(
+        generate_streamed_resource(
+            dataset,
             self._temp_dir,
             "hdx_hapi_funding_global.csv",
-            global_data,
+            self.iterate_rows(self._global_results["rows"]),
             self._configuration["hapi_resource"],
-            headers,
+            self._configuration["hapi_headers"],
             encoding="utf-8-sig",
+            columnar_output=self._columnar_output,
+            schema="hapi_headers",
         )
+        dataset.set_time_period(self.start_date, self._today)
         return dataset
@@ -8,23 +8,42 @@ Generates FTS datasets.
 """
 
 import logging
+from threading import Lock
 
-from hdx.utilities.dateparse import default_enddate, parse_date
+from hdx.utilities.dateparse import default_enddate
 from hdx.utilities.dictandlist import dict_of_lists_add
 
+from hdx.scraper.fts.country_context import CountryContext
+from hdx.scraper.fts.dates import parse_iso_date, parse_year_range
 from hdx.scraper.fts.flows import Flows
 from hdx.scraper.fts.requirements_funding import RequirementsFunding
 from hdx.scraper.fts.requirements_funding_cluster import RequirementsFundingCluster
 from hdx.scraper.fts.requirements_funding_covid import RequirementsFundingCovid
+from hdx.scraper.fts.run_profiler import RunProfiler
+from hdx.scraper.fts.snapshot_store import PLAN_OVERVIEW
 
 logger = logging.getLogger(__name__)
 
 
 class Pipeline:
     def __init__(
-        self, configuration, downloader, folder, locations, today, start_year=1998
+        self,
+        configuration,
+        downloader,
+        folder,
+        locations,
+        today,
+        start_year=1998,
+        global_flows=False,
+        flow_store=None,
+        columnar_output=None,
+        profiler=None,
     ):
         self._downloader = downloader
+        if profiler is None:
+            profiler = RunProfiler()
+        self._profiler = profiler
+        self._columnar_output = columnar_output
         self._today = today
         self._plans_by_year_by_country = {}
         self._planidcodemapping = {}
@@ -33,17 +52,28 @@ class Pipeline:
         self._reqfund = RequirementsFunding(
             downloader, folder, locations, self._globalplanids, today
         )
-        self.get_plans(start_year=start_year)
+        with profiler.measure("plans"):
+            self.get_plans(start_year=start_year)
         self._flows = Flows(
-            configuration, downloader, folder, locations, self._planidcodemapping, today
+            configuration,
+            downloader,
+            folder,
+            locations,
+            self._planidcodemapping,
+            today,
+            global_pull=global_flows and not downloader.get_countryiso3s(),
+            flow_store=flow_store,
         )
         self._others = self.setup_others(folder, locations)
+        self.prefetch_cluster_data(locations)
         self._start_date = default_enddate
+        self._lock = Lock()
 
     def setup_others(self, folder, locations):
-        covid = RequirementsFundingCovid(
-            self._downloader, folder, locations, self._plans_by_year_by_country
-        )
+        with self._profiler.measure("covid_funding"):
+            covid = RequirementsFundingCovid(
+                self._downloader, folder, locations, self._plans_by_year_by_country
+            )
         cluster = RequirementsFundingCluster(
             self._downloader, folder, self._planidswithonelocation
         )
@@ -56,11 +86,27 @@ class Pipeline:
         return {"covid": covid, "cluster": cluster, "globalcluster": globalcluster}
 
     def get_plans(self, start_year=1998):
-        for year in range(self._today.year, start_year, -1):
-            data = self._downloader.download(
-                f"2/fts/flow/plan/overview/progress/{year}"
-            )
-            plans = data["plans"]
+        years = list(range(self._today.year, start_year, -1))
+        requested_years = self._downloader.get_years()
+        if requested_years:
+            years = [year for year in years if str(year) in requested_years]
+        results = self._downloader.download_snapshots(
+            PLAN_OVERVIEW,
+            [
+                (
+                    0,
+                    year,
+                    parse_year_range(year)[1],
+                    f"2/fts/flow/plan/overview/progress/{year}",
+                )
+                for year in years
+            ],
+        )
+        year_plans = [(year, data["plans"]) for year, data in zip(years, results)]
+        self._reqfund.prefetch_location_splits(
+            plan for _, plans in year_plans for plan in plans
+        )
+        for year, plans in year_plans:
             for plan in plans:
                 planid = plan["id"]
                 self._planidcodemapping[planid] = plan["code"]
@@ -83,35 +129,76 @@ class Pipeline:
                         dict_of_lists_add(plans_by_year, year, plan)
                         self._plans_by_year_by_country[countryiso3] = plans_by_year
 
-    def call_others(self, row):
+    def prefetch_cluster_data(self, locations):
+        countryiso3s = {country["iso3"] for country in locations.countries}
+        planids = set()
+        for countryiso3, plans_by_year in self._plans_by_year_by_country.items():
+            if countryiso3 not in countryiso3s:
+                continue
+            for plans in plans_by_year.values():
+                for plan in plans:
+                    planid = plan["id"]
+                    if planid in self._planidswithonelocation:
+                        planids.add(planid)
+        planids = sorted(planids)
+        clusters = (self._others["cluster"], self._others["globalcluster"])
+        partial_urls = []
+        for cluster in clusters:
+            partial_urls.extend(cluster.get_partial_url(planid) for planid in planids)
+        results = self._downloader.download_many(partial_urls, return_exceptions=True)
+        for i, cluster in enumerate(clusters):
+            start = i * len(planids)
+            cluster.prefetch(planids, results[start : start + len(planids)])
+
+    def call_others(self, row, context):
         requirements_clusters, funding_clusters, notspecified, shared = self._others[
             "cluster"
         ].get_requirements_funding_plan(row)
         self._others["cluster"].generate_rows_requirements_funding(
-            row, requirements_clusters, funding_clusters, notspecified, shared
+            row, requirements_clusters, funding_clusters, notspecified, shared, context
         )
-        self._others["covid"].generate_plan_funding(row)
-        self._others["globalcluster"].generate_plan_requirements_funding(row)
+        self._others["covid"].generate_plan_funding(row, context)
+        self._others["globalcluster"].generate_plan_requirements_funding(row, context)
 
-    def generate_other_resources(self, resources, dataset, country):
+    def generate_other_resources(self, resources, dataset, context):
         resource = self._others["globalcluster"].generate_country_resource(
-            dataset, country
+            dataset, context
         )
         if resource:
             resources.insert(1, resource)
-        resource = self._others["cluster"].generate_country_resource(dataset, country)
+        resource = self._others["cluster"].generate_country_resource(dataset, context)
         if resource:
             resources.insert(1, resource)
-        resource = self._others["covid"].generate_country_resource(dataset, country)
+        resource = self._others["covid"].generate_country_resource(dataset, context)
         if resource:
             resources.insert(1, resource)
 
-    def generate_country_dataset_and_showcase(self, country, dataset):
+    def fetch_country(self, country):
+        """Fetch the data of a country from FTS returning a CountryContext
+        holding it. Funding by year is only fetched if there are flows and
+        plans for the country."""
+        context = CountryContext(country)
+        context.flow_table = self._flows.get_country_table(country)
+        plans_by_year = self._plans_by_year_by_country.get(country["iso3"])
+        if context.flow_table.num_rows != 0 and plans_by_year is not None:
+            context.funding_by_year = self._reqfund.get_country_funding(
+                country["id"], plans_by_year
+            )
+        return context
+
+    def generate_country_dataset_and_showcase(self, country, dataset, context=None):
         """
         api.hpc.tools/v1/public/fts/flow?countryISO3=CMR&Year=2016&groupby=cluster
-        """
 
-        resources, start_date = self._flows.generate_country_resources(dataset, country)
+        Per country state is kept in a CountryContext so that this can be
+        called for several countries at once. If no context from fetch_country
+        is given, the country's data is fetched first.
+        """
+        if context is None:
+            context = self.fetch_country(country)
+        resources, start_date = self._flows.generate_country_resources(
+            dataset, country, context.flow_table
+        )
         if len(resources) == 0:
             logger.warning("No requirements or funding data available")
             return False
@@ -124,25 +211,33 @@ class Pipeline:
             )
         else:
             resource, reqfund_start_year = self._reqfund.generate_country_resource(
-                dataset, plans_by_year, country, self.call_others
+                dataset,
+                plans_by_year,
+                country,
+                lambda row: self.call_others(row, context),
+                context.funding_by_year,
             )
-            reqfund_start_date = parse_date(f"{reqfund_start_year}-01-01")
+            reqfund_start_date = parse_iso_date(f"{reqfund_start_year}-01-01")
             if reqfund_start_date < start_date:
                 start_date = reqfund_start_date
             resources.insert(0, resource)
-            self.generate_other_resources(resources, dataset, country)
+            self.generate_other_resources(resources, dataset, context)
         dataset._resources = resources
         dataset.set_time_period(start_date, self._today)
-        if start_date < self._start_date:
-            self._start_date = start_date
+        with self._lock:
+            if start_date < self._start_date:
+                self._start_date = start_date
         return True
 
     def generate_global_dataset(self, dataset):
-        success, results = self._reqfund.generate_global_resource(dataset)
-        self._others["covid"].generate_global_resource(dataset)
-        self._others["cluster"].generate_global_resource(dataset)
-        self._others["globalcluster"].generate_global_resource(dataset)
-        self._flows.generate_global_resources(dataset)
+        columnar_output = self._columnar_output
+        success, results = self._reqfund.generate_global_resource(
+            dataset, columnar_output
+        )
+        self._others["covid"].generate_global_resource(dataset, columnar_output)
+        self._others["cluster"].generate_global_resource(dataset, columnar_output)
+        self._others["globalcluster"].generate_global_resource(dataset, columnar_output)
+        self._flows.generate_global_resources(dataset, columnar_output)
         dataset.set_time_period(self._start_date, self._today)
         results["dataset"] = dataset
         return results
@@ -1,6 +1,8 @@
 import logging
 
+from hdx.scraper.fts.dates import parse_iso_date, parse_year_range
 from hdx.scraper.fts.resource_generator import ResourceGenerator
+from hdx.scraper.fts.snapshot_store import LOCATION_SPLIT, TRENDS
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +15,30 @@ class RequirementsFunding(ResourceGenerator):
         self._today = today
         self._filename = "fts_requirements_funding"
         self._description = "FTS Annual Requirements and Funding Data"
+        self._location_splits = {}
+
+    @staticmethod
+    def needs_location_split(plan):
+        countries = plan["countries"]
+        if not countries or len(countries) == 1:
+            return False
+        return plan.get("customLocationCode") != "COVD"
+
+    @staticmethod
+    def get_location_split_url(planid):
+        return f"1/fts/flow/custom-search?planid={planid}&groupby=location"
+
+    def prefetch_location_splits(self, plans):
+        plans = {plan["id"]: plan for plan in plans if self.needs_location_split(plan)}
+        planids = sorted(plans)
+        requests = []
+        for planid in planids:
+            end_date = parse_iso_date(plans[planid]["endDate"])
+            requests.append(
+                (planid, end_date.year, end_date, self.get_location_split_url(planid))
+            )
+        results = self._downloader.download_snapshots(LOCATION_SPLIT, requests)
+        self._location_splits.update(zip(planids, results))
 
     def add_country_requirements_funding(self, planid, plan, countries):
         if len(countries) == 1:
@@ -33,8 +59,9 @@ class RequirementsFunding(ResourceGenerator):
         else:
             if plan.get("customLocationCode") == "COVD":
                 return True
-            funding_url = f"1/fts/flow/custom-search?planid={planid}&groupby=location"
-            data = self._downloader.download(funding_url)
+            data = self._location_splits.get(planid)
+            if data is None:
+                data = self._downloader.download(self.get_location_split_url(planid))
             requirements = data.get("requirements")
             country_requirements = {}
             if requirements is not None:
@@ -70,14 +97,30 @@ class RequirementsFunding(ResourceGenerator):
                     country["percentFunded"] = int(funding / requirements * 100 + 0.5)
         return False
 
+    @staticmethod
+    def get_trends_end_date(year):
+        """Country trends for a year cover the 5 years either side of it so
+        they change until the last of those years has ended"""
+        return parse_year_range(year + 5)[1]
+
     def get_country_funding(self, countryid, plans_by_year, start_year=2010):
         funding_by_year = {}
         if plans_by_year is not None:
             start_year = sorted(plans_by_year.keys())[0]
-        for year in range(self._today.year + 5, start_year - 5, -11):
-            data = self._downloader.download(
-                f"2/country/{countryid}/summary/trends/{year}"
-            )
+        years = range(self._today.year + 5, start_year - 5, -11)
+        results = self._downloader.download_snapshots(
+            TRENDS,
+            [
+                (
+                    countryid,
+                    year,
+                    self.get_trends_end_date(year),
+                    f"2/country/{countryid}/summary/trends/{year}",
+                )
+                for year in years
+            ],
+        )
+        for data in results:
             for object in data:
                 year = object["year"]
                 funding = object["totalFunding"]
@@ -86,11 +129,17 @@ class RequirementsFunding(ResourceGenerator):
         return funding_by_year
 
     def generate_country_resource(
-        self, dataset, plans_by_year, country, call_others=lambda x: None
+        self,
+        dataset,
+        plans_by_year,
+        country,
+        call_others=lambda x: None,
+        funding_by_year=None,
     ):
         countryiso3 = country["iso3"]
         countryname = country["name"]
-        funding_by_year = self.get_country_funding(country["id"], plans_by_year)
+        if funding_by_year is None:
+            funding_by_year = self.get_country_funding(country["id"], plans_by_year)
         rows = []
 
         all_years = sorted(
@@ -161,7 +210,7 @@ class RequirementsFunding(ResourceGenerator):
                     "percentFunded": "",
                 }
             )
-        self._global_rows[countryname] = rows
+        self._global_rows.add(countryname, rows)
         _, results = self.generate_resource(
             dataset, rows, countryiso3, countryname=countryname
         )
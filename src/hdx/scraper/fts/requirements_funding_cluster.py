@@ -13,9 +13,7 @@ class RequirementsFundingCluster(ResourceGenerator):
         super().__init__(downloader, folder)
         self._planidswithonelocation = planidswithonelocation
         self._clusterlevel = clusterlevel
-        self._rows = []
-        self._iso3_latestdata = {}
-        self._iso3_latestpopulated = {}
+        self._prefetched = {}
         self._filename = f"fts_requirements_funding_{clusterlevel}cluster"
         self._description = "FTS Annual Requirements and Funding Data by Cluster"
         if clusterlevel:
@@ -23,15 +21,37 @@ class RequirementsFundingCluster(ResourceGenerator):
                 "Cluster", f"{clusterlevel.capitalize()} Cluster"
             )
 
+    def get_partial_url(self, planid):
+        return f"1/fts/flow/custom-search?planid={planid}&groupby={self._clusterlevel}cluster"
+
+    def prefetch(self, planids, results):
+        for planid, data in zip(planids, results):
+            if isinstance(data, DownloadError):
+                self._prefetched[planid] = None
+            elif isinstance(data, Exception):
+                raise data
+            else:
+                self._prefetched[planid] = self.parse_requirements_funding(planid, data)
+
     def get_requirements_funding_plan(self, inrow):
         planid = inrow["id"]
-        try:
-            data = self._downloader.download(
-                f"1/fts/flow/custom-search?planid={planid}&groupby={self._clusterlevel}cluster"
-            )
-        except DownloadError:
+        if planid not in self._planidswithonelocation:
+            return None, None, None, None
+        if planid in self._prefetched:
+            results = self._prefetched[planid]
+        else:
+            try:
+                data = self._downloader.download(self.get_partial_url(planid))
+                results = self.parse_requirements_funding(planid, data)
+            except DownloadError:
+                results = None
+        if results is None:
             logger.error(f"Problem with downloading cluster data for {planid}!")
             return None, None, None, None
+        return results
+
+    @staticmethod
+    def parse_requirements_funding(planid, data):
         requirements_clusters = {}
         for reqobject in data["requirements"]["objects"]:
             requirements = reqobject.get("revisedRequirements")
@@ -71,7 +91,13 @@ class RequirementsFundingCluster(ResourceGenerator):
         return row
 
     def generate_rows_requirements_funding(
-        self, inrow, requirements_clusters, funding_clusters, notspecified, shared
+        self,
+        inrow,
+        requirements_clusters,
+        funding_clusters,
+        notspecified,
+        shared,
+        context,
     ):
         if requirements_clusters is None and funding_clusters is None:
             return
@@ -84,11 +110,10 @@ class RequirementsFundingCluster(ResourceGenerator):
         del base_row["requirements"]
         del base_row["funding"]
         del base_row["percentFunded"]
-        countryiso3 = base_row["countryCode"]
+        rows = context.get_rows(self._filename)
+        latestpopulated = context.latestpopulated
         year = base_row["year"]
-        if year >= self._iso3_latestdata.get(countryiso3, year):
-            self._iso3_latestdata[countryiso3] = year
-        year = max(year, self._iso3_latestpopulated.get(countryiso3, year))
+        year = max(year, latestpopulated.get(self._filename, year))
         subrows = []
         for clusterid, (fundname, funding) in funding_clusters.items():
             requirements_cluster = requirements_clusters.get(clusterid)
@@ -101,7 +126,7 @@ class RequirementsFundingCluster(ResourceGenerator):
             row = self.create_row(base_row, clusterid, fundname, requirements, funding)
             if requirements and funding != "":
                 row["percentFunded"] = int(funding / requirements * 100 + 0.5)
-                self._iso3_latestpopulated[countryiso3] = year
+                latestpopulated[self._filename] = year
             else:
                 row["percentFunded"] = ""
             subrows.append(row)
@@ -113,16 +138,16 @@ class RequirementsFundingCluster(ResourceGenerator):
             row = self.create_row(base_row, clusterid, reqname, requirements)
             subrows.append(row)
 
-        self._rows.extend(sorted(subrows, key=lambda k: k["cluster"]))
+        rows.extend(sorted(subrows, key=lambda k: k["cluster"]))
 
         row = self.create_row(base_row, name="Not specified", funding=notspecified)
-        self._rows.append(row)
+        rows.append(row)
         row = self.create_row(
             base_row, name="Multiple clusters/sectors (shared)", funding=shared
         )
-        self._rows.append(row)
+        rows.append(row)
 
-    def generate_plan_requirements_funding(self, inrow):
+    def generate_plan_requirements_funding(self, inrow, context):
         (
             requirements_clusters,
             funding_clusters,
@@ -130,18 +155,23 @@ class RequirementsFundingCluster(ResourceGenerator):
             shared,
         ) = self.get_requirements_funding_plan(inrow)
         self.generate_rows_requirements_funding(
-            inrow, requirements_clusters, funding_clusters, notspecified, shared
+            inrow,
+            requirements_clusters,
+            funding_clusters,
+            notspecified,
+            shared,
+            context,
         )
 
-    def generate_country_resource(self, dataset, country):
-        if not self._rows:
+    def generate_country_resource(self, dataset, context):
+        rows = context.get_rows(self._filename)
+        if not rows:
             return None
-        countryiso3 = country["iso3"]
+        countryiso3 = context.countryiso3
         success, results = self.generate_resource(
-            dataset, self._rows, countryiso3, countryname=country["name"]
+            dataset, rows, countryiso3, countryname=context.country["name"]
         )
-        self._global_rows[countryiso3] = self._rows
-        self._rows = []
+        self._global_rows.add(countryiso3, rows)
         if success:
             return results["resource"]
         else:
@@ -9,8 +9,8 @@ logger = logging.getLogger(__name__)
 class RequirementsFundingCovid(ResourceGenerator):
     def __init__(self, downloader, folder, locations, plans_by_year_by_country):
         super().__init__(downloader, folder)
+        # COVID funding keyed by (plan id, country iso3)
         self._covidfundingbyplanandlocation = {}
-        self._rows = []
         self._get_covid_funding(locations.get_id_to_iso3(), plans_by_year_by_country)
         self._filename = "fts_requirements_funding_covid"
         self._description = "FTS Annual Requirements, Funding and Covid Funding Data"
@@ -18,6 +18,7 @@ class RequirementsFundingCovid(ResourceGenerator):
     def _get_covid_funding(
         self, locationid_to_iso3, plans_by_year_by_country, covidstartyear=2020
     ):
+        requested_countryiso3s = self._downloader.get_countryiso3s()
         multiplecountry_planids = {}
         planid_to_country = {}
         for plans_by_year in plans_by_year_by_country.values():
@@ -26,6 +27,9 @@ class RequirementsFundingCovid(ResourceGenerator):
                     continue
                 for plan in plans_by_year[year]:
                     planid = str(plan["id"])
+                    # Plans with several countries appear under each of them
+                    if planid in multiplecountry_planids:
+                        continue
                     countryiso3s = set()
                     for country in plan["countries"]:
                         adminlevel = country.get(
@@ -33,28 +37,42 @@ class RequirementsFundingCovid(ResourceGenerator):
                         )
                         if adminlevel == 0:
                             countryiso3s.add(country["iso3"])
+                    if requested_countryiso3s and countryiso3s.isdisjoint(
+                        requested_countryiso3s
+                    ):
+                        continue
                     if len(countryiso3s) == 1:
                         planid_to_country[planid] = countryiso3s.pop()
                     else:
                         multiplecountry_planids[planid] = countryiso3s
 
-        onecountry_planids = ",".join(sorted(planid_to_country.keys()))
-        data = self._downloader.download(
-            f"1/fts/flow/custom-search?emergencyid=911&planid={onecountry_planids}&groupby=plan"
-        )
-        for fundingobject in data["report3"]["fundingTotals"]["objects"][0][
-            "objectsBreakdown"
-        ]:
-            planid = fundingobject.get("id")
-            countryiso3 = planid_to_country[planid]
-            self._covidfundingbyplanandlocation[f"{planid}-{countryiso3}"] = (
-                fundingobject["totalFunding"]
+        if planid_to_country:
+            onecountry_planids = ",".join(sorted(planid_to_country.keys()))
+            data = self._downloader.download(
+                f"1/fts/flow/custom-search?emergencyid=911&planid={onecountry_planids}&groupby=plan"
             )
+            for fundingobject in data["report3"]["fundingTotals"]["objects"][0][
+                "objectsBreakdown"
+            ]:
+                planid = fundingobject.get("id")
+                countryiso3 = planid_to_country[planid]
+                self._covidfundingbyplanandlocation[(int(planid), countryiso3)] = (
+                    fundingobject["totalFunding"]
+                )
 
-        for planid in multiplecountry_planids:
-            data = self._downloader.download(
+        # Location breakdowns of several plans cannot be split apart from a
+        # combined query so they are requested per plan in one batch. The
+        # batch shares the global rate limit so it still takes at least one
+        # rate limit period (1s by default) per plan: concurrency only overlaps
+        # the latency of the requests.
+        planids = sorted(multiplecountry_planids)
+        results = self._downloader.download_many(
+            [
                 f"1/fts/flow/custom-search?emergencyid=911&planid={planid}&groupby=location"
-            )
+                for planid in planids
+            ]
+        )
+        for planid, data in zip(planids, results):
             fundingobjects = data["report3"]["fundingTotals"]["objects"]
             if len(fundingobjects) == 0:
                 continue
@@ -62,16 +80,14 @@ class RequirementsFundingCovid(ResourceGenerator):
                 locationid = int(fundingobject["id"])
                 countryiso3 = locationid_to_iso3.get(locationid)
                 if countryiso3:
-                    self._covidfundingbyplanandlocation[f"{planid}-{countryiso3}"] = (
+                    self._covidfundingbyplanandlocation[(int(planid), countryiso3)] = (
                         fundingobject["totalFunding"]
                     )
 
-    def generate_plan_funding(self, inrow):
+    def generate_plan_funding(self, inrow, context):
         planid = inrow["id"]
         countryiso3 = inrow["countryCode"]
-        covidfunding = self._covidfundingbyplanandlocation.get(
-            f"{planid}-{countryiso3}"
-        )
+        covidfunding = self._covidfundingbyplanandlocation.get((planid, countryiso3))
         if covidfunding is None:
             logger.info(
                 f"Location {countryiso3} of plan {planid} has no COVID component!"
@@ -83,17 +99,17 @@ class RequirementsFundingCovid(ResourceGenerator):
         row["covidPercentageOfFunding"] = int(
             covidfunding / inrow["funding"] * 100 + 0.5
         )
-        self._rows.append(row)
+        context.get_rows(self._filename).append(row)
 
-    def generate_country_resource(self, dataset, country):
-        if not self._rows:
+    def generate_country_resource(self, dataset, context):
+        rows = context.get_rows(self._filename)
+        if not rows:
             return None
-        countryiso3 = country["iso3"]
+        countryiso3 = context.countryiso3
         success, results = self.generate_resource(
-            dataset, self._rows, countryiso3, countryname=country["name"]
+            dataset, rows, countryiso3, countryname=context.country["name"]
         )
-        self._global_rows[countryiso3] = self._rows
-        self._rows = []
+        self._global_rows.add(countryiso3, rows)
         if success:
             return results["resource"]
         else:
@@ -1,13 +1,68 @@
 import logging
+from csv import writer
+from itertools import chain
+from os.path import join
+
+from hdx.data.resource import Resource
+
+from hdx.scraper.fts.row_spill import RowSpill
 
 logger = logging.getLogger(__name__)
 
 
+def generate_streamed_resource(
+    dataset,
+    folder,
+    filename,
+    rows,
+    resourcedata,
+    headers,
+    encoding="utf-8",
+    columnar_output=None,
+    schema=None,
+):
+    """Write an iterable of row dicts to a CSV as it is consumed and add the
+    CSV as a resource of the dataset. Unlike dataset.generate_resource, rows
+    are not kept so outputs larger than memory can be written. If a columnar
+    output is given, it is fed from the same pass over the rows.
+
+    Returns:
+        (True if resource added, dictionary with resource and headers)
+    """
+    rows = iter(rows)
+    first_row = next(rows, None)
+    if first_row is None:
+        logger.error(f"No data rows in {filename}!")
+        return False, {}
+    filepath = join(folder, filename)
+    resource = Resource(resourcedata)
+    resource.set_format("csv")
+    resource.set_file_to_upload(filepath)
+    dataset.add_update_resource(resource)
+    with open(filepath, "w", encoding=encoding, newline="") as file:
+        csv_writer = writer(file, lineterminator="\n")
+        csv_writer.writerow(headers)
+
+        def write_rows():
+            for row in chain((first_row,), rows):
+                csv_writer.writerow([row.get(header) for header in headers])
+                yield row
+
+        if columnar_output:
+            columnar_output.generate_resources(
+                dataset, resource, write_rows(), headers, schema
+            )
+        else:
+            for _ in write_rows():
+                pass
+    return True, {"resource": resource, "headers": headers}
+
+
 class ResourceGenerator:
     def __init__(self, downloader, folder):
         self._downloader = downloader
         self._folder = folder
-        self._global_rows = {}
+        self._global_rows = RowSpill(folder)
         self._filename = ""
         self._description = ""
 
@@ -41,8 +96,23 @@ class ResourceGenerator:
         )
         return success, results
 
-    def generate_global_resource(self, dataset):
-        rows = []
-        for countryiso3 in sorted(self._global_rows):
-            rows.extend(self._global_rows[countryiso3])
-        return self.generate_resource(dataset, rows, "global")
+    def generate_global_resource(self, dataset, columnar_output=None):
+        filename = f"{self._filename}_global.csv"
+        resourcedata = {
+            "name": filename,
+            "description": f"{self._description} globally",
+            "format": "csv",
+        }
+        success, results = generate_streamed_resource(
+            dataset,
+            self._folder,
+            filename,
+            self._global_rows,
+            resourcedata,
+            self._global_rows.get_headers(),
+            columnar_output=columnar_output,
+            schema="requirements_headers",
+        )
+        if success:
+            results["rows"] = self._global_rows
+        return success, results
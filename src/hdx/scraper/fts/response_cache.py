@@ -0,0 +1,218 @@
+import logging
+import re
+import sqlite3
+import zlib
+from threading import Lock
+from time import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# Patterns of urls that refer to a year and the number of years after it that
+# their data covers (country trends cover the 5 years either side of the year)
+year_patterns = (
+    (re.compile(r"/plan/overview/progress/(\d{4})"), 0),
+    (re.compile(r"/summary/trends/(\d{4})"), 5),
+    (re.compile(r"[?&]year=(\d{4})"), 0),
+)
+
+
+class CacheEntry:
+    def __init__(self, body, etag, last_modified, expires):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+    def is_fresh(self):
+        return time() < self.expires
+
+    def get_validators(self):
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """On disk cache of FTS responses keyed by normalised url. Responses are
+    stored zlib compressed in SQLite which handles locking so that the cache
+    can be shared by several processes. Entries for endpoints that refer to a
+    year before the current year are kept for longer than others. When the
+    cache exceeds max_size bytes, the least recently used entries are evicted.
+    The total size is kept up to date in the cache_size table on each insert
+    or eviction rather than summed every time.
+    """
+
+    def __init__(
+        self,
+        path,
+        current_year,
+        current_year_ttl=3600,
+        closed_year_ttl=30 * 24 * 3600,
+        default_ttl=3600,
+        max_size=512 * 1024 * 1024,
+    ):
+        self._current_year = current_year
+        self._current_year_ttl = current_year_ttl
+        self._closed_year_ttl = closed_year_ttl
+        self._default_ttl = default_ttl
+        self._max_size = max_size
+        self._lock = Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, "
+            "body BLOB, etag TEXT, last_modified TEXT, expires REAL, "
+            "last_access REAL, size INTEGER)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access "
+            "ON responses (last_access)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY "
+            "CHECK (id = 0), size INTEGER)"
+        )
+        self._connection.execute(
+            "INSERT OR IGNORE INTO cache_size "
+            "SELECT 0, COALESCE(SUM(size), 0) FROM responses"
+        )
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.network_time = 0.0
+
+    @staticmethod
+    def normalise_url(url):
+        split = urlsplit(url)
+        query = urlencode(sorted(parse_qsl(split.query, keep_blank_values=True)))
+        return urlunsplit(
+            (split.scheme.lower(), split.netloc.lower(), split.path, query, "")
+        )
+
+    def get_ttl(self, key):
+        for pattern, years_after in year_patterns:
+            match = pattern.search(key)
+            if match:
+                if int(match.group(1)) + years_after < self._current_year:
+                    return self._closed_year_ttl
+                return self._current_year_ttl
+        return self._default_ttl
+
+    def get(self, url):
+        key = self.normalise_url(url)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT body, etag, last_modified, expires FROM responses "
+                "WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (time(), key)
+            )
+        body, etag, last_modified, expires = row
+        return CacheEntry(zlib.decompress(body), etag, last_modified, expires)
+
+    def set(self, url, body, etag=None, last_modified=None):
+        key = self.normalise_url(url)
+        compressed = zlib.compress(body)
+        now = time()
+        size = len(compressed)
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute(
+                    "SELECT size FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    size -= row[0]
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        key,
+                        compressed,
+                        etag,
+                        last_modified,
+                        now + self.get_ttl(key),
+                        now,
+                        len(compressed),
+                    ),
+                )
+                self._connection.execute(
+                    "UPDATE cache_size SET size = size + ? WHERE id = 0", (size,)
+                )
+                self._evict()
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def refresh(self, url):
+        key = self.normalise_url(url)
+        with self._lock:
+            self._connection.execute(
+                "UPDATE responses SET expires = ? WHERE key = ?",
+                (time() + self.get_ttl(key), key),
+            )
+
+    def get_size(self):
+        with self._lock:
+            (total_size,) = self._connection.execute(
+                "SELECT size FROM cache_size WHERE id = 0"
+            ).fetchone()
+        return total_size
+
+    def _evict(self):
+        (total_size,) = self._connection.execute(
+            "SELECT size FROM cache_size WHERE id = 0"
+        ).fetchone()
+        if total_size <= self._max_size:
+            return
+        keys = []
+        evicted_size = 0
+        for key, size in self._connection.execute(
+            "SELECT key, size FROM responses ORDER BY last_access"
+        ):
+            if total_size - evicted_size <= self._max_size:
+                break
+            keys.append((key,))
+            evicted_size += size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self._connection.execute(
+            "UPDATE cache_size SET size = size - ? WHERE id = 0", (evicted_size,)
+        )
+
+    def record(self, outcome, network_time=0.0):
+        with self._lock:
+            if outcome == "hit":
+                self.hits += 1
+            elif outcome == "revalidated":
+                self.revalidated += 1
+            else:
+                self.misses += 1
+            self.network_time += network_time
+
+    def log_stats(self):
+        requests = self.hits + self.revalidated + self.misses
+        if requests == 0:
+            return
+        fetches = self.revalidated + self.misses
+        if fetches:
+            saved = self.hits * self.network_time / fetches
+        else:
+            saved = 0.0
+        logger.info(
+            f"FTS response cache: {self.hits} hits, {self.revalidated} revalidated, "
+            f"{self.misses} misses ({self.hits / requests:.0%} hit rate). "
+            f"Estimated network time saved: {saved:.0f}s"
+        )
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,66 @@
+class ResponseFilter:
+    """Filters the data of FTS responses down to the given countries and/or
+    years in a single pass. Plans are kept if they have no countries or any of
+    their countries match and then if any of their usage years match. Lists of
+    objects with iso3 keys are kept if the iso3 is present and matches and
+    those with year keys if the year matches. Each filter method returns a new
+    list leaving its input unchanged.
+    """
+
+    def __init__(self, countryiso3s=None, years=None):
+        if countryiso3s:
+            self.countryiso3s = frozenset(countryiso3s)
+        else:
+            self.countryiso3s = None
+        if years:
+            self.years = frozenset(years)
+        else:
+            self.years = None
+
+    def is_active(self):
+        return self.countryiso3s is not None or self.years is not None
+
+    def keep_plan(self, plan):
+        if self.countryiso3s:
+            countries = plan["countries"]
+            if countries and not any(
+                country["iso3"] in self.countryiso3s for country in countries
+            ):
+                return False
+        if self.years:
+            return any(year["year"] in self.years for year in plan["usageYears"])
+        return True
+
+    def keep_object(self, object):
+        if "iso3" in object:
+            countryiso3 = object["iso3"]
+            if countryiso3 is None:
+                return False
+            if self.countryiso3s and countryiso3 not in self.countryiso3s:
+                return False
+        if "year" in object and self.years:
+            return str(object["year"]) in self.years
+        return True
+
+    def filter_plans(self, plans):
+        if not self.is_active():
+            return list(plans)
+        return [plan for plan in plans if self.keep_plan(plan)]
+
+    def filter_objects(self, objects):
+        if not self.is_active():
+            return list(objects)
+        return [object for object in objects if self.keep_object(object)]
+
+    def filter_data(self, data):
+        """Filter the data of a response. For a dict, its plans are filtered
+        in place of the original list and for a list, a new list is returned.
+        """
+        if isinstance(data, dict):
+            plans = data.get("plans")
+            if plans is not None:
+                data["plans"] = self.filter_plans(plans)
+            return data
+        if self.is_active():
+            return self.filter_objects(data)
+        return data
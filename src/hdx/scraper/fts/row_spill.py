@@ -0,0 +1,59 @@
+from json import dumps, loads
+from tempfile import TemporaryFile
+from threading import Lock
+
+
+class RowSpill:
+    """Rows spilled to a temporary JSON lines file in blocks keyed by country
+    so that they need not be held in memory until the global resources are
+    generated. Adding rows for a key that already exists replaces them. The
+    rows are read back one block at a time in sorted key order so the output
+    does not depend on the order in which keys were added. Iterating over the
+    spill reads the rows back so it can be passed wherever a list of rows was.
+    """
+
+    def __init__(self, folder):
+        self._folder = folder
+        self._file = None
+        self._blocks = {}
+        self._lock = Lock()
+
+    def add(self, key, rows):
+        headers = None
+        lines = []
+        for row in rows:
+            if headers is None:
+                headers = list(row.keys())
+            lines.append(dumps(row, separators=(",", ":")).encode("utf-8"))
+            lines.append(b"\n")
+        with self._lock:
+            if self._file is None:
+                self._file = TemporaryFile(dir=self._folder, suffix=".jsonl")
+            file = self._file
+            file.seek(0, 2)
+            start = file.tell()
+            file.writelines(lines)
+            size = file.tell() - start
+            self._blocks[key] = (start, size, headers, len(lines) // 2)
+
+    def get_headers(self):
+        for key in sorted(self._blocks):
+            headers = self._blocks[key][2]
+            if headers:
+                return headers
+        return None
+
+    def iterate(self):
+        for key in sorted(self._blocks):
+            start, size, _, _ = self._blocks[key]
+            with self._lock:
+                self._file.seek(start)
+                block = self._file.read(size)
+            for line in block.splitlines():
+                yield loads(line)
+
+    def __iter__(self):
+        return self.iterate()
+
+    def __len__(self):
+        return sum(block[3] for block in self._blocks.values())
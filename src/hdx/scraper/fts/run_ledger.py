@@ -0,0 +1,189 @@
+import sqlite3
+import sys
+from csv import reader
+from glob import glob
+from json import dumps, loads
+from os.path import basename, join
+from statistics import median
+from urllib.parse import urlsplit
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Changes below these amounts are never reported whatever the ratio
+min_changes = {
+    "seconds": 2.0,
+    "requests": 2,
+    "pages": 1,
+    "bytes": 1024 * 1024,
+    "mb": 50.0,
+}
+
+
+class RunLedger:
+    """SQLite ledger with a compact JSON record of each run: total and per
+    stage wall time, time per country, requests, failures, bytes, time and
+    pages per endpoint, pages per flow search, cache hit rate, peak RSS and
+    rows per output file along with its status: success, failed (it raised an
+    exception) or interrupted (for example, by a timeout). Only the latest
+    keep_runs runs are kept. compare finds the costs of the latest run that
+    jumped compared with the median of the successful runs before it.
+    """
+
+    def __init__(self, path, keep_runs=400):
+        self._keep_runs = keep_runs
+        self._connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "started_at TEXT, record TEXT)"
+        )
+
+    @staticmethod
+    def get_peak_rss_mb():
+        if resource is None:
+            return None
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        if sys.platform == "darwin":
+            return peak_rss / 1024 / 1024
+        return peak_rss / 1024
+
+    @staticmethod
+    def count_rows(folder):
+        rows = {}
+        for path in sorted(glob(join(folder, "*.csv"))):
+            with open(path, newline="", encoding="utf-8-sig") as file:
+                rows[basename(path)] = max(sum(1 for _ in reader(file)) - 1, 0)
+        return rows
+
+    @staticmethod
+    def get_search_key(url):
+        split = urlsplit(url)
+        path = split.path.rsplit("/", 1)[-1]
+        if split.query:
+            return f"{path}?{split.query}"
+        return path
+
+    @classmethod
+    def create_record(
+        cls, started_at, seconds, timings, download_stats, folder, status="success"
+    ):
+        """Create a record of a run from the stage timings of a RunProfiler, a
+        DownloadStats and the folder of output files"""
+        stages = {stage: timing["seconds"] for stage, timing in timings.items()}
+        countries = timings.get("country", {}).get("items", {})
+        report = download_stats.get_report()
+        total = report.pop("total")
+        endpoints = {}
+        for endpoint, figures in report.items():
+            endpoints[endpoint] = {
+                key: figures[key]
+                for key in ("requests", "cached", "failures", "bytes", "seconds")
+            }
+            if "pages" in figures:
+                endpoints[endpoint]["pages"] = figures["pages"]
+        responses = total["requests"] + total["cached"]
+        if responses:
+            cache_hit_rate = round(total["cached"] / responses, 3)
+        else:
+            cache_hit_rate = None
+        peak_rss_mb = cls.get_peak_rss_mb()
+        if peak_rss_mb is not None:
+            peak_rss_mb = round(peak_rss_mb, 1)
+        return {
+            "started_at": started_at.isoformat(timespec="seconds"),
+            "status": status,
+            "seconds": round(seconds, 3),
+            "stages": stages,
+            "countries": countries,
+            "requests": total["requests"],
+            "failures": total["failures"],
+            "bytes": total["bytes"],
+            "cache_hit_rate": cache_hit_rate,
+            "peak_rss_mb": peak_rss_mb,
+            "endpoints": endpoints,
+            "searches": {
+                cls.get_search_key(url): pages
+                for url, pages in sorted(download_stats.get_search_pages().items())
+            },
+            "rows": cls.count_rows(folder),
+        }
+
+    def add_run(self, record):
+        self._connection.execute(
+            "INSERT INTO runs (started_at, record) VALUES (?, ?)",
+            (record["started_at"], dumps(record, separators=(",", ":"))),
+        )
+        self._connection.execute(
+            "DELETE FROM runs WHERE id NOT IN "
+            "(SELECT id FROM runs ORDER BY id DESC LIMIT ?)",
+            (self._keep_runs,),
+        )
+
+    def get_runs(self, limit=None):
+        """Returns the latest runs, newest first"""
+        if limit is None:
+            limit = -1
+        return [
+            loads(record)
+            for (record,) in self._connection.execute(
+                "SELECT record FROM runs ORDER BY id DESC LIMIT ?", (limit,)
+            )
+        ]
+
+    @staticmethod
+    def is_successful(record):
+        # Records from before statuses were added are of successful runs
+        return record.get("status", "success") == "success"
+
+    @staticmethod
+    def get_costs(record):
+        """Flatten the costs in a record to a dict of (section, name, unit) to
+        value"""
+        costs = {("run", "total", "seconds"): record["seconds"]}
+        for stage, seconds in record["stages"].items():
+            costs[("stage", stage, "seconds")] = seconds
+        for countryiso3, seconds in record["countries"].items():
+            costs[("country", countryiso3, "seconds")] = seconds
+        for endpoint, figures in record["endpoints"].items():
+            for unit in ("requests", "bytes", "seconds", "pages"):
+                if unit in figures:
+                    costs[("endpoint", endpoint, unit)] = figures[unit]
+        for search, pages in record["searches"].items():
+            costs[("search", search, "pages")] = pages
+        if record["peak_rss_mb"] is not None:
+            costs[("run", "peak_rss", "mb")] = record["peak_rss_mb"]
+        return costs
+
+    def compare(self, baseline_runs=7, threshold=0.5):
+        """Compare the costs of the latest run with the median of up to
+        baseline_runs successful runs before it. Failed and interrupted runs
+        stop early so their costs are not used as a baseline. Returns the latest run, the number of
+        baseline runs and a list of (section, name, unit, latest, baseline)
+        for costs that rose by more than threshold (as a fraction of the
+        baseline) and by at least the unit's minimum change, largest rise
+        first."""
+        runs = self.get_runs()
+        if not runs:
+            return None, 0, []
+        latest = runs[0]
+        baselines = [
+            self.get_costs(run) for run in runs[1:] if self.is_successful(run)
+        ][:baseline_runs]
+        jumps = []
+        for key, value in self.get_costs(latest).items():
+            values = [costs[key] for costs in baselines if key in costs]
+            if not values:
+                continue
+            baseline = median(values)
+            if value - baseline < min_changes[key[2]]:
+                continue
+            if value > baseline * (1 + threshold):
+                jumps.append((*key, value, baseline))
+        jumps.sort(key=lambda jump: (jump[3] + 1) / (jump[4] + 1), reverse=True)
+        return latest, len(baselines), jumps
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,229 @@
+import io
+import logging
+import pstats
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from json import dump
+from os.path import join
+from threading import Lock, local
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+
+class StageProfile:
+    """Deterministic profile of the calls made by one thread during a stage in
+    the format of cProfile so that it can be loaded with pstats. Since Python
+    3.12, cProfile is built on sys.monitoring which allows only one profiler to
+    be enabled in a process so events are instead received from a
+    sys.setprofile hook which is per thread. Calls that were already running
+    when the stage started are not counted.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self._stack = []
+        self._active = {}
+
+    def create_stats(self):
+        # Called by pstats when loading the profile
+        pass
+
+    def dispatch(self, frame, event, arg, now):
+        if event == "call":
+            code = frame.f_code
+            self._push(
+                (code.co_filename, code.co_firstlineno, code.co_name), frame, now
+            )
+        elif event == "return":
+            self._pop(frame, now)
+        elif event == "c_call":
+            name = getattr(arg, "__qualname__", None) or repr(arg)
+            self._push(("~", 0, f"<built-in method {name}>"), arg, now)
+        else:
+            # c_return and c_exception
+            self._pop(arg, now)
+
+    def _push(self, function, called, now):
+        self._stack.append([function, called, now, 0.0])
+        self._active[function] = self._active.get(function, 0) + 1
+
+    def _pop(self, called, now):
+        if not self._stack or self._stack[-1][1] is not called:
+            return
+        function, _, start, children = self._stack.pop()
+        elapsed = now - start
+        active = self._active[function] - 1
+        self._active[function] = active
+        primitive_calls, calls, total, cumulative, callers = self.stats.get(
+            function, (0, 0, 0.0, 0.0, {})
+        )
+        calls += 1
+        if active == 0:
+            # Recursive calls are included in the outermost one's time
+            primitive_calls += 1
+            cumulative += elapsed
+        total += elapsed - children
+        if self._stack:
+            parent = self._stack[-1]
+            parent[3] += elapsed
+            callers[parent[0]] = callers.get(parent[0], 0) + 1
+        self.stats[function] = primitive_calls, calls, total, cumulative, callers
+
+
+class RunProfiler:
+    """Named timers for the stages of a run, optionally broken down by item
+    (such as country). Stages can be nested and measured from several threads.
+    If profile is True, every stage in every thread is also profiled with a
+    StageProfile, merging the profiles of calls of the same stage, which slows
+    the run down considerably. The memory allocated during the first call of
+    each stage is traced with tracemalloc, not every call since snapshots are
+    slow to take. Allocations are those of the whole process during the call.
+    """
+
+    def __init__(self, folder=None, profile=False, top=30):
+        self._folder = folder
+        self._profile = profile
+        self._top = top
+        self._lock = Lock()
+        self._thread_local = local()
+        self._seconds = {}
+        self._calls = {}
+        self._items = {}
+        self._stats = {}
+        self._allocations = {}
+        self._traced_stages = set()
+        if profile:
+            tracemalloc.start()
+
+    def _dispatch(self, frame, event, arg):
+        now = perf_counter()
+        for stage_profile in self._thread_local.profiles:
+            stage_profile.dispatch(frame, event, arg, now)
+
+    def _start_profile(self):
+        profiles = getattr(self._thread_local, "profiles", None)
+        if profiles is None:
+            profiles = self._thread_local.profiles = []
+        stage_profile = StageProfile()
+        profiles.append(stage_profile)
+        if len(profiles) == 1:
+            sys.setprofile(self._dispatch)
+        return stage_profile
+
+    def _stop_profile(self, stage_profile):
+        profiles = self._thread_local.profiles
+        profiles.remove(stage_profile)
+        if not profiles:
+            sys.setprofile(None)
+
+    @contextmanager
+    def measure(self, stage, item=None):
+        stage_profile = None
+        snapshot = None
+        if self._profile:
+            with self._lock:
+                trace = stage not in self._traced_stages
+                self._traced_stages.add(stage)
+            if trace:
+                snapshot = tracemalloc.take_snapshot()
+            stage_profile = self._start_profile()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            if stage_profile is not None:
+                self._stop_profile(stage_profile)
+                self._add_profile(stage, stage_profile, snapshot)
+            self._add_time(stage, item, seconds)
+
+    def _add_time(self, stage, item, seconds):
+        with self._lock:
+            self._seconds[stage] = self._seconds.get(stage, 0.0) + seconds
+            self._calls[stage] = self._calls.get(stage, 0) + 1
+            if item is not None:
+                items = self._items.setdefault(stage, {})
+                items[item] = items.get(item, 0.0) + seconds
+
+    def _add_profile(self, stage, stage_profile, snapshot):
+        differences = []
+        if snapshot is not None:
+            differences = tracemalloc.take_snapshot().compare_to(snapshot, "lineno")
+        with self._lock:
+            stats = self._stats.get(stage)
+            if stats is None:
+                self._stats[stage] = pstats.Stats(stage_profile)
+            else:
+                stats.add(stage_profile)
+            allocations = self._allocations.setdefault(stage, {})
+            for difference in differences:
+                if difference.size_diff <= 0:
+                    continue
+                line = str(difference.traceback)
+                allocations[line] = allocations.get(line, 0) + difference.size_diff
+
+    def get_timings(self):
+        """Returns a dict of stage to seconds, number of calls and seconds by
+        item for stages measured with items"""
+        with self._lock:
+            timings = {}
+            for stage, seconds in self._seconds.items():
+                timing = {"seconds": round(seconds, 3), "calls": self._calls[stage]}
+                items = self._items.get(stage)
+                if items:
+                    timing["items"] = {
+                        item: round(seconds, 3)
+                        for item, seconds in sorted(
+                            items.items(), key=lambda x: x[1], reverse=True
+                        )
+                    }
+                timings[stage] = timing
+            return timings
+
+    def write(self):
+        """Write timings and, if profiling, cProfile stats (as .prof files
+        that can be loaded with pstats and as text) and top allocations for
+        each stage to folder"""
+        if not self._folder:
+            return
+        with open(join(self._folder, "timings.json"), "w") as file:
+            dump(self.get_timings(), file, indent=2)
+        if not self._profile:
+            return
+        with self._lock:
+            for stage, stats in self._stats.items():
+                stats.dump_stats(join(self._folder, f"{stage}.prof"))
+                stream = io.StringIO()
+                stats.stream = stream
+                stats.sort_stats("cumulative").print_stats(self._top)
+                allocations = sorted(
+                    self._allocations.get(stage, {}).items(),
+                    key=lambda x: x[1],
+                    reverse=True,
+                )
+                with open(join(self._folder, f"{stage}.txt"), "w") as file:
+                    file.write(stream.getvalue())
+                    file.write(f"Top {self._top} allocations:\n")
+                    for line, size in allocations[: self._top]:
+                        file.write(f"{size / 1024:>12.1f} KiB  {line}\n")
+        logger.info(f"Profiles written to {self._folder}")
+
+    def log_summary(self):
+        for stage, timing in self.get_timings().items():
+            message = (
+                f"Stage {stage}: {timing['seconds']:.1f}s in {timing['calls']} calls"
+            )
+            items = timing.get("items")
+            if items:
+                slowest = ", ".join(
+                    f"{item} {seconds:.1f}s"
+                    for item, seconds in list(items.items())[:5]
+                )
+                message = f"{message} (slowest: {slowest})"
+            logger.info(message)
+
+    def close(self):
+        if self._profile:
+            tracemalloc.stop()
@@ -0,0 +1,105 @@
+import logging
+import sqlite3
+import zlib
+from datetime import timedelta, timezone
+from json import dumps, loads
+from threading import Lock
+from time import time
+
+logger = logging.getLogger(__name__)
+
+# Kinds of snapshot
+PLAN_OVERVIEW = "plan_overview"
+LOCATION_SPLIT = "location_split"
+TRENDS = "trends"
+
+
+class SnapshotStore:
+    """SQLite store of FTS data that no longer changes keyed by kind, id
+    (plan or country id, 0 for plan overviews) and year. Data is frozen once
+    the period it covers (a year or a plan) ended more than horizon_days
+    before today. Frozen data is served from the store without a request and
+    is only revalidated (downloaded again) every revalidate_days. Data that is
+    not frozen is never stored.
+    """
+
+    def __init__(self, path, today, horizon_days=365, revalidate_days=7):
+        if today.tzinfo is None:
+            today = today.replace(tzinfo=timezone.utc)
+        self._horizon = today - timedelta(days=horizon_days)
+        self._revalidate_period = revalidate_days * 24 * 3600
+        self._lock = Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots (kind TEXT, id INTEGER, "
+            "year INTEGER, data BLOB, validated_at REAL, "
+            "PRIMARY KEY (kind, id, year))"
+        )
+        self.hits = 0
+        self.stored = 0
+        self.revalidated = 0
+        self.changed = 0
+
+    def is_frozen(self, end_date):
+        """Whether data for a period ending on end_date is frozen"""
+        if end_date.tzinfo is None:
+            end_date = end_date.replace(tzinfo=timezone.utc)
+        return end_date < self._horizon
+
+    def _get_row(self, kind, id, year):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT data, validated_at FROM snapshots "
+                "WHERE kind = ? AND id = ? AND year = ?",
+                (kind, id, year),
+            ).fetchone()
+
+    def get(self, kind, id, year):
+        """Returns the stored data for kind, id and year or None"""
+        row = self._get_row(kind, id, year)
+        if row is None:
+            return None
+        return loads(zlib.decompress(row[0]))
+
+    def get_fresh(self, kind, id, year):
+        """Returns the stored data for kind, id and year if it does not need
+        revalidating or None"""
+        row = self._get_row(kind, id, year)
+        if row is None:
+            return None
+        data, validated_at = row
+        if time() - validated_at > self._revalidate_period:
+            return None
+        with self._lock:
+            self.hits += 1
+        return loads(zlib.decompress(data))
+
+    def set(self, kind, id, year, data):
+        body = zlib.compress(dumps(data, separators=(",", ":")).encode("utf-8"))
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM snapshots WHERE kind = ? AND id = ? AND year = ?",
+                (kind, id, year),
+            ).fetchone()
+            if row is None:
+                self.stored += 1
+            else:
+                self.revalidated += 1
+                if zlib.decompress(row[0]) != zlib.decompress(body):
+                    self.changed += 1
+                    logger.info(f"Frozen {kind} snapshot {id} {year} has changed")
+            self._connection.execute(
+                "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)",
+                (kind, id, year, body, time()),
+            )
+
+    def log_stats(self):
+        logger.info(
+            f"FTS snapshots: {self.hits} served, {self.stored} stored, "
+            f"{self.revalidated} revalidated ({self.changed} changed)"
+        )
+
+    def close(self):
+        self._connection.close()
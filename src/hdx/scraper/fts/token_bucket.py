@@ -0,0 +1,37 @@
+from threading import Lock
+from time import monotonic, sleep
+
+
+class TokenBucket:
+    """Token bucket rate limiter that can be shared by threads.
+    Up to calls requests can be made in a burst after which tokens are refilled
+    at a rate of calls per period seconds.
+    """
+
+    def __init__(self, calls, period):
+        self._capacity = calls
+        self._rate = calls / period
+        self._tokens = calls
+        self._updated = monotonic()
+        self._lock = Lock()
+
+    def reserve(self):
+        """Take a token, returning how many seconds the caller must wait before
+        it may be used. The token is reserved even if the wait is non zero so
+        that callers waiting concurrently are queued fairly."""
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(
+                self._capacity, self._tokens + (now - self._updated) * self._rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self._rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay:
+            sleep(delay)
+        return delay
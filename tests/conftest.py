@@ -7,6 +7,8 @@ from hdx.data.vocabulary import Vocabulary
 from hdx.location.country import Country
 from hdx.utilities.useragent import UserAgent
 
+from tests.fts_server import FTSServer
+
 
 @pytest.fixture(scope="session")
 def fixtures_dir():
@@ -55,3 +57,21 @@ def configuration(config_dir):
     configuration = Configuration.read()
     configuration["base_url"] = configuration["test_url"]
     return configuration
+
+
+@pytest.fixture
+def fts_server(configuration):
+    """Starts an FTSServer with the given options returning it and a copy of the
+    configuration pointing at it. Servers are stopped after the test."""
+    servers = []
+
+    def start_server(**kwargs):
+        server = FTSServer(**kwargs).start()
+        servers.append(server)
+        server_configuration = dict(configuration)
+        server_configuration["base_url"] = server.url
+        return server, server_configuration
+
+    yield start_server
+    for server in servers:
+        server.stop()
@@ -0,0 +1,220 @@
+"""
+Local stand-in for the FTS API (api.hpc.tools) that FTSDownload can be pointed
+at through base_url. It serves either the fixture files in a folder (named as
+FTSDownload does with testpath) or a dict of responses keyed by partial url,
+such as those from benchmarks/synthetic_fts.py. nextLinks of fixture files are
+rewritten to point at the server. Per request latency, 429 and 5xx responses
+and a rate limit can be injected and request counts and timings are recorded
+per endpoint family as classified by DownloadStats as is the maximum number of
+requests in flight at once.
+
+"""
+
+import logging
+import random
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from os.path import exists, join
+from threading import Lock, Thread
+from time import monotonic, sleep
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from hdx.scraper.fts.download import FTSDownload
+from hdx.scraper.fts.download_stats import DownloadStats
+
+logger = logging.getLogger(__name__)
+
+error_statuses = (500, 502, 503)
+
+
+class FTSServer:
+    def __init__(
+        self,
+        folder=None,
+        responses=None,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        rate_limit=None,
+        retry_after=1,
+        seed=1,
+    ):
+        self._folder = folder
+        self._responses = {}
+        if responses:
+            for partial_url, body in responses.items():
+                self.add_response(partial_url, body)
+        self._latency = latency
+        self._jitter = jitter
+        self._error_rate = error_rate
+        self._throttle_rate = throttle_rate
+        self._rate_limit = rate_limit
+        self._retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = Lock()
+        self._request_times = deque()
+        self.statuses = {}
+        self.endpoints = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._httpd = None
+        self._thread = None
+        self.url = None
+
+    @staticmethod
+    def get_key(partial_url):
+        split = urlsplit(partial_url)
+        query = urlencode(sorted(parse_qsl(split.query, keep_blank_values=True)))
+        path = split.path.lstrip("/")
+        if query:
+            return f"{path}?{query}"
+        return path
+
+    def add_response(self, partial_url, body):
+        if not isinstance(body, (str, bytes)):
+            body = dumps(body)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self._responses[self.get_key(partial_url)] = body
+
+    def get_body(self, partial_url):
+        body = self._responses.get(self.get_key(partial_url))
+        if body is not None or not self._folder:
+            return body
+        for filename in (
+            FTSDownload.get_testfile_path(partial_url),
+            FTSDownload.get_testfile_path(url=f"{self.url}{partial_url}"),
+        ):
+            path = join(self._folder, filename)
+            if exists(path):
+                break
+        else:
+            return None
+        with open(path, "rb") as file:
+            body = file.read()
+        json = loads(body)
+        meta = json.get("meta")
+        if meta and meta.get("nextLink"):
+            nextname = FTSDownload.get_testfile_path(url=meta["nextLink"])
+            meta["nextLink"] = f"{self.url}{nextname}"
+            body = dumps(json).encode("utf-8")
+        return body
+
+    def get_failure(self):
+        """Returns the status code of a failure to inject or None"""
+        with self._lock:
+            if self._rate_limit:
+                now = monotonic()
+                period = self._rate_limit["period"]
+                while self._request_times and self._request_times[0] <= now - period:
+                    self._request_times.popleft()
+                if len(self._request_times) >= self._rate_limit["calls"]:
+                    return 429
+                self._request_times.append(now)
+            value = self._rng.random()
+            if value < self._throttle_rate:
+                return 429
+            if value < self._throttle_rate + self._error_rate:
+                return self._rng.choice(error_statuses)
+            return None
+
+    def get_delay(self):
+        with self._lock:
+            return self._latency + self._rng.uniform(0, self._jitter)
+
+    def record(self, partial_url, status, seconds, size):
+        endpoint = DownloadStats.get_endpoint(partial_url)
+        with self._lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = {"requests": 0, "failures": 0, "seconds": 0.0, "bytes": 0}
+                self.endpoints[endpoint] = stats
+            stats["requests"] += 1
+            if status != 200:
+                stats["failures"] += 1
+            stats["seconds"] += seconds
+            stats["bytes"] += size
+
+    def handle(self, handler):
+        start = monotonic()
+        with self._lock:
+            self.in_flight += 1
+            if self.in_flight > self.max_in_flight:
+                self.max_in_flight = self.in_flight
+        try:
+            self.respond(handler, start)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def respond(self, handler, start):
+        partial_url = handler.path.lstrip("/")
+        delay = self.get_delay()
+        if delay:
+            sleep(delay)
+        status = self.get_failure()
+        headers = {}
+        if status is None:
+            body = self.get_body(partial_url)
+            if body is None:
+                status = 404
+                body = b'{"status": "error"}'
+            else:
+                status = 200
+        else:
+            body = b'{"status": "error"}'
+            if status == 429:
+                headers["Retry-After"] = str(self._retry_after)
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+        self.record(partial_url, status, monotonic() - start, len(body))
+
+    def get_no_requests(self):
+        with self._lock:
+            return sum(self.statuses.values())
+
+    def log_stats(self):
+        with self._lock:
+            for endpoint, stats in sorted(self.endpoints.items()):
+                logger.info(
+                    f"{endpoint}: {stats['requests']} requests, {stats['failures']} failures, {stats['seconds']:.2f}s, {stats['bytes']} bytes"
+                )
+            logger.info(f"Responses by status: {dict(sorted(self.statuses.items()))}")
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._httpd.server_port}/"
+        self._thread = Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -0,0 +1,135 @@
+"""
+Unit tests for FTS Parquet and Arrow outputs.
+
+"""
+
+from csv import DictReader
+from datetime import date
+from os.path import join
+
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet
+import pytest
+from hdx.data.dataset import Dataset
+from hdx.data.resource import Resource
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.fts.columnar_output import ColumnarOutput
+
+
+class TestColumnarOutput:
+    headers = ["countryCode", "id", "code", "startDate", "funding", "percentFunded"]
+    rows = [
+        {
+            "countryCode": "AFG",
+            "id": 929,
+            "code": "HAFG20",
+            "startDate": "2020-01-01",
+            "funding": 100,
+            "percentFunded": 50,
+        },
+        {
+            "countryCode": "AFG",
+            "id": "",
+            "code": "",
+            "startDate": "2020-01-01T00:00:00",
+            "funding": 10.5,
+            "percentFunded": "",
+        },
+        {
+            "countryCode": "JOR",
+            "id": "1010",
+            "code": "OJOR20",
+            "startDate": None,
+            "funding": None,
+            "percentFunded": "",
+        },
+    ]
+    outputs = {
+        "fts_requirements_funding_global": "requirements_headers",
+        "fts_requirements_funding_covid_global": "requirements_headers",
+        "fts_requirements_funding_cluster_global": "requirements_headers",
+        "fts_requirements_funding_globalcluster_global": "requirements_headers",
+        "fts_incoming_funding_global": "plans_headers",
+        "fts_internal_funding_global": "plans_headers",
+        "fts_outgoing_funding_global": "plans_headers",
+        "hdx_hapi_funding_global": "hapi_headers",
+    }
+
+    def test_get_columns(self):
+        column_types = {
+            "countryCode": "string",
+            "id": "int64",
+            "startDate": "date32",
+            "funding": "float64",
+        }
+        columns = ColumnarOutput.get_columns(self.rows, column_types)
+        assert columns["id"] == [929, None, 1010]
+        assert columns["startDate"] == [date(2020, 1, 1), date(2020, 1, 1), None]
+        assert columns["funding"] == [100.0, 10.5, None]
+
+    def test_generate_resources(self, configuration, fixtures_dir, monkeypatch):
+        schemas = configuration["columnar_output"]["schemas"]
+        formats = {"csv": "csv", "parquet": "parquet"}
+        monkeypatch.setattr(Resource, "_formats_dict", formats)
+        with temp_dir("FTS-TEST-COLUMNAR") as folder:
+            # Rows are consumed from an iterator a batch at a time
+            columnar_output = ColumnarOutput(folder, schemas, batch_size=2)
+            dataset = Dataset({"name": "test"})
+            resource = Resource(
+                {"name": "test_global.csv", "description": "Test globally"}
+            )
+            columnar_output.generate_resources(
+                dataset,
+                resource,
+                iter(self.rows),
+                self.headers,
+                "requirements_headers",
+            )
+            resources = dataset.get_resources()
+            # HDX has no file type for arrow so only parquet is written
+            assert [resource["name"] for resource in resources] == [
+                "test_global.parquet",
+            ]
+            assert resources[0]["format"] == "parquet"
+            table = pyarrow.parquet.read_table(join(folder, "test_global.parquet"))
+            assert table.column_names == self.headers
+            assert (
+                pyarrow.parquet.ParquetFile(
+                    join(folder, "test_global.parquet")
+                ).num_row_groups
+                == 2
+            )
+            assert table.column("percentFunded").to_pylist() == [50, None, None]
+            with pytest.raises(ValueError):
+                columnar_output.generate_resources(
+                    dataset, resource, self.rows, self.headers, "hapi_headers"
+                )
+
+            # The global outputs are written with the same schema whatever
+            # their rows hold
+            formats["arrow"] = "arrow"
+            columnar_output = ColumnarOutput(folder, schemas)
+            for stem, schema in self.outputs.items():
+                with open(
+                    join(fixtures_dir, f"{stem}.csv"), encoding="utf-8-sig"
+                ) as file:
+                    reader = DictReader(file)
+                    headers = reader.fieldnames
+                    rows = list(reader)
+                resource = Resource({"name": f"{stem}.csv", "description": stem})
+                columnar_output.generate_resources(
+                    dataset, resource, rows, headers, schema
+                )
+                table = pyarrow.parquet.read_table(join(folder, f"{stem}.parquet"))
+                assert table.num_rows == len(rows)
+                expected_types = {
+                    header: pyarrow.type_for_alias(schemas[schema][header])
+                    for header in headers
+                }
+                assert dict(zip(table.column_names, table.schema.types)) == (
+                    expected_types
+                )
+                with pyarrow.ipc.open_file(join(folder, f"{stem}.arrow")) as reader:
+                    assert reader.read_all().equals(table)
@@ -0,0 +1,92 @@
+"""
+Unit tests for FTS country stages.
+
+"""
+
+from threading import Event, Thread
+from time import sleep
+
+import pytest
+
+from hdx.scraper.fts.country_stages import CountryStages
+
+
+class TestCountryStages:
+    countries = [{"iso3": iso3} for iso3 in ("AFG", "JOR", "PSE", "SDN", "SYR")]
+
+    def test_country_stages(self):
+        fetched = []
+        generated = []
+        uploaded = []
+        release_uploads = Event()
+
+        def fetch(country):
+            fetched.append(country["iso3"])
+            return (country["iso3"],)
+
+        def generate(countryiso3):
+            generated.append(countryiso3)
+            return countryiso3, countryiso3.lower()
+
+        def upload(countryiso3, name):
+            release_uploads.wait()
+            uploaded.append(countryiso3)
+            return name
+
+        with CountryStages(
+            fetch, generate, upload, self.countries, queue_size=1
+        ) as country_stages:
+            assert fetched == []
+            results = []
+            waiter = Thread(
+                target=lambda: results.append(country_stages.wait(self.countries[1]))
+            )
+            waiter.start()
+            # With uploads blocked, generation stops once JOR is uploading,
+            # PSE is queued for upload and SDN is waiting to be queued while
+            # SYR is fetched and queued for generation
+            for _ in range(100):
+                if len(generated) == 3 and len(fetched) == 4:
+                    break
+                sleep(0.01)
+            sleep(0.05)
+            assert fetched == ["JOR", "PSE", "SDN", "SYR"]
+            assert generated == ["JOR", "PSE", "SDN"]
+            assert uploaded == []
+            release_uploads.set()
+            waiter.join()
+            assert results == ["jor"]
+            for country in self.countries[2:]:
+                assert country_stages.wait(country) == country["iso3"].lower()
+        # AFG is never waited for so is never fetched or generated
+        assert fetched == ["JOR", "PSE", "SDN", "SYR"]
+        assert generated == ["JOR", "PSE", "SDN", "SYR"]
+        assert uploaded == ["JOR", "PSE", "SDN", "SYR"]
+
+    def test_country_stages_errors(self):
+        def fetch(country):
+            if country["iso3"] == "SDN":
+                raise ValueError("Fetch failed")
+            return (country["iso3"],)
+
+        def generate(countryiso3):
+            if countryiso3 == "JOR":
+                raise ValueError("Generation failed")
+            return (countryiso3,)
+
+        def upload(countryiso3):
+            if countryiso3 == "PSE":
+                raise ValueError("Upload failed")
+            return countryiso3
+
+        with pytest.raises(ValueError):
+            CountryStages(fetch, generate, upload, self.countries, queue_size=0)
+        with CountryStages(fetch, generate, upload, self.countries) as country_stages:
+            assert country_stages.wait(self.countries[0]) == "AFG"
+            with pytest.raises(ValueError, match="Generation failed"):
+                country_stages.wait(self.countries[1])
+            with pytest.raises(ValueError, match="Upload failed"):
+                country_stages.wait(self.countries[2])
+            with pytest.raises(ValueError, match="Fetch failed"):
+                country_stages.wait(self.countries[3])
+            assert country_stages.wait(self.countries[4]) == "SYR"
@@ -0,0 +1,19 @@
+"""
+Unit tests for FTS date parsing.
+
+"""
+
+from hdx.utilities.dateparse import parse_date, parse_date_range
+
+from hdx.scraper.fts.dates import parse_iso_date, parse_year_range
+
+
+class TestDates:
+    def test_parse_iso_date(self):
+        for datestr in ("2020-03-05", "2019-12-31", "2020-02-29T10:11:12.345Z"):
+            assert parse_iso_date(datestr) == parse_date(datestr)
+        assert parse_iso_date("2020-03-05") is parse_iso_date("2020-03-05")
+
+    def test_parse_year_range(self):
+        assert parse_year_range(2020) == parse_date_range("2020")
+        assert parse_year_range("2021") == parse_date_range("2021")
@@ -0,0 +1,408 @@
+"""
+Unit tests for FTS downloading.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from json import loads
+from os.path import join
+from time import monotonic
+
+import pytest
+from hdx.utilities.downloader import Download, DownloadError
+from hdx.utilities.loader import load_json
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.fts.download import FTSDownload
+from hdx.scraper.fts.download_stats import DownloadStats
+from hdx.scraper.fts.requirements_funding import RequirementsFunding
+from hdx.scraper.fts.response_cache import ResponseCache
+from hdx.scraper.fts.response_filter import ResponseFilter
+from hdx.scraper.fts.snapshot_store import PLAN_OVERVIEW, TRENDS, SnapshotStore
+from hdx.scraper.fts.token_bucket import TokenBucket
+
+
+class TestFTSDownload:
+    def test_token_bucket(self):
+        token_bucket = TokenBucket(2, 0.2)
+        assert token_bucket.reserve() == 0
+        assert token_bucket.reserve() == 0
+        assert token_bucket.reserve() == pytest.approx(0.1, abs=0.02)
+        assert token_bucket.reserve() == pytest.approx(0.2, abs=0.02)
+
+    def test_response_filter(self):
+        plans = [
+            {"id": 1, "countries": [{"iso3": "AFG"}], "usageYears": [{"year": "2020"}]},
+            {"id": 2, "countries": [{"iso3": "SDN"}], "usageYears": [{"year": "2020"}]},
+            {"id": 3, "countries": [], "usageYears": [{"year": "2021"}]},
+            {"id": 4, "countries": [], "usageYears": [{"year": "2020"}]},
+        ]
+        objects = [
+            {"iso3": "AFG", "year": 2020},
+            {"iso3": None},
+            {"iso3": "SDN"},
+            {"year": 2021},
+            {"name": "x"},
+        ]
+        response_filter = ResponseFilter()
+        assert response_filter.is_active() is False
+        assert response_filter.filter_plans(plans) == plans
+        assert response_filter.filter_data(objects) is objects
+        response_filter = ResponseFilter(["AFG"], ["2020"])
+        assert [plan["id"] for plan in response_filter.filter_plans(plans)] == [1, 4]
+        assert response_filter.filter_objects(objects) == [
+            {"iso3": "AFG", "year": 2020},
+            {"name": "x"},
+        ]
+        response_filter = ResponseFilter(["AFG"])
+        data = {"plans": plans}
+        assert [plan["id"] for plan in response_filter.filter_data(data)["plans"]] == [
+            1,
+            3,
+            4,
+        ]
+        assert len(plans) == 4
+
+    def test_download_many(self, configuration):
+        partial_urls = [
+            "1/public/location",
+            "2/fts/flow/plan/overview/progress/2020",
+            "1/fts/flow/custom-search?planid=943&groupby=cluster",
+        ]
+        with Download(user_agent="test") as downloader:
+            ftsdownloader = FTSDownload(
+                configuration,
+                downloader,
+                testpath=True,
+                rate_limit={"calls": 2, "period": 0.2},
+                max_concurrent=2,
+            )
+            expected = [
+                ftsdownloader.download(partial_url) for partial_url in partial_urls
+            ]
+            start = monotonic()
+            results = ftsdownloader.download_many(partial_urls)
+            assert results == expected
+            # bucket was drained by the serial downloads
+            assert monotonic() - start >= 0.2
+
+            results = ftsdownloader.download_many(
+                ["1/public/location", "1/public/missing"], return_exceptions=True
+            )
+            assert results[0] == expected[0]
+            assert isinstance(results[1], DownloadError)
+
+    def test_max_concurrent(self, fts_server):
+        partial_urls = [f"1/public/location?id={i}" for i in range(4)]
+        server, server_configuration = fts_server(
+            responses={
+                partial_url: {"status": "ok", "data": []}
+                for partial_url in partial_urls
+            },
+            latency=0.05,
+        )
+        with Download(user_agent="test") as downloader:
+            ftsdownloader = FTSDownload(
+                server_configuration, downloader, max_concurrent=2
+            )
+            # Each download_many runs its own event loop as country workers do
+            with ThreadPoolExecutor(3) as executor:
+                futures = [
+                    executor.submit(ftsdownloader.download_many, partial_urls)
+                    for _ in range(3)
+                ]
+                for future in futures:
+                    assert future.result() == [[]] * 4
+                futures = [
+                    executor.submit(ftsdownloader.download, partial_url)
+                    for partial_url in partial_urls
+                ]
+                for future in futures:
+                    assert future.result() == []
+        assert server.get_no_requests() == 16
+        assert server.max_in_flight == 2
+
+    def test_response_cache(self):
+        with temp_dir("FTS-TEST-CACHE") as folder:
+            cache = ResponseCache(
+                join(folder, "cache.sqlite"),
+                2020,
+                current_year_ttl=10,
+                closed_year_ttl=1000,
+                default_ttl=100,
+                max_size=150,
+            )
+            assert (
+                cache.normalise_url("HTTPS://API.hpc.tools/v1/x?year=2020&b=1")
+                == "https://api.hpc.tools/v1/x?b=1&year=2020"
+            )
+            assert cache.get_ttl("2/fts/flow/plan/overview/progress/2020") == 10
+            assert cache.get_ttl("2/fts/flow/plan/overview/progress/2019") == 1000
+            assert cache.get_ttl("2/country/1/summary/trends/2014") == 1000
+            # Trends for 2017 cover up to 2022
+            assert cache.get_ttl("2/country/1/summary/trends/2017") == 10
+            assert (
+                cache.get_ttl("1/fts/flow/custom-search?locationid=1&year=2020") == 10
+            )
+            assert cache.get_ttl("1/public/location") == 100
+
+            # zlib cannot compress these bodies so each takes about 60 bytes
+            cache.set("https://a/1", bytes(range(50)), etag='"abc"')
+            entry = cache.get("https://a/1")
+            assert entry.body == bytes(range(50))
+            assert entry.is_fresh() is True
+            assert entry.get_validators() == {"If-None-Match": '"abc"'}
+            cache.set("https://a/2", bytes(range(50, 100)))
+            cache.get("https://a/2")
+            size = cache.get_size()
+            cache.set("https://a/2", bytes(range(50, 100)))
+            assert cache.get_size() == size
+            cache.set("https://a/3", bytes(range(100, 150)))
+            # least recently used entry is evicted
+            assert cache.get("https://a/1") is None
+            assert cache.get("https://a/2").body == bytes(range(50, 100))
+            size = cache.get_size()
+            assert size <= 150
+            cache.close()
+            # the total size is kept when the cache is opened again
+            cache = ResponseCache(join(folder, "cache.sqlite"), 2020, max_size=150)
+            assert cache.get_size() == size
+            cache.close()
+
+    def test_download_with_cache(self, configuration):
+        with temp_dir("FTS-TEST-CACHE") as folder:
+            cache = ResponseCache(join(folder, "cache.sqlite"), 2020)
+            with Download(user_agent="test") as downloader:
+                ftsdownloader = FTSDownload(
+                    configuration, downloader, testpath=True, cache=cache
+                )
+                expected = ftsdownloader.download(
+                    "2/fts/flow/plan/overview/progress/2020"
+                )
+                assert cache.misses == 1
+                assert ftsdownloader.download_many(
+                    ["2/fts/flow/plan/overview/progress/2020"]
+                ) == [expected]
+                assert cache.hits == 1
+            cache.close()
+
+    def test_iterate_flows(self, configuration, input_dir):
+        expected = []
+        for suffix in ("", "-page-2", "-page-3"):
+            json = load_json(
+                join(input_dir, f"custom-search-locationid-1-year-2020{suffix}.json")
+            )
+            for flow in json["data"]["flows"]:
+                del flow["reportDetails"]
+                expected.append(flow)
+        with Download(user_agent="test") as downloader:
+            ftsdownloader = FTSDownload(configuration, downloader, testpath=True)
+            url = ftsdownloader.get_url("custom-search?locationid=1&year=2020")
+            flows = ftsdownloader.iterate_flows(url=url)
+            assert next(flows) == expected[0]
+            assert list(flows) == expected[1:]
+
+    def test_fts_server(self, configuration, input_dir, fts_server):
+        with Download(user_agent="test") as downloader:
+            ftsdownloader = FTSDownload(configuration, downloader, testpath=True)
+            expected_locations = ftsdownloader.download("1/public/location")
+            expected_flows = list(
+                ftsdownloader.iterate_flows("custom-search?locationid=1&year=2020")
+            )
+        server, server_configuration = fts_server(
+            folder=input_dir,
+            latency=0.001,
+            error_rate=0.2,
+            throttle_rate=0.2,
+            retry_after=0,
+        )
+        with Download(user_agent="test", backoff_factor=0.01) as downloader:
+            ftsdownloader = FTSDownload(server_configuration, downloader)
+            assert ftsdownloader.download("1/public/location") == expected_locations
+            url = ftsdownloader.get_url(
+                "1/fts/flow/custom-search?locationid=1&year=2020"
+            )
+            assert list(ftsdownloader.iterate_flows(url=url)) == expected_flows
+        assert server.statuses[200] == 4
+        assert server.get_no_requests() > 4, server.statuses
+        assert sorted(server.endpoints) == ["flows_by_location", "locations"]
+        assert server.endpoints["locations"]["requests"] >= 1
+
+        server, server_configuration = fts_server(
+            responses={"1/public/location": {"status": "ok", "data": []}},
+            rate_limit={"calls": 2, "period": 0.5},
+            retry_after=1,
+        )
+        with Download(user_agent="test") as downloader:
+            ftsdownloader = FTSDownload(server_configuration, downloader)
+            for _ in range(3):
+                assert ftsdownloader.download("1/public/location") == []
+        assert server.statuses == {200: 3, 429: 1}
+
+    def test_download_stats(self, input_dir, fts_server):
+        assert (
+            DownloadStats.get_endpoint(
+                "https://api.hpc.tools/v1/fts/flow/custom-search?planid=1&groupby=globalcluster"
+            )
+            == "plan_globalclusters"
+        )
+        assert (
+            DownloadStats.get_endpoint(
+                "http://x/1-fts-flow-custom-search-emergencyid-911-planid-943-groupby-location.json"
+            )
+            == "covid"
+        )
+        server, server_configuration = fts_server(
+            folder=input_dir, throttle_rate=0.5, retry_after=0
+        )
+        with Download(user_agent="test", backoff_factor=0.01) as downloader:
+            stats = DownloadStats()
+            ftsdownloader = FTSDownload(
+                server_configuration,
+                downloader,
+                rate_limit={"calls": 1, "period": 0.5},
+                stats=stats,
+            )
+            assert ftsdownloader.get_stats() is stats
+            ftsdownloader.download("1/public/location")
+            url = ftsdownloader.get_url(
+                "1/fts/flow/custom-search?locationid=1&year=2020"
+            )
+            flows = list(ftsdownloader.iterate_flows(url=url))
+            with pytest.raises(DownloadError):
+                ftsdownloader.download("2/country/1/summary/trends/2000")
+        report = stats.get_report()
+        assert sorted(report) == [
+            "flows_by_location",
+            "locations",
+            "total",
+            "trends",
+        ]
+        flows_by_location = report["flows_by_location"]
+        assert flows_by_location["requests"] == 3
+        assert flows_by_location["searches"] == 1
+        assert flows_by_location["pages"] == 3
+        assert flows_by_location["max_pages"] == 3
+        assert flows_by_location["rate_limit_wait"] > 0
+        assert sum(flows_by_location["latency_histogram"].values()) == 3
+        assert report["trends"]["failures"] == 1
+        assert report["locations"]["failures"] == 0
+        total = report["total"]
+        assert total["requests"] == 5
+        with open(join(input_dir, "1-public-location.json"), "rb") as file:
+            assert report["locations"]["bytes"] == len(file.read())
+        assert total["bytes"] > report["locations"]["bytes"]
+        # Streamed pages are measured as the bytes of their bodies too
+        expected_bytes = 0
+        partial_url = "1/fts/flow/custom-search?locationid=1&year=2020"
+        while partial_url:
+            body = server.get_body(partial_url)
+            expected_bytes += len(body)
+            nextlink = loads(body)["meta"].get("nextLink")
+            partial_url = nextlink[len(server.url) :] if nextlink else None
+        assert flows_by_location["bytes"] == expected_bytes
+        assert len(flows) > 0
+        # The server classifies requests into the same endpoint families
+        assert sorted(server.endpoints) == ["flows_by_location", "locations", "trends"]
+        assert server.endpoints["flows_by_location"]["requests"] >= 3
+
+    def test_trends_snapshots(self):
+        class SnapshotDownloader:
+            def download_snapshots(self, kind, requests):
+                self.kind = kind
+                self.requests = requests
+                return [[{"year": requests[0][1], "totalFunding": 10}], []]
+
+        downloader = SnapshotDownloader()
+        today = datetime(2020, 6, 1)
+        requirements_funding = RequirementsFunding(downloader, None, None, None, today)
+        funding_by_year = requirements_funding.get_country_funding(1, {2012: []})
+        assert funding_by_year == {2025: 10}
+        assert downloader.kind == TRENDS
+        assert [request[1] for request in downloader.requests] == [2025, 2014]
+        with temp_dir("FTS-TRENDS", delete_on_success=True) as folder:
+            snapshot_store = SnapshotStore(join(folder, "snapshots.sqlite"), today)
+            # 2014 closed long ago but its trends window runs to the end of
+            # 2019 which is within the horizon so it is not frozen yet
+            _, year, end_date, _ = downloader.requests[1]
+            assert end_date == datetime(2019, 12, 31, tzinfo=timezone.utc)
+            assert snapshot_store.is_frozen(datetime(year, 12, 31)) is True
+            assert snapshot_store.is_frozen(end_date) is False
+            snapshot_store.close()
+
+    def test_snapshot_store(self, input_dir, fts_server):
+        requests = [
+            (
+                0,
+                2020,
+                datetime(2020, 12, 31),
+                "2/fts/flow/plan/overview/progress/2020",
+            ),
+            (1, 2025, datetime(2025, 12, 31), "2/country/1/summary/trends/2025"),
+        ]
+        today = datetime(2022, 6, 1)
+        with temp_dir("FTS-SNAPSHOTS", delete_on_success=True) as folder:
+            path = join(folder, "snapshots.sqlite")
+            server, server_configuration = fts_server(folder=input_dir)
+            with Download(user_agent="test") as downloader:
+                snapshot_store = SnapshotStore(path, today)
+                assert snapshot_store.is_frozen(datetime(2021, 5, 31)) is True
+                assert snapshot_store.is_frozen(datetime(2021, 6, 2)) is False
+                ftsdownloader = FTSDownload(
+                    server_configuration, downloader, snapshot_store=snapshot_store
+                )
+                expected = ftsdownloader.download_snapshots(PLAN_OVERVIEW, requests)
+                assert server.get_no_requests() == 2
+                assert snapshot_store.stored == 1
+                assert snapshot_store.get(TRENDS, 1, 2025) is None
+                assert snapshot_store.get(PLAN_OVERVIEW, 0, 2020) == expected[0]
+                assert (
+                    ftsdownloader.download_snapshots(PLAN_OVERVIEW, requests)
+                    == expected
+                )
+                assert server.get_no_requests() == 3
+                assert snapshot_store.hits == 1
+                report = ftsdownloader.get_stats().get_report()
+                assert report["plan_overview"]["cached"] == 1
+                assert report["plan_overview"]["requests"] == 1
+                snapshot_store.close()
+
+                snapshot_store = SnapshotStore(path, today, revalidate_days=0)
+                ftsdownloader = FTSDownload(
+                    server_configuration, downloader, snapshot_store=snapshot_store
+                )
+                assert (
+                    ftsdownloader.download_snapshots(PLAN_OVERVIEW, requests)
+                    == expected
+                )
+                assert server.get_no_requests() == 5
+                assert snapshot_store.revalidated == 1
+                assert snapshot_store.changed == 0
+                snapshot_store.close()
+
+                # Filtered data is not stored
+                snapshot_store = SnapshotStore(join(folder, "filtered.sqlite"), today)
+                ftsdownloader = FTSDownload(
+                    server_configuration,
+                    downloader,
+                    years="2020",
+                    snapshot_store=snapshot_store,
+                )
+                ftsdownloader.download_snapshots(PLAN_OVERVIEW, requests[:1])
+                assert snapshot_store.stored == 0
+                snapshot_store.close()
+
+                # Responses being saved to a test folder are always downloaded
+                snapshot_store = SnapshotStore(path, today)
+                ftsdownloader = FTSDownload(
+                    server_configuration,
+                    downloader,
+                    testfolder=folder,
+                    snapshot_store=snapshot_store,
+                )
+                no_requests = server.get_no_requests()
+                ftsdownloader.download_snapshots(PLAN_OVERVIEW, requests[:1])
+                assert server.get_no_requests() == no_requests + 1
+                assert snapshot_store.hits == 0
+                snapshot_store.close()
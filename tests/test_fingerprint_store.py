@@ -0,0 +1,66 @@
+"""
+Unit tests for FTS upload fingerprints.
+
+"""
+
+from os.path import join
+
+from hdx.data.dataset import Dataset
+from hdx.data.showcase import Showcase
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.fts.fingerprint_store import (
+    SKIP,
+    UPDATE_DATE,
+    UPLOAD,
+    FingerprintStore,
+)
+
+
+class TestFingerprintStore:
+    @staticmethod
+    def get_dataset(folder, contents, dataset_date):
+        dataset = Dataset(
+            {
+                "name": "afg-requirements-and-funding-data",
+                "title": "Afghanistan - Requirements and Funding Data",
+                "dataset_date": dataset_date,
+            }
+        )
+        dataset.generate_resource(
+            folder,
+            "fts_requirements_funding_afg.csv",
+            [{"year": 2020, "funding": contents}],
+            {"name": "fts_requirements_funding_afg.csv", "description": "Test"},
+            ["year", "funding"],
+        )
+        return dataset
+
+    def test_fingerprint_store(self, configuration):
+        with temp_dir("FTS-TEST-FINGERPRINTS") as folder:
+            store = FingerprintStore(join(folder, "fingerprints.sqlite"))
+            name = "afg-requirements-and-funding-data"
+            showcase = Showcase({"name": "afg-showcase", "title": "AFG"})
+            dataset_date = "[2016-01-01T00:00:00 TO 2020-12-31T23:59:59]"
+            dataset = self.get_dataset(folder, 100, dataset_date)
+            fingerprint = store.get_fingerprint(dataset, showcase)
+            assert store.get_action(name, fingerprint, dataset_date) == UPLOAD
+            store.set(name, fingerprint, dataset_date)
+            assert store.get_action(name, fingerprint, dataset_date) == SKIP
+
+            # only the dataset date is ignored in the fingerprint
+            next_date = "[2016-01-01T00:00:00 TO 2021-01-01T23:59:59]"
+            dataset = self.get_dataset(folder, 100, next_date)
+            assert store.get_fingerprint(dataset, showcase) == fingerprint
+            assert store.get_action(name, fingerprint, next_date) == UPDATE_DATE
+            dataset = self.get_dataset(folder, 200, dataset_date)
+            assert store.get_fingerprint(dataset, showcase) != fingerprint
+            showcase["title"] = "Afghanistan"
+            dataset = self.get_dataset(folder, 100, dataset_date)
+            assert store.get_fingerprint(dataset, showcase) != fingerprint
+
+            store = FingerprintStore(
+                join(folder, "fingerprints.sqlite"), refresh_days=0
+            )
+            assert store.get_action(name, fingerprint, dataset_date) == UPDATE_DATE
+            store.close()
@@ -0,0 +1,236 @@
+"""
+Unit tests for FTS flows.
+
+"""
+
+from os.path import join
+
+import pyarrow
+from hdx.utilities.dateparse import default_enddate
+from hdx.utilities.loader import load_json
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.fts.dates import parse_iso_date
+from hdx.scraper.fts.flow_index import FlowIndex
+from hdx.scraper.fts.flow_store import FlowStore
+from hdx.scraper.fts.flow_table import FlowTable
+
+
+class TestFlows:
+    @staticmethod
+    def load_flows(input_dir, locationid):
+        flows = []
+        for suffix in ("", "-page-2", "-page-3"):
+            json = load_json(
+                join(
+                    input_dir,
+                    f"custom-search-locationid-{locationid}-year-2020{suffix}.json",
+                )
+            )
+            flows.extend(json["data"]["flows"])
+        return flows
+
+    def test_flow_index(self, input_dir):
+        flows = self.load_flows(input_dir, 171)
+        flow_index = FlowIndex(None, 2020)
+        flattened = []
+
+        def flatten_flow(flow):
+            flattened.append(flow["id"])
+            return {"id": flow["id"]}
+
+        for flow in flows:
+            flow_index.add_flow(flow, flatten_flow)
+        flow_index.add_flow(
+            {
+                "id": "1",
+                "sourceObjects": [{"type": "Organization", "id": "1"}],
+                "destinationObjects": [{"type": "UsageYear", "name": "2020"}],
+            },
+            flatten_flow,
+        )
+        assert flow_index.no_flows == len(flows) == len(flattened)
+        assert flow_index.no_unlocated_flows == 1
+        rows = flow_index.get_rows(171)
+        assert [row["id"] for row in rows] == [flow["id"] for flow in flows]
+        # Germany (id 83) is the source of the first flow whose usage years are shared
+        germany_rows = flow_index.get_rows("83")
+        assert germany_rows[0] == {
+            "id": "138397",
+            "boundary": "outgoing",
+            "onBoundary": "shared",
+        }
+
+        # The boundaries of every flow match those of the per location searches
+        for locationid in (1, 114, 171):
+            flows = self.load_flows(input_dir, locationid)
+            for flow in flows:
+                boundary = FlowIndex.get_boundaries(flow, 2020)[locationid]
+                assert boundary == (flow["boundary"], flow["onBoundary"]), flow["id"]
+
+    def test_flow_store(self, input_dir):
+        flows = self.load_flows(input_dir, 114)
+        with temp_dir("FTS-TEST-FLOWSTORE") as folder:
+            flow_store = FlowStore(join(folder, "flows.sqlite"))
+            assert flow_store.get_sync_info(2020, 114) == (None, None)
+            changed, deleted, earliest, latest = flow_store.merge(2020, 114, flows)
+            assert changed == len(flows) == 478
+            assert deleted == 0
+            assert latest == "2021-03-05T15:52:13.192Z"
+            flow_store.set_sync_info(2020, 114, latest, 1.0)
+            assert flow_store.get_sync_info(2020, 114) == (latest, 1.0)
+            assert flow_store.get_sync_info(2020, 1) == (None, None)
+
+            updated_flow = dict(flows[0], updatedAt="2021-04-01T00:00:00.000Z")
+            updated_flow["description"] = "Updated"
+            unchanged_flow = dict(flows[1])
+            deleted_flow = dict(flows[2], deletedAt="2021-02-01T00:00:00.000Z")
+            changed, deleted, earliest, latest = flow_store.merge(
+                2020, 114, [updated_flow, unchanged_flow, deleted_flow]
+            )
+            assert changed == 1
+            assert deleted == 1
+            assert earliest == min(flows[1]["updatedAt"], flows[2]["updatedAt"])
+            assert latest == "2021-04-01T00:00:00.000Z"
+            stored_flows = {
+                flow["id"]: flow for flow in flow_store.get_flows(2020, 114)
+            }
+            assert len(stored_flows) == 477
+            assert stored_flows[flows[0]["id"]]["description"] == "Updated"
+            assert stored_flows[flows[0]["id"]]["boundary"] == flows[0]["boundary"]
+            assert "reportDetails" not in stored_flows[flows[0]["id"]]
+            assert flows[2]["id"] not in stored_flows
+            assert list(flow_store.get_flows(2020, 1)) == []
+
+            flowids = {int(flow["id"]) for flow in flows[3:]}
+            assert flow_store.remove_missing(2020, 114, flowids) == 2
+            assert len(list(flow_store.get_flows(2020, 114))) == 475
+            flow_store.close()
+
+    def test_flow_store_sync(self, input_dir):
+        flows = self.load_flows(input_dir, 114)
+        watermark = "2021-03-05T15:52:13.192Z"
+
+        class Downloader:
+            def __init__(self):
+                self.urls = []
+                self.flows = flows
+
+            def get_url(self, partial_url):
+                return partial_url
+
+            def iterate_flows(self, url):
+                self.urls.append(url)
+                return iter(self.flows)
+
+        downloader = Downloader()
+        with temp_dir("FTS-TEST-FLOWSTORESYNC") as folder:
+            flow_store = FlowStore(join(folder, "flows.sqlite"))
+            # The updated since parameter is ignored so the probe gets flows
+            assert flow_store.probe(downloader, 2020, 114) is False
+            assert downloader.urls[-1] == (
+                "1/fts/flow/custom-search?locationid=114&year=2020"
+                "&updatedSince=9999-12-31T00%3A00%3A00.000Z"
+            )
+            downloader.flows = []
+            assert flow_store.probe(downloader, 2020, 114) is True
+
+            # Flows are returned in the order of the search not by id
+            downloader.flows = list(reversed(flows))
+            flow_store.sync(downloader, 2020, 114)
+            assert downloader.urls[-1] == (
+                "1/fts/flow/custom-search?locationid=114&year=2020"
+            )
+            _, full_sync = flow_store.get_sync_info(2020, 114)
+            assert [flow["id"] for flow in flow_store.get_flows(2020, 114)] == [
+                flow["id"] for flow in reversed(flows)
+            ]
+
+            # A delta of flows updated since the watermark: updated flows keep
+            # their position and new ones go after those stored
+            new_flow = dict(flows[1], id="1", updatedAt="2021-04-01T00:00:00.000Z")
+            downloader.flows = [
+                new_flow,
+                dict(flows[0], updatedAt="2021-04-01T00:00:00.000Z"),
+            ]
+            flow_store.sync(downloader, 2020, 114)
+            assert downloader.urls[-1] == (
+                "1/fts/flow/custom-search?locationid=114&year=2020"
+                "&updatedSince=2021-03-05T15%3A52%3A13.192Z"
+            )
+            assert flow_store.get_sync_info(2020, 114) == (
+                "2021-04-01T00:00:00.000Z",
+                full_sync,
+            )
+            flowids = [flow["id"] for flow in flow_store.get_flows(2020, 114)]
+            assert flowids == [flow["id"] for flow in reversed(flows)] + ["1"]
+
+            # The updated since parameter is ignored so all flows are returned
+            # and the full sync puts them in its order
+            downloader.flows = flows[1:]
+            flow_store.sync(downloader, 2020, 114)
+            watermark, new_full_sync = flow_store.get_sync_info(2020, 114)
+            assert watermark == "2021-04-01T00:00:00.000Z"
+            assert new_full_sync > full_sync
+            assert [flow["id"] for flow in flow_store.get_flows(2020, 114)] == [
+                flow["id"] for flow in flows[1:]
+            ]
+            flow_store.close()
+
+    def test_flow_table(self):
+        headers = [
+            "date",
+            "amountUSD",
+            "originalAmount",
+            "exchangeRate",
+            "description",
+            "boundary",
+        ]
+        rows = [
+            ["2020-03-01", 100, "", 1, "a", "incoming"],
+            ["2020-05-01", 200, 150.5, 1.0, "b", "outgoing"],
+            ["2020-03-01", 300, None, 0.8, "c", "incoming"],
+            ["2021-01-01", 400, 10, None, "d", "incoming"],
+        ]
+        flow_table = FlowTable(headers)
+        for row in rows:
+            newrow = flow_table.new_row()
+            newrow.update(zip(headers, row))
+            flow_table.append(newrow)
+        assert flow_table.no_rows == 4
+        table = flow_table.build()
+        types = dict(zip(table.column_names, table.schema.types))
+        assert types["amountUSD"] == pyarrow.int64()
+        assert pyarrow.types.is_union(types["exchangeRate"])
+        # Only low cardinality string columns are dictionary encoded
+        assert pyarrow.types.is_dictionary(types["boundary"])
+        assert types["description"] == pyarrow.string()
+        assert FlowTable.get_min_date(
+            table, ["date"], default_enddate
+        ) == parse_iso_date("2020-03-01")
+        tables_by_boundary = FlowTable.partition(table, "boundary")
+        assert sorted(tables_by_boundary) == ["incoming", "outgoing"]
+        incoming = FlowTable.sort(tables_by_boundary["incoming"], "date", reverse=True)
+        outgoing = tables_by_boundary["outgoing"]
+        columns = FlowTable.get_columns(outgoing)
+        assert list(FlowTable.iterate_rows(outgoing.column_names, columns)) == [
+            {
+                "date": "2020-05-01",
+                "amountUSD": 200,
+                "originalAmount": 150.5,
+                "exchangeRate": 1.0,
+                "description": "b",
+                "boundary": "outgoing",
+            },
+        ]
+        with temp_dir("FTS-TEST-FLOWTABLE") as folder:
+            path = join(folder, "flows.csv")
+            columns = FlowTable.get_columns(incoming)
+            FlowTable.write_csv(incoming.column_names, columns, path)
+            with open(path, encoding="utf-8") as file:
+                assert file.read() == (
+                    "date,amountUSD,originalAmount,exchangeRate,description,boundary\n"
+                    "2021-01-01,400,10,,d,incoming\n"
+                    "2020-03-01,100,,1,a,incoming\n"
+                    "2020-03-01,300,,0.8,c,incoming\n"
+                )
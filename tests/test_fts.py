@@ -15,6 +15,7 @@ from hdx.utilities.dateparse import parse_date
 from hdx.utilities.downloader import Download
 from hdx.utilities.path import temp_dir
 
+from hdx.scraper.fts.country_executor import CountryExecutor
 from hdx.scraper.fts.dataset_generator import DatasetGenerator
 from hdx.scraper.fts.download import FTSDownload
 from hdx.scraper.fts.hapi_output import HAPIOutput
@@ -461,3 +462,80 @@ class TestFTS:
                         join("tests", "fixtures", "hdx_hapi_funding_global.csv"),
                         join(folder, "hdx_hapi_funding_global.csv"),
                     )
+
+    def test_generate_datasets_concurrently(self, configuration, read_dataset):
+        with temp_dir("FTS-TEST-CONCURRENT", delete_on_failure=False) as folder:
+            with Download(user_agent="test") as downloader:
+                ftsdownloader = FTSDownload(configuration, downloader, testpath=True)
+                today = parse_date("2020-12-31")
+                locations = Locations(ftsdownloader)
+                pipeline = Pipeline(
+                    configuration,
+                    ftsdownloader,
+                    folder,
+                    locations,
+                    today,
+                    start_year=2019,
+                )
+                dataset_generator = DatasetGenerator(
+                    today, configuration["notes"], ("covid-19",)
+                )
+
+                def generate_country(country):
+                    dataset, _ = dataset_generator.get_country_dataset_and_showcase(
+                        country
+                    )
+                    pipeline.generate_country_dataset_and_showcase(country, dataset)
+                    return dataset
+
+                with CountryExecutor(
+                    generate_country, locations.countries, max_workers=3
+                ) as country_executor:
+                    for country in locations.countries:
+                        dataset = country_executor.get(country)
+                        for resource in dataset.get_resources():
+                            resource_name = resource["name"]
+                            assert_files_same(
+                                join("tests", "fixtures", resource_name),
+                                join(folder, resource_name),
+                            )
+
+                global_dataset = dataset_generator.get_global_dataset()
+                pipeline.generate_global_dataset(global_dataset)
+                for resource in global_dataset.get_resources():
+                    resource_name = resource["name"]
+                    assert_files_same(
+                        join("tests", "fixtures", resource_name),
+                        join(folder, resource_name),
+                    )
+
+    def test_requested_years(self, configuration, read_dataset):
+        # Only 2020 plans are in the fixtures so other years must not be queried
+        with temp_dir("FTS-TEST-YEARS", delete_on_failure=False) as folder:
+            with Download(user_agent="test") as downloader:
+                ftsdownloader = FTSDownload(
+                    configuration, downloader, years="2020", testpath=True
+                )
+                assert ftsdownloader.get_years() == {"2020"}
+                assert ftsdownloader.get_countryiso3s() is None
+                today = parse_date("2020-12-31")
+                locations = Locations(ftsdownloader)
+                pipeline = Pipeline(
+                    configuration,
+                    ftsdownloader,
+                    folder,
+                    locations,
+                    today,
+                    start_year=2015,
+                )
+                dataset_generator = DatasetGenerator(
+                    today, configuration["notes"], ("covid-19",)
+                )
+                country = locations.countries[0]
+                dataset, _ = dataset_generator.get_country_dataset_and_showcase(country)
+                pipeline.generate_country_dataset_and_showcase(country, dataset)
+                resource_name = "fts_requirements_funding_afg.csv"
+                assert_files_same(
+                    join("tests", "fixtures", resource_name),
+                    join(folder, resource_name),
+                )
@@ -0,0 +1,92 @@
+"""
+Unit tests for FTS run ledger.
+
+"""
+
+from datetime import datetime
+from os.path import join
+
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.fts.compare_runs import main
+from hdx.scraper.fts.download_stats import DownloadStats
+from hdx.scraper.fts.run_ledger import RunLedger
+
+
+class TestRunLedger:
+    flows_url = "https://api.hpc.tools/v1/fts/flow/custom-search?locationid=1&year=2020"
+
+    def get_record(self, folder, day, pages, afg_seconds, status="success"):
+        timings = {
+            "country": {
+                "seconds": afg_seconds + 5,
+                "calls": 2,
+                "items": {"AFG": afg_seconds, "JOR": 5},
+            }
+        }
+        download_stats = DownloadStats()
+        download_stats.record_cached("https://api.hpc.tools/v1/public/location")
+        for _ in range(pages):
+            download_stats.record_request(self.flows_url, 1, 1000)
+        download_stats.record_pages(self.flows_url, pages)
+        return RunLedger.create_record(
+            datetime(2025, 1, day),
+            100 + afg_seconds,
+            timings,
+            download_stats,
+            folder,
+            status=status,
+        )
+
+    def test_run_ledger(self, fixtures_dir, capsys):
+        record = self.get_record(fixtures_dir, 1, 3, 10)
+        assert record["started_at"] == "2025-01-01T00:00:00"
+        assert record["status"] == "success"
+        assert record["countries"] == {"AFG": 10, "JOR": 5}
+        assert record["stages"] == {"country": 15}
+        assert record["requests"] == 3
+        assert record["bytes"] == 3000
+        assert record["cache_hit_rate"] == 0.25
+        assert record["peak_rss_mb"] > 0
+        assert record["endpoints"]["flows_by_location"]["pages"] == 3
+        assert record["searches"] == {"custom-search?locationid=1&year=2020": 3}
+        assert record["rows"]["fts_requirements_funding_afg.csv"] == 3
+
+        with temp_dir("FTS-RUN-LEDGER", delete_on_success=True) as folder:
+            path = join(folder, "runs.sqlite")
+            ledger = RunLedger(path, keep_runs=7)
+            assert ledger.compare() == (None, 0, [])
+            for day in range(1, 10):
+                ledger.add_run(self.get_record(fixtures_dir, day, 3, 10 + day % 2))
+            runs = ledger.get_runs()
+            assert len(runs) == 7
+            assert runs[0]["started_at"] == "2025-01-09T00:00:00"
+            latest, no_baseline_runs, jumps = ledger.compare(baseline_runs=3)
+            assert latest == runs[0]
+            assert no_baseline_runs == 3
+            assert jumps == []
+
+            # Failed and interrupted runs stop early and are not baselines
+            ledger.add_run(self.get_record(fixtures_dir, 10, 1, 1, status="failed"))
+            ledger.add_run(
+                self.get_record(fixtures_dir, 11, 1, 1, status="interrupted")
+            )
+            ledger.add_run(self.get_record(fixtures_dir, 12, 6, 40))
+            latest, no_baseline_runs, jumps = ledger.compare(baseline_runs=3)
+            assert no_baseline_runs == 3
+            assert [jump[:3] for jump in jumps] == [
+                ("country", "AFG", "seconds"),
+                ("stage", "country", "seconds"),
+                ("endpoint", "flows_by_location", "requests"),
+                ("endpoint", "flows_by_location", "seconds"),
+                ("endpoint", "flows_by_location", "pages"),
+                ("search", "custom-search?locationid=1&year=2020", "pages"),
+            ]
+            assert jumps[0][3:] == (40, 11)
+            ledger.close()
+
+            assert main([path, "--baseline-runs", "3", "--top", "2"]) == 1
+            output = capsys.readouterr().out
+            assert "Jumps against median of 3 earlier successful runs:" in output
+            assert "country AFG: 40.0s vs 11.0s" in output
+            assert "... and 4 more" in output
@@ -0,0 +1,68 @@
+"""
+Unit tests for FTS run profiler.
+
+"""
+
+import pstats
+from json import load
+from os.path import join
+from threading import Thread
+
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.fts.run_profiler import RunProfiler
+
+
+class TestRunProfiler:
+    def test_run_profiler(self):
+        profiler = RunProfiler()
+        with profiler.measure("plans"):
+            with profiler.measure("covid_funding"):
+                pass
+        for iso3 in ("AFG", "JOR", "AFG"):
+            with profiler.measure("country", iso3):
+                pass
+        timings = profiler.get_timings()
+        assert list(timings) == ["covid_funding", "plans", "country"]
+        assert timings["plans"]["calls"] == 1
+        assert timings["country"]["calls"] == 3
+        assert sorted(timings["country"]["items"]) == ["AFG", "JOR"]
+        assert "items" not in timings["plans"]
+
+    def test_profile(self):
+        with temp_dir("FTS-PROFILE", delete_on_success=True) as folder:
+            profiler = RunProfiler(folder, profile=True, top=5)
+            kept = []
+
+            def make_strings():
+                return [str(i) * 10 for i in range(10000)]
+
+            def generate(iso3):
+                with profiler.measure("country", iso3):
+                    kept.append(make_strings())
+
+            with profiler.measure("global"):
+                with profiler.measure("hapi"):
+                    generate("AFG")
+            threads = [Thread(target=generate, args=(iso3,)) for iso3 in ("JOR", "PSE")]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            profiler.write()
+            profiler.close()
+            with open(join(folder, "timings.json")) as file:
+                timings = load(file)
+            assert sorted(timings) == ["country", "global", "hapi"]
+            assert timings["country"]["calls"] == 3
+            # Nested stages and stages in every thread are profiled
+            for stage in ("global", "hapi"):
+                stats = pstats.Stats(join(folder, f"{stage}.prof"))
+                assert any(function[2] == "generate" for function in stats.stats)
+            stats = pstats.Stats(join(folder, "country.prof"))
+            calls = {function[2]: stat[1] for function, stat in stats.stats.items()}
+            assert calls["make_strings"] == 3
+            with open(join(folder, "global.txt")) as file:
+                text = file.read()
+            allocations = text.split("Top 5 allocations:\n")[1]
+            assert "test_run_profiler.py" in allocations.split("\n")[0]